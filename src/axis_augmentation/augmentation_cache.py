@@ -0,0 +1,303 @@
+"""
+Memoization cache for the stages of the augmentation pipeline.
+"""
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.utils.constants import AugmentationCacheConstants
+
+# Scalars whose repr is stable across processes and identifies their value
+_SCALAR_TYPES = (type(None), bool, int, float, complex)
+
+
+class UncacheableValueError(TypeError):
+    """A value has no stable digest, so the augmenter calls that depend on it cannot be cached."""
+
+
+def _update_digest(hasher, value: Any, memo: Optional[Dict[int, bytes]] = None):
+    """
+    Feed a value into a hash in a stable, type-tagged way.
+
+    Args:
+        hasher: A hashlib hash object.
+        value: The value to hash: dicts, lists, tuples, sets, DataFrames, Series, arrays, strings,
+            bytes and numeric scalars are supported.
+        memo: Optional digests of the DataFrames already hashed, by id, so a DataFrame shared by
+            many values is only hashed once. The DataFrames must outlive the memo.
+
+    Raises:
+        UncacheableValueError: If the value (or a value it contains) has another type, whose repr
+            may embed a memory address or collide with a different value.
+    """
+    if isinstance(value, dict):
+        hasher.update(b"{")
+        for key in sorted(value, key=repr):
+            _update_digest(hasher, key, memo)
+            _update_digest(hasher, value[key], memo)
+        hasher.update(b"}")
+    elif isinstance(value, (list, tuple)):
+        hasher.update(b"[" if isinstance(value, list) else b"(")
+        for item in value:
+            _update_digest(hasher, item, memo)
+        hasher.update(b"]")
+    elif isinstance(value, (set, frozenset)):
+        hasher.update(b"<")
+        for item_digest in sorted(digest(item, memo) for item in value):
+            hasher.update(item_digest.encode())
+        hasher.update(b">")
+    elif isinstance(value, pd.DataFrame):
+        frame_digest = memo.get(id(value)) if memo is not None else None
+        if frame_digest is None:
+            frame_hasher = hashlib.sha256()
+            _update_digest(frame_hasher, [str(column) for column in value.columns])
+            frame_hasher.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+            frame_digest = frame_hasher.digest()
+            if memo is not None:
+                memo[id(value)] = frame_digest
+        hasher.update(b"df" + frame_digest)
+    elif isinstance(value, pd.Series):
+        hasher.update(b"ps" + str(value.name).encode("utf-8"))
+        hasher.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+    elif isinstance(value, np.ndarray):
+        if value.dtype == object:
+            raise UncacheableValueError("Object arrays have no stable digest")
+        hasher.update(b"nd" + str(value.dtype).encode() + str(value.shape).encode())
+        hasher.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, str):
+        hasher.update(b"s" + str(len(value)).encode() + b":" + value.encode("utf-8"))
+    elif isinstance(value, bytes):
+        hasher.update(b"b" + str(len(value)).encode() + b":" + value)
+    elif isinstance(value, np.generic):
+        _update_digest(hasher, value.item(), memo)
+    elif isinstance(value, _SCALAR_TYPES):
+        hasher.update(b"r" + repr(value).encode("utf-8"))
+    else:
+        raise UncacheableValueError(f"Values of type {type(value).__name__} have no stable digest")
+
+
+def digest(value: Any, memo: Optional[Dict[int, bytes]] = None) -> str:
+    """Return a stable hex digest of a value (see _update_digest for memo and the supported types)."""
+    hasher = hashlib.sha256()
+    _update_digest(hasher, value, memo)
+    return hasher.hexdigest()
+
+
+def _entry_size(value: List[str]) -> int:
+    """Approximate memory footprint of a cached entry in bytes."""
+    return sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value)
+
+
+class AugmentationCache:
+    """
+    Two-tier cache of augmenter outputs.
+
+    Entries are keyed by the augmenter class, its configuration (n_augments, num_examples,
+    seed, ...), the input text and a digest of the identification data; calls whose augmenter
+    or identification data has no stable digest are not cached (see UncacheableValueError).
+    The in-memory tier is an LRU bounded by the approximate size of its entries; the optional
+    on-disk tier is a SQLite file that survives restarts, whose entries expire after
+    disk_ttl_seconds and whose least recently used entries are evicted beyond max_disk_entries.
+    Hit, miss and eviction counters are exposed through stats() so the cache can be sized.
+    """
+
+    def __init__(self, max_memory_bytes: int = AugmentationCacheConstants.DEFAULT_MAX_MEMORY_BYTES,
+                 disk_path: Optional[str] = None,
+                 disk_ttl_seconds: Optional[float] = AugmentationCacheConstants.DEFAULT_DISK_TTL_SECONDS,
+                 max_disk_entries: Optional[int] = AugmentationCacheConstants.DEFAULT_MAX_DISK_ENTRIES):
+        """
+        Initialize the cache.
+
+        Args:
+            max_memory_bytes: Maximum approximate size of the in-memory tier.
+            disk_path: Optional path of the SQLite file of the on-disk tier.
+            disk_ttl_seconds: Time to live of the on-disk entries (None for no expiry).
+            max_disk_entries: Maximum number of on-disk entries (None for no limit).
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_path = disk_path
+        self.disk_ttl_seconds = disk_ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._disk_puts = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        self._connection = None
+        if disk_path:
+            self._connection = sqlite3.connect(disk_path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS augmentations (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created REAL NOT NULL DEFAULT 0, accessed REAL NOT NULL DEFAULT 0)")
+            # Files written before the entries were timestamped get the columns, as expired entries
+            columns = {row[1] for row in self._connection.execute("PRAGMA table_info(augmentations)")}
+            for column in ("created", "accessed"):
+                if column not in columns:
+                    self._connection.execute(
+                        f"ALTER TABLE augmentations ADD COLUMN {column} REAL NOT NULL DEFAULT 0")
+            self._connection.commit()
+            with self._lock:
+                self._evict_from_disk()
+
+    @staticmethod
+    def augmenter_digest(augmenter) -> str:
+        """
+        Digest of an augmenter's class and configuration.
+
+        Args:
+            augmenter: The augmenter.
+
+        Returns:
+            Hex digest identifying the augmenter's behaviour.
+        """
+        augmenter_class = type(augmenter)
+        config = augmenter.get_cache_config() if hasattr(augmenter, "get_cache_config") else vars(augmenter)
+        return digest([f"{augmenter_class.__module__}.{augmenter_class.__qualname__}", config])
+
+    @staticmethod
+    def identification_digest(identification_data: Optional[Dict[str, Any]],
+                              memo: Optional[Dict[int, bytes]] = None) -> str:
+        """Digest of the identification data passed to a stage (see _update_digest for memo)."""
+        return digest(identification_data, memo)
+
+    @staticmethod
+    def make_key(augmenter_digest: str, identification_digest: str, text: str) -> str:
+        """
+        Build the cache key of a single augmenter call.
+
+        Args:
+            augmenter_digest: Result of augmenter_digest.
+            identification_digest: Result of identification_digest.
+            text: The input text.
+
+        Returns:
+            The cache key.
+        """
+        return digest([augmenter_digest, identification_digest, text])
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """
+        Look up an entry, promoting on-disk hits to the in-memory tier.
+
+        Args:
+            key: The cache key.
+
+        Returns:
+            A copy of the cached outputs, or None on a miss.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(value)
+            if self._connection is not None:
+                row = self._connection.execute("SELECT value FROM augmentations WHERE key = ? AND created >= ?",
+                                               (key, self._disk_cutoff())).fetchone()
+                if row is not None:
+                    self._connection.execute("UPDATE augmentations SET accessed = ? WHERE key = ?",
+                                             (time.time(), key))
+                    self._connection.commit()
+                    value = json.loads(row[0])
+                    self._store_in_memory(key, value)
+                    self.disk_hits += 1
+                    return list(value)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: List[str]):
+        """
+        Store an entry in both tiers.
+
+        Args:
+            key: The cache key.
+            value: The augmenter outputs.
+        """
+        value = list(value)
+        with self._lock:
+            self._store_in_memory(key, value)
+            if self._connection is not None:
+                now = time.time()
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO augmentations (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), now, now))
+                self._connection.commit()
+                self._disk_puts += 1
+                if self._disk_puts % AugmentationCacheConstants.EVICTION_INTERVAL == 0:
+                    self._evict_from_disk()
+
+    def _disk_cutoff(self) -> float:
+        """Creation time before which on-disk entries are expired."""
+        return time.time() - self.disk_ttl_seconds if self.disk_ttl_seconds is not None else float("-inf")
+
+    def _evict_from_disk(self):
+        """Delete the expired on-disk entries and the least recently used ones beyond max_disk_entries."""
+        deleted = 0
+        if self.disk_ttl_seconds is not None:
+            deleted += self._connection.execute("DELETE FROM augmentations WHERE created < ?",
+                                                (self._disk_cutoff(),)).rowcount
+        if self.max_disk_entries is not None:
+            (n_entries,) = self._connection.execute("SELECT COUNT(*) FROM augmentations").fetchone()
+            if n_entries > self.max_disk_entries:
+                deleted += self._connection.execute(
+                    "DELETE FROM augmentations WHERE rowid IN "
+                    "(SELECT rowid FROM augmentations ORDER BY accessed LIMIT ?)",
+                    (n_entries - self.max_disk_entries,)).rowcount
+        self._connection.commit()
+        self.disk_evictions += deleted
+
+    def _store_in_memory(self, key: str, value: List[str]):
+        """Insert an entry in the LRU tier and evict the least recently used entries if it is too big."""
+        if key in self._entries:
+            self._memory_bytes -= _entry_size(self._entries.pop(key))
+        size = _entry_size(value)
+        if size > self.max_memory_bytes:
+            return
+        self._entries[key] = value
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_bytes -= _entry_size(evicted)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cache counters and the current size of the in-memory tier."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "entries": len(self._entries),
+                "memory_bytes": self._memory_bytes,
+            }
+
+    def clear(self):
+        """Empty both tiers and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+            self.hits = self.disk_hits = self.misses = self.evictions = self.disk_evictions = 0
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM augmentations")
+                self._connection.commit()
+
+    def close(self):
+        """Close the on-disk tier."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
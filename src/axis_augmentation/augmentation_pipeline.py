@@ -1,9 +1,21 @@
 """
 Augmentation pipeline that combines multiple augmentation methods.
 """
+import asyncio
+import inspect
+import itertools
+import logging
+import math
+import os
 import random
-from typing import List, Optional, Dict, Any
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
+import numpy as np
+
+from src.axis_augmentation.augmentation_cache import AugmentationCache, UncacheableValueError
 from src.axis_augmentation.base_augmenter import BaseAxisAugmenter
 from src.axis_augmentation.text_surface_augmenter import TextSurfaceAugmenter
 from src.axis_augmentation.context_augmenter import ContextAugmenter
@@ -11,23 +23,340 @@ from src.axis_augmentation.multiple_choice_augmenter import MultipleChoiceAugmen
 from src.axis_augmentation.paraphrase_instruct import Paraphrase
 from src.axis_augmentation.fewshot_augmenter import FewShotAugmenter
 from src.axis_augmentation.multidoc_augmenter import MultiDocAugmenter
+from src.utils.constants import AugmentationPipelineConstants
+from src.utils.instrumentation import Instrumentation, get_instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+def _call_with_text(augmenter: BaseAxisAugmenter, text: str, identification_data: Dict[str, Any] = None) -> List[str]:
+    """Call augment with the text only."""
+    return augmenter.augment(text)
+
+
+def _call_with_data(augmenter: BaseAxisAugmenter, text: str, identification_data: Dict[str, Any] = None) -> List[str]:
+    """Call augment with the text and the identification data."""
+    return augmenter.augment(text, identification_data)
+
+
+def _call_with_data_or_original(augmenter: BaseAxisAugmenter, text: str,
+                                identification_data: Dict[str, Any] = None) -> List[str]:
+    """Call augment with the identification data, or return the original text if there is none."""
+    # FewShotAugmenter needs example pairs in identification_data
+    if identification_data:
+        return augmenter.augment(text, identification_data)
+    return [text]
+
+
+def _call_with_docs(augmenter: MultiDocAugmenter, text: str, identification_data: Dict[str, Any] = None) -> List[str]:
+    """Permute and concatenate the documents of the identification data, or return the original text."""
+    # MultiDocAugmenter works with lists of documents
+    if identification_data and "docs" in identification_data:
+        permutations = augmenter.permute_docs_order(identification_data["docs"], n_permutations=augmenter.n_augments)
+        concat_type = identification_data.get("concat_type", "single_doc")
+        return [augmenter.concatenate_docs(perm, concat_type) for perm in permutations]
+    return [text]
+
+
+def _return_original(augmenter: Any, text: str, identification_data: Dict[str, Any] = None) -> List[str]:
+    """Return the original text, for objects without an augment method."""
+    return [text]
+
+
+def _accepts_positional_args(function, n_args: int) -> bool:
+    """Check whether a callable can be called with n_args positional arguments."""
+    try:
+        inspect.signature(function).bind(*([None] * n_args))
+    except TypeError:
+        return False
+    return True
+
+
+class InvocationPlan:
+    """
+    Precompiled way of calling an augmenter.
+
+    The interface an augmenter supports (which augment signature to call, which identification_data
+    keys to extract, whether it can stream its outputs or has a native aaugment) is resolved once
+    by compile_invocation_plan, so calling the plan is a direct call. Plans are picklable, so they
+    can be shipped to process pool workers.
+    """
+
+    def __init__(self, augmenter: BaseAxisAugmenter, call, streaming: bool = False,
+                 native_async: bool = False, async_with_data: bool = True):
+        """
+        Initialize the plan.
+
+        Args:
+            augmenter: The augmenter
+            call: Module-level function calling the augmenter as call(augmenter, text, identification_data)
+            streaming: Whether the augmenter generates its variations lazily through iter_augment
+            native_async: Whether the augmenter has its own aaugment implementation
+            async_with_data: Whether the native aaugment is given the identification data
+        """
+        self.augmenter = augmenter
+        self.call = call
+        self.streaming = streaming
+        self.native_async = native_async
+        self.async_with_data = async_with_data
+
+    def __call__(self, text: str, identification_data: Dict[str, Any] = None) -> List[str]:
+        return self.call(self.augmenter, text, identification_data)
+
+    def iter(self, text: str, identification_data: Dict[str, Any] = None) -> Iterator[str]:
+        """Lazily call the augmenter, streaming its outputs if it supports it."""
+        if self.streaming:
+            return self.augmenter.iter_augment(text)
+        return iter(self.call(self.augmenter, text, identification_data))
+
+    async def acall(self, text: str, identification_data: Dict[str, Any] = None) -> List[str]:
+        """Async call: native aaugment implementations are awaited, the others run in a worker thread."""
+        if not self.native_async:
+            return await asyncio.to_thread(self.call, self.augmenter, text, identification_data)
+        if self.async_with_data:
+            return await self.augmenter.aaugment(text, identification_data)
+        return await self.augmenter.aaugment(text)
+
+
+def compile_invocation_plan(augmenter: BaseAxisAugmenter) -> InvocationPlan:
+    """
+    Resolve the interface of an augmenter into an invocation plan.
+
+    Args:
+        augmenter: The augmenter
+
+    Returns:
+        The invocation plan of the augmenter
+
+    Raises:
+        TypeError: If the augmenter's augment method can be called neither with the text
+            nor with the text and the identification data.
+    """
+    native_async = getattr(type(augmenter), "aaugment", BaseAxisAugmenter.aaugment) is not BaseAxisAugmenter.aaugment
+
+    if isinstance(augmenter, Paraphrase):
+        return InvocationPlan(augmenter, _call_with_text, native_async=native_async, async_with_data=False)
+    if isinstance(augmenter, TextSurfaceAugmenter):
+        return InvocationPlan(augmenter, _call_with_text, streaming=True, native_async=native_async)
+    if isinstance(augmenter, ContextAugmenter):
+        return InvocationPlan(augmenter, _call_with_text, native_async=native_async)
+    if isinstance(augmenter, FewShotAugmenter):
+        return InvocationPlan(augmenter, _call_with_data_or_original, native_async=native_async)
+    if isinstance(augmenter, MultiDocAugmenter):
+        return InvocationPlan(augmenter, _call_with_docs, native_async=native_async)
+    # MultipleChoiceAugmenter and the other augmenters take the identification data if their signature allows it
+    if not callable(getattr(augmenter, "augment", None)):
+        return InvocationPlan(augmenter, _return_original)
+    if _accepts_positional_args(augmenter.augment, 2):
+        return InvocationPlan(augmenter, _call_with_data, native_async=native_async)
+    if _accepts_positional_args(augmenter.augment, 1):
+        return InvocationPlan(augmenter, _call_with_text, native_async=native_async, async_with_data=False)
+    raise TypeError(f"{augmenter.__class__.__name__}.augment must accept the text, "
+                    f"optionally followed by the identification data")
+
+
+def invoke_augmenter(augmenter: BaseAxisAugmenter, text: str, identification_data: Dict[str, Any] = None) -> List[str]:
+    """
+    Call an augmenter on a text through the interface it supports.
+
+    The pipeline compiles the invocation plans of its augmenters once; this helper compiles
+    the plan on every call and is meant for one-off calls.
+
+    Args:
+        augmenter: The augmenter to apply
+        text: The text to augment
+        identification_data: Optional identification data for augmenters that need it
+
+    Returns:
+        List of augmented texts
+    """
+    return compile_invocation_plan(augmenter)(text, identification_data)
+
+
+def timed_invoke(plan: InvocationPlan, text: str,
+                 identification_data: Dict[str, Any] = None) -> Tuple[List[str], float]:
+    """
+    Call an invocation plan and measure the latency of the call.
+
+    This is a module-level function so that it can be shipped to process pool workers.
+
+    Args:
+        plan: The invocation plan of the augmenter
+        text: The text to augment
+        identification_data: Optional identification data for augmenters that need it
+
+    Returns:
+        The augmented texts and the latency of the call in seconds
+    """
+    start = time.perf_counter()
+    augmented = plan(text, identification_data)
+    return augmented, time.perf_counter() - start
+
+
+def reservoir_sample(items: Iterable[str], k: int, rng: random.Random) -> List[str]:
+    """
+    Uniformly sample up to k items from a stream in a single pass (Algorithm R).
+
+    Only the reservoir is kept in memory. If the stream has at most k items they are all returned
+    in stream order; otherwise the sample is shuffled, so the result is distributed like
+    rng.sample(list(items), k).
+
+    Args:
+        items: The stream of items
+        k: The size of the reservoir
+        rng: The random generator used for sampling
+
+    Returns:
+        List of at most k items
+    """
+    reservoir = []
+    count = 0
+    for count, item in enumerate(items, start=1):
+        if count <= k:
+            reservoir.append(item)
+        else:
+            j = rng.randrange(count)
+            if j < k:
+                reservoir[j] = item
+    if count > k:
+        rng.shuffle(reservoir)
+    return reservoir
+
+
+def deduplicate_calls(texts: List[str], identification_data_list: List[Optional[Dict[str, Any]]]
+                      ) -> Tuple[List[str], List[Optional[Dict[str, Any]]], List[int]]:
+    """
+    Collapse the calls of a stage that have the same text and identification data.
+
+    Args:
+        texts: The input text of every call
+        identification_data_list: The identification data of every call
+
+    Returns:
+        The distinct texts, their identification data, and for every call the position of its distinct call
+    """
+    seen = {}
+    unique_texts = []
+    unique_data = []
+    positions = []
+    for text, identification_data in zip(texts, identification_data_list):
+        # Identification data objects are shared by all the variations of a text, so identity is enough
+        key = (text, id(identification_data))
+        position = seen.get(key)
+        if position is None:
+            position = seen[key] = len(unique_texts)
+            unique_texts.append(text)
+            unique_data.append(identification_data)
+        positions.append(position)
+    return unique_texts, unique_data, positions
+
+
+def expand_results(results: Iterable[Iterable[str]], positions: List[int]) -> Iterator[Iterable[str]]:
+    """
+    Map the results of the distinct calls back to every call, in call order.
+
+    Results are consumed lazily; only the results of calls that are still to be repeated are kept.
+
+    Args:
+        results: The outputs of each distinct call, in order (see deduplicate_calls)
+        positions: For every call, the position of its distinct call
+
+    Returns:
+        Iterator over the outputs of every call
+    """
+    remaining = [0] * (max(positions) + 1 if positions else 0)
+    for position in positions:
+        remaining[position] += 1
+
+    results = iter(results)
+    pending = {}
+    next_position = 0
+    for position in positions:
+        if position == next_position:
+            augmented = next(results)
+            next_position += 1
+            if remaining[position] > 1:
+                augmented = pending[position] = list(augmented)
+        else:
+            augmented = pending[position]
+        remaining[position] -= 1
+        if not remaining[position]:
+            pending.pop(position, None)
+        yield augmented
+
+
+async def ainvoke_augmenter(augmenter: BaseAxisAugmenter, text: str,
+                            identification_data: Dict[str, Any] = None) -> List[str]:
+    """
+    Async counterpart of invoke_augmenter.
+
+    Augmenters with a native aaugment (the LLM-backed ones) are awaited directly; the others
+    are adapted by running their invocation plan in a worker thread.
+
+    Args:
+        augmenter: The augmenter to apply
+        text: The text to augment
+        identification_data: Optional identification data for augmenters that need it
+
+    Returns:
+        List of augmented texts
+    """
+    return await compile_invocation_plan(augmenter).acall(text, identification_data)
 
 
 class AugmentationPipeline:
     """
     A pipeline that applies multiple augmentation methods sequentially.
     Each augmenter in the pipeline processes all variations produced by the previous augmenter.
+
+    The variations of a stage can be processed concurrently in a thread or process pool,
+    or on an event loop with aaugment; outputs are always collected in input order, so
+    results match a serial run.
     """
 
-    def __init__(self, augmenters: Optional[List[BaseAxisAugmenter]] = None, max_variations: int = 100):
+    def __init__(self, augmenters: Optional[List[BaseAxisAugmenter]] = None, max_variations: int = 100,
+                 seed: Optional[int] = None, executor: str = AugmentationPipelineConstants.SERIAL_EXECUTOR,
+                 max_workers: Optional[int] = None,
+                 max_concurrency: int = AugmentationPipelineConstants.DEFAULT_MAX_CONCURRENCY,
+                 cache: Optional[AugmentationCache] = None, budget_aware: bool = False,
+                 fanout_history: Optional[Dict[str, List[int]]] = None,
+                 instrumentation: Optional[Instrumentation] = None):
         """
         Initialize the augmentation pipeline.
 
         Args:
             augmenters: List of augmenters to apply in sequence. If None, a default set will be used.
             max_variations: Maximum number of variations to generate in total.
+            seed: Root seed of the pipeline. If given, every augmenter is re-rooted on a stream
+                spawned from it, so the whole pipeline is reproducible.
+            executor: How each stage processes its input variations: "serial", "thread", "process",
+                or "auto" (threads for I/O-bound augmenters, processes for CPU-bound ones).
+            max_workers: Maximum number of workers of the pools (defaults to the executor's default).
+            max_concurrency: Maximum number of augmenter calls in flight at once in aaugment,
+                shared by all the aaugment calls running on the same event loop.
+            cache: Optional AugmentationCache memoizing augmenter calls. It can be shared between
+                pipelines, e.g. to reuse the augmentations of a text occurring in many annotations.
+            budget_aware: If True, every stage only receives as many input variations as needed for
+                the pipeline to end with about max_variations variations (see plan), instead of
+                generating max_variations variations at every stage and discarding the excess.
+            fanout_history: Optional mapping from augmenter to its observed [inputs, outputs] counts,
+                used by the planner. It can be shared between pipelines to accumulate observations.
+            instrumentation: Optional Instrumentation receiving the stage and call metrics. Defaults
+                to the process-wide instrumentation; without one, nothing is measured.
         """
+        if executor not in AugmentationPipelineConstants.EXECUTORS:
+            raise ValueError(f"Invalid executor: {executor}. Choose from: {AugmentationPipelineConstants.EXECUTORS}")
         self.max_variations = max_variations
+        self.executor = executor
+        self.max_workers = max_workers
+        self._executors = {}
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._semaphore_loop = None
+        self.cache = cache
+        self.budget_aware = budget_aware
+        self.fanout_history = fanout_history if fanout_history is not None else {}
+        self.instrumentation = instrumentation if instrumentation is not None else get_instrumentation()
 
         # Use provided augmenters or create default ones
         if augmenters is not None:
@@ -38,6 +367,117 @@ class AugmentationPipeline:
                 ContextAugmenter(n_augments=2)
             ]
 
+        # Spawn one independent stream per augmenter, plus one for the pipeline's own sampling
+        root = np.random.SeedSequence(seed)
+        children = root.spawn(len(self.augmenters) + 1)
+        if seed is not None:
+            for augmenter, child in zip(self.augmenters, children):
+                if isinstance(augmenter, BaseAxisAugmenter):
+                    augmenter.set_seed_sequence(child)
+        # Resolve how every augmenter is called once, instead of on every call
+        self._invocation_plans = {id(augmenter): compile_invocation_plan(augmenter) for augmenter in self.augmenters}
+        self.rng = random.Random(int.from_bytes(children[-1].generate_state(4, np.uint64).tobytes(), "little"))
+
+    @staticmethod
+    def _get_fanout_key(augmenter: BaseAxisAugmenter) -> str:
+        """Get the key of an augmenter in the fan-out history."""
+        return f"{augmenter.__class__.__name__}(n_augments={getattr(augmenter, 'n_augments', None)})"
+
+    def _record_fanout(self, augmenter: BaseAxisAugmenter, n_inputs: int, n_outputs: int):
+        """Add the input and output counts of a stage to the fan-out history."""
+        counts = self.fanout_history.setdefault(self._get_fanout_key(augmenter), [0, 0])
+        counts[0] += n_inputs
+        counts[1] += n_outputs
+
+    def get_expected_fanout(self, augmenter: BaseAxisAugmenter) -> Dict[str, Any]:
+        """
+        Estimate the number of output variations an augmenter produces per input variation.
+
+        Args:
+            augmenter: The augmenter
+
+        Returns:
+            Dictionary with the expected fan-out and its source ("observed" or "n_augments")
+        """
+        n_inputs, n_outputs = self.fanout_history.get(self._get_fanout_key(augmenter), (0, 0))
+        if n_inputs >= AugmentationPipelineConstants.MIN_FANOUT_OBSERVATIONS:
+            return {"fanout": max(n_outputs / n_inputs, 1.0), "source": "observed"}
+        return {"fanout": float(max(getattr(augmenter, "n_augments", 1), 1)), "source": "n_augments"}
+
+    def plan(self) -> List[Dict[str, Any]]:
+        """
+        Plan how many input variations each stage receives.
+
+        A stage whose inputs are expected to fan out by a factor F through it and all the stages
+        after it only needs ceil(max_variations / F) inputs for the pipeline to end with about
+        max_variations variations. Without budget_aware, every stage receives up to max_variations.
+
+        Returns:
+            One dictionary per stage with the augmenter name, its expected fan-out and the source
+            of the estimate, its input budget and its expected number of outputs
+        """
+        fanouts = [self.get_expected_fanout(augmenter) for augmenter in self.augmenters]
+        stages = []
+        downstream = 1.0
+        for augmenter, fanout in reversed(list(zip(self.augmenters, fanouts))):
+            downstream *= fanout["fanout"]
+            input_budget = self.max_variations
+            if self.budget_aware:
+                input_budget = min(self.max_variations, max(1, math.ceil(self.max_variations / downstream)))
+            stages.append({
+                "augmenter": augmenter.__class__.__name__,
+                "expected_fanout": fanout["fanout"],
+                "fanout_source": fanout["source"],
+                "input_budget": input_budget,
+            })
+        stages.reverse()
+
+        # The first stage only ever receives the original text
+        n_inputs = 1
+        for stage in stages:
+            n_inputs = min(n_inputs, stage["input_budget"])
+            stage["expected_inputs"] = n_inputs
+            stage["expected_outputs"] = min(n_inputs * stage["expected_fanout"], self.max_variations)
+            n_inputs = stage["expected_outputs"]
+        return stages
+
+    def dry_run(self) -> List[Dict[str, Any]]:
+        """
+        Print the plan of the pipeline without calling any augmenter.
+
+        Returns:
+            The plan (see plan)
+        """
+        stages = self.plan()
+        print(f"Pipeline plan (max_variations={self.max_variations}, budget_aware={self.budget_aware}):")
+        for i, stage in enumerate(stages):
+            print(f"  {i + 1}. {stage['augmenter']}: expected fan-out {stage['expected_fanout']:.2f} "
+                  f"({stage['fanout_source']}), input budget {stage['input_budget']}, "
+                  f"expected inputs {stage['expected_inputs']:.0f}, expected outputs {stage['expected_outputs']:.0f}")
+        return stages
+
+    def _get_output_sizes(self) -> List[int]:
+        """Get the number of variations kept after each stage: the input budget of the next stage."""
+        if not self.budget_aware:
+            return [self.max_variations] * len(self.augmenters)
+        budgets = [stage["input_budget"] for stage in self.plan()]
+        return budgets[1:] + [self.max_variations]
+
+    def get_invocation_plan(self, augmenter: BaseAxisAugmenter) -> InvocationPlan:
+        """
+        Get the invocation plan of an augmenter, compiling it if the augmenter is not part of the pipeline.
+
+        Args:
+            augmenter: The augmenter
+
+        Returns:
+            The invocation plan of the augmenter
+        """
+        plan = self._invocation_plans.get(id(augmenter))
+        if plan is None or plan.augmenter is not augmenter:
+            plan = self._invocation_plans[id(augmenter)] = compile_invocation_plan(augmenter)
+        return plan
+
     def apply_augmenter(self, augmenter: BaseAxisAugmenter, text: str, identification_data: Dict[str, Any] = None) -> List[str]:
         """
         Apply a single augmenter to a text.
@@ -50,55 +490,250 @@ class AugmentationPipeline:
         Returns:
             List of augmented texts
         """
-        # Handle different augmenter interfaces
-        if isinstance(augmenter, Paraphrase):
-            return augmenter.augment(text)
-        elif isinstance(augmenter, MultipleChoiceAugmenter) and identification_data:
-            return augmenter.augment(text, identification_data)
-        elif isinstance(augmenter, FewShotAugmenter):
-            # If we have example pairs in identification_data, use them
-            if identification_data:
-                return augmenter.augment(text, identification_data)
-            # Otherwise return the original text
-            return [text]
-        elif isinstance(augmenter, MultiDocAugmenter):
-            # MultiDocAugmenter works with lists of documents
-            if identification_data and "docs" in identification_data:
-                # Get the documents from identification_data
-                docs = identification_data["docs"]
-                # Get the concatenation type if provided
-                concat_type = identification_data.get("concat_type", "single_doc")
-                # Generate permutations
-                permutations = augmenter.permute_docs_order(docs, n_permutations=augmenter.n_augments)
-                # Concatenate each permutation
-                return [augmenter.concatenate_docs(perm, concat_type) for perm in permutations]
-            # If no documents are provided, return the original text
-            return [text]
-        elif isinstance(augmenter, ContextAugmenter):
-            # ContextAugmenter has a standard interface
-            return augmenter.augment(text)
-        elif isinstance(augmenter, TextSurfaceAugmenter):
-            # TextSurfaceAugmenter has a standard interface
-            return augmenter.augment(text)
-        elif hasattr(augmenter, 'augment'):
-            # Standard augmenter interface
-            try:
-                return augmenter.augment(text, identification_data)
-            except TypeError:
-                # Try without identification_data if it fails
+        plan = self.get_invocation_plan(augmenter)
+        key = self._get_cache_key(augmenter, text, identification_data) if self.cache is not None else None
+        if key is None:
+            return plan(text, identification_data)
+        augmented = self.cache.get(key)
+        if augmented is None:
+            augmented = plan(text, identification_data)
+            self.cache.put(key, augmented)
+        return augmented
+
+    def _get_executor(self, kind: str) -> Executor:
+        """Get (lazily creating) the pool of the given kind."""
+        if kind not in self._executors:
+            if kind == AugmentationPipelineConstants.THREAD_EXECUTOR:
+                self._executors[kind] = ThreadPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executors[kind] = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executors[kind]
+
+    def _get_executor_kind(self, augmenter: BaseAxisAugmenter) -> str:
+        """Resolve the executor kind used for an augmenter's stage."""
+        if self.executor == AugmentationPipelineConstants.AUTO_EXECUTOR:
+            if getattr(augmenter, "io_bound", False):
+                return AugmentationPipelineConstants.THREAD_EXECUTOR
+            return AugmentationPipelineConstants.PROCESS_EXECUTOR
+        return self.executor
+
+    def run_stage(self, augmenter: BaseAxisAugmenter, variations: List[str],
+                  identification_data: Dict[str, Any] = None) -> List[List[str]]:
+        """
+        Apply an augmenter to every input variation of a stage, possibly concurrently.
+
+        Args:
+            augmenter: The augmenter of the stage
+            variations: The input variations of the stage
+            identification_data: Optional identification data for augmenters that need it
+
+        Returns:
+            The outputs of the augmenter for each input variation, in input order
+        """
+        return self._run_calls(augmenter, variations, [identification_data] * len(variations))
+
+    def iter_stage(self, augmenter: BaseAxisAugmenter, variations: List[str],
+                   identification_data: Dict[str, Any] = None) -> Iterator[str]:
+        """
+        Stream the outputs of a stage, in input order.
+
+        Without a cache, the outputs are produced as they are consumed: serial stages call the
+        augmenter on the next input variation only when needed, and pooled stages hand out the
+        results of the workers one at a time.
+
+        Args:
+            augmenter: The augmenter of the stage
+            variations: The input variations of the stage
+            identification_data: Optional identification data for augmenters that need it
+
+        Returns:
+            Iterator over the output variations of the stage
+        """
+        for augmented in self._iter_calls(augmenter, variations, [identification_data] * len(variations)):
+            yield from augmented
+
+    def _run_calls(self, augmenter: BaseAxisAugmenter, texts: List[str],
+                   identification_data_list: List[Optional[Dict[str, Any]]]) -> List[List[str]]:
+        """Apply an augmenter to every text with its own identification data, consulting the cache."""
+        if self.cache is None:
+            return [list(augmented) for augmented in self._iter_calls_uncached(augmenter, texts, identification_data_list)]
+
+        # Only the texts missing from the cache are sent to the augmenter
+        keys = self._get_cache_keys(augmenter, texts, identification_data_list)
+        results = [self.cache.get(key) if key is not None else None for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        computed = self._iter_calls_uncached(augmenter, [texts[i] for i in missing],
+                                             [identification_data_list[i] for i in missing])
+        for i, augmented in zip(missing, computed):
+            augmented = list(augmented)
+            if keys[i] is not None:
+                self.cache.put(keys[i], augmented)
+            results[i] = augmented
+        return results
+
+    def _iter_calls(self, augmenter: BaseAxisAugmenter, texts: List[str],
+                    identification_data_list: List[Optional[Dict[str, Any]]]) -> Iterator[Iterable[str]]:
+        """Lazily yield the outputs of the augmenter for each text; with a cache the calls are made up front."""
+        if self.cache is not None:
+            return iter(self._run_calls(augmenter, texts, identification_data_list))
+        return self._iter_calls_uncached(augmenter, texts, identification_data_list)
+
+    def _get_cache_key(self, augmenter: BaseAxisAugmenter, text: str,
+                       identification_data: Optional[Dict[str, Any]]) -> Optional[str]:
+        """Build the cache key of a single call, or None if the call cannot be cached."""
+        try:
+            return self.cache.make_key(self.cache.augmenter_digest(augmenter),
+                                       self.cache.identification_digest(identification_data), text)
+        except UncacheableValueError as error:
+            logger.debug("Not caching a call of %s: %s", augmenter.get_name(), error)
+            return None
+
+    def _get_cache_keys(self, augmenter: BaseAxisAugmenter, texts: List[str],
+                        identification_data_list: List[Optional[Dict[str, Any]]]) -> List[Optional[str]]:
+        """
+        Build the cache keys of a stage, digesting the augmenter, each identification data object
+        and each DataFrame they share (e.g. a few-shot dataset) once. Calls that cannot be cached
+        get a None key.
+        """
+        try:
+            augmenter_digest = self.cache.augmenter_digest(augmenter)
+        except UncacheableValueError as error:
+            logger.debug("Not caching the calls of %s: %s", augmenter.get_name(), error)
+            return [None] * len(texts)
+        identification_digests = {}
+        frame_digests = {}
+        keys = []
+        for text, identification_data in zip(texts, identification_data_list):
+            if id(identification_data) not in identification_digests:
                 try:
-                    return augmenter.augment(text)
-                except:
-                    # If all else fails, return the original text
-                    return [text]
+                    identification_digests[id(identification_data)] = self.cache.identification_digest(
+                        identification_data, frame_digests)
+                except UncacheableValueError as error:
+                    logger.debug("Not caching a call of %s: %s", augmenter.get_name(), error)
+                    identification_digests[id(identification_data)] = None
+            identification_digest = identification_digests[id(identification_data)]
+            keys.append(self.cache.make_key(augmenter_digest, identification_digest, text)
+                        if identification_digest is not None else None)
+        return keys
+
+    def _iter_calls_uncached(self, augmenter: BaseAxisAugmenter, texts: List[str],
+                             identification_data_list: List[Optional[Dict[str, Any]]]) -> Iterator[Iterable[str]]:
+        """Lazily yield the outputs of the augmenter for each text through the configured executor, in order."""
+        kind = self._get_executor_kind(augmenter)
+        plan = self.get_invocation_plan(augmenter)
+        if self.instrumentation is None:
+            if kind == AugmentationPipelineConstants.SERIAL_EXECUTOR or len(texts) <= 1:
+                return (plan.iter(text, identification_data)
+                        for text, identification_data in zip(texts, identification_data_list))
+            return self._map_calls(kind, plan, texts, identification_data_list)
+
+        # Instrumented calls are timed where they run, i.e. in the workers
+        if kind == AugmentationPipelineConstants.SERIAL_EXECUTOR or len(texts) <= 1:
+            timed_results = (timed_invoke(plan, text, identification_data)
+                             for text, identification_data in zip(texts, identification_data_list))
         else:
-            # If the augmenter doesn't have an augment method, return the original text
-            return [text]
+            timed_results = self._map_calls(kind, partial(timed_invoke, plan), texts, identification_data_list)
+        return self._record_calls(augmenter, timed_results)
+
+    def _map_calls(self, kind: str, invoke, texts: List[str],
+                   identification_data_list: List[Optional[Dict[str, Any]]]) -> Iterator[Any]:
+        """Map a picklable invoke(text, identification_data) callable over the texts with a pool, in order."""
+        if kind == AugmentationPipelineConstants.THREAD_EXECUTOR:
+            return self._get_executor(kind).map(invoke, texts, identification_data_list)
+
+        # Every chunk is pickled as a whole, so the augmenter and identification data shared
+        # by the calls of a chunk are sent to the worker once
+        executor = self._get_executor(kind)
+        chunksize = max(1, len(texts) // (4 * (self.max_workers or os.cpu_count() or 1)))
+        return executor.map(invoke, texts, identification_data_list, chunksize=chunksize)
+
+    def _record_calls(self, augmenter: BaseAxisAugmenter,
+                      timed_results: Iterable[Tuple[List[str], float]]) -> Iterator[List[str]]:
+        """Record the latency of every call in the instrumentation and yield its outputs."""
+        name = augmenter.__class__.__name__
+        for augmented, seconds in timed_results:
+            self.instrumentation.record_call(name, seconds)
+            yield augmented
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Get the concurrency limit of the running event loop (semaphores are bound to one loop)."""
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def aapply_augmenter(self, augmenter: BaseAxisAugmenter, text: str,
+                               identification_data: Dict[str, Any] = None) -> List[str]:
+        """
+        Async counterpart of apply_augmenter, limited by the pipeline's max_concurrency.
+
+        Args:
+            augmenter: The augmenter to apply
+            text: The text to augment
+            identification_data: Optional identification data for augmenters that need it
+
+        Returns:
+            List of augmented texts
+        """
+        key = self._get_cache_key(augmenter, text, identification_data) if self.cache is not None else None
+        if key is None:
+            return await self._ainvoke(augmenter, text, identification_data)
+
+        augmented = self.cache.get(key)
+        if augmented is None:
+            augmented = await self._ainvoke(augmenter, text, identification_data)
+            self.cache.put(key, augmented)
+        return augmented
+
+    async def _ainvoke(self, augmenter: BaseAxisAugmenter, text: str,
+                       identification_data: Dict[str, Any] = None) -> List[str]:
+        """Call an augmenter within the concurrency limit, timing the call if instrumented."""
+        plan = self.get_invocation_plan(augmenter)
+        async with self._get_semaphore():
+            if self.instrumentation is None:
+                return await plan.acall(text, identification_data)
+            start = time.perf_counter()
+            augmented = await plan.acall(text, identification_data)
+            self.instrumentation.record_call(augmenter.__class__.__name__, time.perf_counter() - start)
+            return augmented
+
+    async def arun_stage(self, augmenter: BaseAxisAugmenter, variations: List[str],
+                         identification_data: Dict[str, Any] = None) -> List[List[str]]:
+        """
+        Async counterpart of run_stage: every input variation is augmented concurrently.
+
+        Args:
+            augmenter: The augmenter of the stage
+            variations: The input variations of the stage
+            identification_data: Optional identification data for augmenters that need it
+
+        Returns:
+            The outputs of the augmenter for each input variation, in input order
+        """
+        return list(await asyncio.gather(
+            *(self.aapply_augmenter(augmenter, variation, identification_data) for variation in variations)))
+
+    def close(self):
+        """Shut down the worker pools of the pipeline."""
+        for executor in self._executors.values():
+            executor.shutdown()
+        self._executors = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def augment(self, text: str, identification_data: Dict[str, Any] = None) -> List[str]:
         """
         Apply the augmentation pipeline to the input text.
 
+        Every stage is streamed into a reservoir of max_variations variations (or of the input
+        budget of the next stage if budget_aware), so the outputs that are not sampled are never
+        collected.
+
         Args:
             text: The input text to augment.
             identification_data: Optional identification data for augmenters that need it
@@ -106,25 +741,111 @@ class AugmentationPipeline:
         Returns:
             A list of augmented texts.
         """
-        all_variations = [text]  # Start with the original text
+        return self.augment_many([text], [identification_data])[0]
+
+    def augment_many(self, texts: List[str],
+                     identification_data_list: Optional[List[Optional[Dict[str, Any]]]] = None) -> Dict[int, List[str]]:
+        """
+        Apply the augmentation pipeline to a whole dataset.
+
+        Each stage runs once over the variations of all the texts, so the executor pools and the
+        per-stage setup are shared by the dataset. Every text keeps its own reservoir of variations.
+
+        Args:
+            texts: The input texts to augment.
+            identification_data_list: Optional identification data of each text.
+
+        Returns:
+            Mapping from the index of each input text to its augmented texts.
+        """
+        if identification_data_list is None:
+            identification_data_list = [None] * len(texts)
+        if len(identification_data_list) != len(texts):
+            raise ValueError(f"Got {len(identification_data_list)} identification data for {len(texts)} texts")
+
+        all_variations = {index: [text] for index, text in enumerate(texts)}  # Start with the original texts
+        output_sizes = self._get_output_sizes()
 
         for i, augmenter in enumerate(self.augmenters):
-            print(f"Applying augmenter {i+1}/{len(self.augmenters)}: {augmenter.__class__.__name__}")
-            print(f"Input variations: {len(all_variations)}")
+            start = time.perf_counter() if self.instrumentation is not None else None
+            logger.info("Applying augmenter %d/%d: %s", i + 1, len(self.augmenters), augmenter.__class__.__name__)
+
+            # One call per variation of every text, grouped by text
+            indices = [index for index, variations in all_variations.items() for _ in variations]
+            stage_texts = [variation for variations in all_variations.values() for variation in variations]
+            stage_data = [identification_data_list[index] for index in indices]
+            logger.info("Input variations: %d", len(stage_texts))
+
+            # Each distinct variation is augmented once; its outputs are shared by all its occurrences
+            unique_texts, unique_data, positions = deduplicate_calls(stage_texts, stage_data)
+            results = expand_results(self._iter_calls(augmenter, unique_texts, unique_data), positions)
+
+            # Stream the outputs of each text into its own uniform sample
+            n_outputs = 0
+            n_unique = 0
+            for index, group in itertools.groupby(zip(indices, results), key=lambda item: item[0]):
+                outputs = [0]
+                # Distinct outputs are only tracked when instrumented
+                seen = set() if self.instrumentation is not None else None
+
+                def count_outputs(calls):
+                    for _, augmented in calls:
+                        for output in augmented:
+                            outputs[0] += 1
+                            if seen is not None:
+                                seen.add(output)
+                            yield output
+
+                all_variations[index] = reservoir_sample(count_outputs(group), output_sizes[i], self.rng)
+                n_outputs += outputs[0]
+                n_unique += len(seen) if seen is not None else 0
+            self._record_fanout(augmenter, len(stage_texts), n_outputs)
+            n_kept = sum(len(variations) for variations in all_variations.values())
+            logger.info("Output variations: %d", n_kept)
+            if self.instrumentation is not None:
+                self.instrumentation.record_stage(i, augmenter.__class__.__name__, time.perf_counter() - start,
+                                                  len(texts), len(stage_texts), n_outputs, n_unique, n_kept,
+                                                  n_calls=len(unique_texts))
+
+        return all_variations
 
-            new_variations = []
+    async def aaugment(self, text: str, identification_data: Dict[str, Any] = None) -> List[str]:
+        """
+        Async counterpart of augment.
+
+        Every stage issues the augmenter calls of all its input variations concurrently, up to
+        max_concurrency calls in flight, so many prompts can be augmented on one event loop.
+
+        Args:
+            text: The input text to augment.
+            identification_data: Optional identification data for augmenters that need it
 
-            # Apply the current augmenter to each existing variation
-            for variation in all_variations:
-                augmented = self.apply_augmenter(augmenter, variation, identification_data)
-                new_variations.extend(augmented)
+        Returns:
+            A list of augmented texts.
+        """
+        all_variations = [text]  # Start with the original text
+        output_sizes = self._get_output_sizes()
 
-            # Limit the number of variations if it exceeds the maximum
-            if len(new_variations) > self.max_variations:
-                new_variations = random.sample(new_variations, self.max_variations)
+        for i, augmenter in enumerate(self.augmenters):
+            start = time.perf_counter() if self.instrumentation is not None else None
+            logger.info("Applying augmenter %d/%d: %s", i + 1, len(self.augmenters), augmenter.__class__.__name__)
+            logger.info("Input variations: %d", len(all_variations))
 
-            all_variations = new_variations
-            print(f"Output variations: {len(all_variations)}")
+            # Apply the current augmenter to each distinct variation, sharing the outputs between occurrences
+            unique_texts, _, positions = deduplicate_calls(all_variations, [identification_data] * len(all_variations))
+            results = list(expand_results(await self.arun_stage(augmenter, unique_texts, identification_data),
+                                          positions))
+            n_inputs = len(all_variations)
+            n_outputs = sum(len(augmented) for augmented in results)
+            self._record_fanout(augmenter, n_inputs, n_outputs)
+            all_variations = reservoir_sample((variation for augmented in results for variation in augmented),
+                                              output_sizes[i], self.rng)
+            logger.info("Output variations: %d", len(all_variations))
+            if self.instrumentation is not None:
+                n_unique = len({variation for augmented in results for variation in augmented})
+                self.instrumentation.record_stage(i, augmenter.__class__.__name__, time.perf_counter() - start,
+                                                  1, n_inputs, n_outputs, n_unique, len(all_variations),
+                                                  n_calls=len(unique_texts))
 
         return all_variations
 
@@ -308,6 +1029,8 @@ def run_multidoc_combined_example():
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
     # Run all examples
     # run_basic_augmentation_example()
     # run_multiple_choice_example()
@@ -1,24 +1,152 @@
+import asyncio
+import hashlib
+import random
+
+import numpy as np
+
+
 class BaseAxisAugmenter:
     """
     Base class for all axis augmenters.
-    
+
     Axis augmenters generate variations of a prompt along a specific dimension
     without changing the meaning of the prompt.
+
+    Augmenters that wait on the network (LLM calls) set io_bound to True, so the
+    pipeline can run them in a thread pool rather than a process pool.
+
+    Each augmenter owns its own random streams, rooted in a numpy SeedSequence.
+    The streams used for a call are derived from the root and the call's inputs,
+    so results do not depend on call order and augmenters can safely run in
+    thread or process pools.
     """
 
-    def __init__(self, n_augments=3):
+    io_bound = False
+
+    def __init__(self, n_augments=3, seed=0):
         """
         Initialize the augmenter.
-        
+
         Args:
             n_augments: Number of variations to generate (default: 3)
+            seed: Root seed (int or SeedSequence) of the augmenter's random streams (default: 0,
+                so runs are reproducible). Pass None to opt into fresh entropy.
         """
         self.n_augments = n_augments
+        self.set_seed_sequence(seed)
 
     def get_name(self):
         """Get the name of this augmenter."""
         return self.__class__.__name__
 
+    def set_seed_sequence(self, seed=0):
+        """
+        Re-root the random streams of this augmenter.
+
+        Args:
+            seed: An int, a numpy SeedSequence (e.g. spawned by the pipeline) or None for fresh entropy.
+        """
+        # Remember whether the streams are reproducible (augmenters on fresh entropy share cache entries)
+        self.seed = seed
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed_sequence = seed
+        # Hashing key of the bulk stream keys (see get_stream_keys)
+        self._stream_root = seed.generate_state(4, np.uint64).tobytes()
+
+    def get_cache_config(self):
+        """
+        Get the configuration that determines this augmenter's outputs, used in cache keys.
+
+        Returns:
+            Dictionary of the public attributes of the augmenter, with the seed normalized.
+        """
+        config = {key: value for key, value in vars(self).items()
+                  if not key.startswith("_") and key not in ("seed", "seed_sequence")}
+        if self.seed is not None:
+            config["seed"] = (self.seed_sequence.entropy, tuple(self.seed_sequence.spawn_key))
+        return config
+
+    def _derive_seed_sequence(self, keys) -> np.random.SeedSequence:
+        """Derive a child SeedSequence of the root that is keyed by the given values."""
+        digest = hashlib.blake2b("\x1f".join(str(key) for key in keys).encode("utf-8"), digest_size=8).digest()
+        return np.random.SeedSequence(
+            entropy=self.seed_sequence.entropy,
+            spawn_key=tuple(self.seed_sequence.spawn_key) + (int.from_bytes(digest, "little"),),
+            pool_size=self.seed_sequence.pool_size,
+        )
+
+    def get_rng(self, *keys, seed=None) -> np.random.Generator:
+        """
+        Get a numpy Generator for a single call.
+
+        Args:
+            *keys: Values identifying the call (usually the input text).
+            seed: Optional explicit seed. If given, it is used as is instead of the augmenter's streams.
+
+        Returns:
+            A numpy Generator that is independent of any other call and of the global RNG.
+        """
+        if seed is not None:
+            return np.random.default_rng(seed)
+        return np.random.default_rng(self._derive_seed_sequence(keys))
+
+    def get_py_rng(self, *keys, seed=None) -> random.Random:
+        """
+        Get a random.Random instance for a single call.
+
+        Args:
+            *keys: Values identifying the call (usually the input text).
+            seed: Optional explicit seed. If given, it is used as is instead of the augmenter's streams.
+
+        Returns:
+            A random.Random instance that is independent of any other call and of the global RNG.
+        """
+        if seed is not None:
+            return random.Random(seed)
+        state = self._derive_seed_sequence(keys).generate_state(4, np.uint64)
+        return random.Random(int.from_bytes(state.tobytes(), "little"))
+
+    def get_stream_keys(self, values, seed=None) -> np.ndarray:
+        """
+        Get one 64-bit stream key per value, in bulk, for counter-based batch streams.
+
+        A key only depends on the root seed and on its value, like the streams of get_rng, but
+        is much cheaper to derive (one keyed hash per value, no SeedSequence).
+
+        Args:
+            values: Values identifying the calls (usually the input texts).
+            seed: Optional explicit seed. If given, every value gets the key of the seed, as is.
+
+        Returns:
+            A uint64 array with one key per value.
+        """
+        if seed is not None:
+            sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+            return np.full(len(values), sequence.generate_state(1, np.uint64)[0], dtype=np.uint64)
+        return np.fromiter(
+            (int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), key=self._stream_root, digest_size=8).digest(),
+                            "little") for value in values),
+            dtype=np.uint64, count=len(values))
+
+    async def aaugment(self, prompt, identification_data=None):
+        """
+        Async counterpart of augment.
+
+        The default implementation adapts the synchronous augment by running it in a worker
+        thread; augmenters that call an LLM override it with a native async implementation.
+
+        Args:
+            prompt: The original prompt text
+            identification_data: Optional data from the identifier
+
+        Returns:
+            List of variations of this axis
+        """
+        if identification_data is None:
+            return await asyncio.to_thread(self.augment, prompt)
+        return await asyncio.to_thread(self.augment, prompt, identification_data)
+
     # def augment(self, prompt: str, identification_data: Dict[str, Any] = None) -> List[str]:
     #     """
     #     Generate variations of the prompt based on identification data.
@@ -0,0 +1,242 @@
+"""
+Micro-benchmarks for the non-LLM augmentation operations.
+
+Sweeps text lengths, batch sizes and n_augments over every offline augmenter operation and
+reports throughput (ops/sec, one op being one input text) and peak memory as JSON, so runs can
+be compared between commits. Throughput is reported warm (tokenization and plan caches filled
+by a previous run) and cold (caches cleared before every run):
+
+    python -m src.axis_augmentation.benchmark --output benchmark_results.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.axis_augmentation.fewshot_augmenter import FewShotAugmenter
+from src.axis_augmentation.multidoc_augmenter import MultiDocAugmenter
+from src.axis_augmentation.multiple_choice_augmenter import MultipleChoiceAugmenter
+from src.axis_augmentation.text_surface_augmenter import TextSurfaceAugmenter
+
+BENCHMARK_SEED = 0
+
+# Vocabulary used to build synthetic prompts (words, punctuation and mixed case)
+BENCHMARK_WORDS = [
+    "What", "is", "the", "capital", "of", "France?", "Paris,", "London;", "Berlin:", "Madrid!",
+    "Please", "answer", "the", "following", "question.", "The", "quick", "brown", "fox", "-",
+    "jumps", "over", "the", "lazy", "dog_", "and", "then", "explains", "photosynthesis.",
+]
+
+DEFAULT_TEXT_LENGTHS = [64, 1024, 8192]
+DEFAULT_BATCH_SIZES = [1, 64]
+DEFAULT_N_AUGMENTS = [1, 5]
+
+
+def make_texts(length: int, batch_size: int, seed: int = BENCHMARK_SEED) -> List[str]:
+    """
+    Build a reproducible batch of synthetic prompts.
+
+    Args:
+        length: Number of characters of every text.
+        batch_size: Number of texts.
+        seed: Seed of the word sampling.
+
+    Returns:
+        List of batch_size texts of exactly length characters.
+    """
+    rng = np.random.default_rng(seed)
+    texts = []
+    for _ in range(batch_size):
+        words = []
+        size = 0
+        while size < length:
+            word = BENCHMARK_WORDS[rng.integers(len(BENCHMARK_WORDS))]
+            words.append(word)
+            size += len(word) + 1
+        texts.append(" ".join(words)[:length])
+    return texts
+
+
+def build_cases(texts: List[str], n_augments: int) -> Tuple[Dict[str, Callable[[], Any]], Callable[[], None]]:
+    """
+    Build the benchmarked operations for one point of the sweep.
+
+    Args:
+        texts: The batch of input texts.
+        n_augments: Number of variations (max_outputs for the text surface methods).
+
+    Returns:
+        A tuple of (mapping from operation name to a zero-argument callable processing the whole
+        batch, callable clearing the caches the operations fill).
+    """
+    surface = TextSurfaceAugmenter(n_augments=n_augments, seed=BENCHMARK_SEED)
+    multiple_choice = MultipleChoiceAugmenter(n_augments=n_augments, seed=BENCHMARK_SEED)
+    multidoc = MultiDocAugmenter(n_augments=n_augments, seed=BENCHMARK_SEED)
+    fewshot = FewShotAugmenter(num_examples=2, n_augments=n_augments, seed=BENCHMARK_SEED)
+
+    # Every text is split into four options / documents; the batch doubles as the few-shot dataset
+    options = [[text[i::4] for i in range(4)] for text in texts]
+    mc_data = [{"question": text, "options": text_options, "markers": ["A", "B", "C", "D"]}
+               for text, text_options in zip(texts, options)]
+    fewshot_data = {"dataset": pd.DataFrame({"input": texts + ["placeholder input"],
+                                             "output": [text[::-1] for text in texts] + ["placeholder output"]})}
+
+    cases = {
+        "butter_finger": lambda: [surface.butter_finger(text, max_outputs=n_augments) for text in texts],
+        "butter_finger_batch": lambda: surface.butter_finger_batch(texts, max_outputs=n_augments),
+        "change_char_case": lambda: [surface.change_char_case(text, max_outputs=n_augments) for text in texts],
+        "change_char_case_batch": lambda: surface.change_char_case_batch(texts, max_outputs=n_augments),
+        "swap_characters": lambda: [surface.swap_characters(text, max_outputs=n_augments) for text in texts],
+        "swap_characters_batch": lambda: surface.swap_characters_batch(texts, max_outputs=n_augments),
+        "switch_punctuation": lambda: [surface.switch_punctuation(text, max_outputs=n_augments) for text in texts],
+        "switch_punctuation_batch": lambda: surface.switch_punctuation_batch(texts, max_outputs=n_augments),
+        "add_white_spaces": lambda: [surface.add_white_spaces(text, max_outputs=n_augments) for text in texts],
+        "add_white_spaces_batch": lambda: surface.add_white_spaces(texts, max_outputs=n_augments),
+        "TextSurfaceAugmenter.augment": lambda: [surface.augment(text) for text in texts],
+        "MultipleChoiceAugmenter.augment": lambda: [multiple_choice.augment(text, data)
+                                                    for text, data in zip(texts, mc_data)],
+        "MultiDocAugmenter.permute_docs_order": lambda: [multidoc.permute_docs_order(docs, n_permutations=n_augments)
+                                                         for docs in options],
+        "MultiDocAugmenter.concatenate_docs": lambda: [multidoc.concatenate_docs(docs, "titles") for docs in options],
+        "FewShotAugmenter.augment": lambda: [fewshot.augment(text, fewshot_data) for text in texts],
+    }
+    return cases, surface.clear_caches
+
+
+def measure(operation: Callable[[], Any], repeats: int,
+            clear_caches: Optional[Callable[[], None]] = None) -> Dict[str, float]:
+    """
+    Time an operation cold and warm, and measure its peak memory.
+
+    The operation is first timed repeats times with the caches cleared before every run (cold),
+    then run once as warm-up and timed repeats times on the filled caches (warm), keeping the
+    best run of each, then run once more under tracemalloc to measure its peak Python heap
+    allocation.
+
+    Args:
+        operation: Zero-argument callable to measure.
+        repeats: Number of timed runs of each kind.
+        clear_caches: Optional callable clearing the caches the operation fills.
+
+    Returns:
+        Dictionary with the best warm and cold wall times in seconds and the peak memory in bytes.
+    """
+    cold = float("inf")
+    for _ in range(repeats):
+        if clear_caches is not None:
+            clear_caches()
+        start = time.perf_counter()
+        operation()
+        cold = min(cold, time.perf_counter() - start)
+
+    operation()
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        operation()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": best, "cold_seconds": cold, "peak_memory_bytes": peak}
+
+
+def get_git_commit() -> str:
+    """Return the current git commit hash, or an empty string outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run_benchmarks(text_lengths: List[int], batch_sizes: List[int], n_augments_values: List[int],
+                   repeats: int = 3, operations: List[str] = None) -> Dict[str, Any]:
+    """
+    Run the benchmark sweep.
+
+    Args:
+        text_lengths: Text lengths (in characters) to sweep.
+        batch_sizes: Batch sizes to sweep.
+        n_augments_values: Values of n_augments to sweep.
+        repeats: Number of timed runs per case.
+        operations: Optional subset of operation names to run (all if None).
+
+    Returns:
+        Dictionary with the run metadata and one result entry per case.
+    """
+    results = []
+    for text_length in text_lengths:
+        for batch_size in batch_sizes:
+            texts = make_texts(text_length, batch_size)
+            for n_augments in n_augments_values:
+                cases, clear_caches = build_cases(texts, n_augments)
+                for name, operation in cases.items():
+                    if operations and name not in operations:
+                        continue
+                    measurement = measure(operation, repeats, clear_caches)
+                    results.append({
+                        "operation": name,
+                        "text_length": text_length,
+                        "batch_size": batch_size,
+                        "n_augments": n_augments,
+                        "seconds": measurement["seconds"],
+                        "ops_per_sec": batch_size / measurement["seconds"] if measurement["seconds"] else None,
+                        "cold_seconds": measurement["cold_seconds"],
+                        "cold_ops_per_sec": (batch_size / measurement["cold_seconds"]
+                                             if measurement["cold_seconds"] else None),
+                        "peak_memory_bytes": measurement["peak_memory_bytes"],
+                    })
+                    print(f"{name:40s} len={text_length:<6d} batch={batch_size:<5d} n={n_augments:<3d} "
+                          f"{results[-1]['ops_per_sec']:>12.1f} ops/s warm "
+                          f"{results[-1]['cold_ops_per_sec']:>12.1f} ops/s cold  "
+                          f"{measurement['peak_memory_bytes'] / 1024:>10.1f} KiB", file=sys.stderr)
+
+    return {
+        "metadata": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": get_git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "seed": BENCHMARK_SEED,
+            "repeats": repeats,
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the non-LLM augmenters.")
+    parser.add_argument("--lengths", type=int, nargs="+", default=DEFAULT_TEXT_LENGTHS,
+                        help=f"Text lengths in characters (default: {DEFAULT_TEXT_LENGTHS}).")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=DEFAULT_BATCH_SIZES,
+                        help=f"Number of texts per batch (default: {DEFAULT_BATCH_SIZES}).")
+    parser.add_argument("--n-augments", type=int, nargs="+", default=DEFAULT_N_AUGMENTS,
+                        help=f"Values of n_augments / max_outputs (default: {DEFAULT_N_AUGMENTS}).")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Number of timed cold and warm runs per case; the best of each is reported (default: 3).")
+    parser.add_argument("--operations", type=str, nargs="*", default=None,
+                        help="Only run these operations (default: all).")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Path of the JSON report (default: print to stdout).")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.lengths, args.batch_sizes, args.n_augments, args.repeats, args.operations)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -1,7 +1,11 @@
-import random
+import asyncio
+import logging
 from typing import List, Dict, Any
 from src.axis_augmentation.base_augmenter import BaseAxisAugmenter
-from src.utils.model_client import get_completion
+from src.utils.llm_retry import LLMError
+from src.utils.model_client import aget_completion, get_completion
+
+logger = logging.getLogger(__name__)
 
 
 class ContextAugmenter(BaseAxisAugmenter):
@@ -10,14 +14,17 @@ class ContextAugmenter(BaseAxisAugmenter):
     This doesn't change the meaning of the task but makes the prompt longer.
     """
 
-    def __init__(self, n_augments=3):
+    io_bound = True
+
+    def __init__(self, n_augments=3, seed=0):
         """
         Initialize the context augmenter.
 
         Args:
             n_augments: Number of variations to generate
+            seed: Root seed of the augmenter's random streams (default: 0; None for fresh entropy)
         """
-        super().__init__(n_augments=n_augments)
+        super().__init__(n_augments=n_augments, seed=seed)
         
     def get_name(self):
         return "Context Variations"
@@ -34,26 +41,50 @@ class ContextAugmenter(BaseAxisAugmenter):
             List of variations with added context
         """
         variations = [prompt]  # Start with the original prompt
-        
+        rng = self.get_py_rng(prompt)
+        type_counts = {}
+
         # Generate n_augments-1 variations (since we already have the original)
         for _ in range(self.n_augments - 1):
             # Randomly decide whether to add context before, after, or both
-            variation_type = random.choice(["before", "after", "both"])
+            variation_type = rng.choice(["before", "after", "both"])
+            sample = type_counts[variation_type] = type_counts.get(variation_type, -1) + 1
             
             # Generate the variation
-            new_variation = self._generate_variation(prompt, variation_type)
+            new_variation = self._generate_variation(prompt, variation_type, sample)
             if new_variation and new_variation != prompt:
                 variations.append(new_variation)
         
         return variations
 
-    def _generate_variation(self, prompt: str, variation_type: str) -> str:
+    async def aaugment(self, prompt: str, identification_data: Dict[str, Any] = None) -> List[str]:
+        """
+        Async counterpart of augment: all the LLM calls of the prompt are issued concurrently.
+
+        Args:
+            prompt: The original prompt text
+            identification_data: Data from the identifier (not used in this augmenter)
+
+        Returns:
+            List of variations with added context
+        """
+        rng = self.get_py_rng(prompt)
+        variation_types = [rng.choice(["before", "after", "both"]) for _ in range(self.n_augments - 1)]
+        # Index the repeated variation types, so their requests are not coalesced
+        samples = [variation_types[:i].count(variation_type) for i, variation_type in enumerate(variation_types)]
+        new_variations = await asyncio.gather(
+            *(self._agenerate_variation(prompt, variation_type, sample)
+              for variation_type, sample in zip(variation_types, samples)))
+        return [prompt] + [variation for variation in new_variations if variation and variation != prompt]
+
+    def _generate_variation(self, prompt: str, variation_type: str, sample: int = 0) -> str:
         """
         Generate a single variation by adding context.
 
         Args:
             prompt: The original prompt
             variation_type: Where to add context ("before", "after", or "both")
+            sample: Index of the variation among those of the same type
 
         Returns:
             A new variation of the prompt
@@ -63,13 +94,39 @@ class ContextAugmenter(BaseAxisAugmenter):
         
         # Call language model to generate the variation
         try:
-            result = get_completion(meta_prompt)
+            result = get_completion(meta_prompt, sample=sample)
             # Check if the result is valid (not empty and not the same as the original prompt and the original prompt is in the result)
             if result and result != prompt and prompt in result:
                 return result
             else:
                 return prompt
-        except Exception as e:
+        except LLMError as error:
+            # Counted by the retry policy (see get_client_stats); the prompt is kept as is
+            logger.warning("ContextAugmenter variation failed: %s", error)
+            return prompt
+
+    async def _agenerate_variation(self, prompt: str, variation_type: str, sample: int = 0) -> str:
+        """
+        Async counterpart of _generate_variation.
+
+        Args:
+            prompt: The original prompt
+            variation_type: Where to add context ("before", "after", or "both")
+            sample: Index of the variation among those of the same type
+
+        Returns:
+            A new variation of the prompt
+        """
+        meta_prompt = self._create_meta_prompt(prompt, variation_type)
+        try:
+            result = await aget_completion(meta_prompt, sample=sample)
+            if result and result != prompt and prompt in result:
+                return result
+            else:
+                return prompt
+        except LLMError as error:
+            # Counted by the retry policy (see get_client_stats); the prompt is kept as is
+            logger.warning("ContextAugmenter variation failed: %s", error)
             return prompt
 
     def _create_meta_prompt(self, prompt: str, variation_type: str) -> str:
@@ -1,6 +1,5 @@
 from typing import Dict, List, Any
 import pandas as pd
-import random
 
 from src.axis_augmentation.base_augmenter import BaseAxisAugmenter
 from src.utils.constants import FewShotConstants
@@ -12,15 +11,16 @@ class FewShotAugmenter(BaseAxisAugmenter):
     It selects examples from a dataset to provide context for each question.
     """
 
-    def __init__(self, num_examples: int = 1, n_augments: int = 3):
+    def __init__(self, num_examples: int = 1, n_augments: int = 3, seed=0):
         """
         Initialize the few-shot augmenter.
         
         Args:
             num_examples: Number of examples to include for each question
             n_augments: Number of variations to generate (used for consistency with other augmenters)
+            seed: Root seed of the augmenter's random streams (default: 0; None for fresh entropy)
         """
-        super().__init__(n_augments=n_augments)
+        super().__init__(n_augments=n_augments, seed=seed)
         self.num_examples = num_examples
         self.dataset = None
 
@@ -44,7 +44,9 @@ class FewShotAugmenter(BaseAxisAugmenter):
         
         Args:
             prompt: The original prompt text
-            identification_data: Optional data containing a dataset to use
+            identification_data: Optional data containing a dataset to use, and optionally the
+                index label ("exclude_index") of a row of the dataset that must not be an example
+                (e.g. the prompt's own annotation), so one dataset can be shared by all prompts
             
         Returns:
             List of variations with few-shot examples
@@ -53,6 +55,7 @@ class FewShotAugmenter(BaseAxisAugmenter):
         dataset = self.dataset
         if dataset is None and identification_data and "dataset" in identification_data:
             dataset = identification_data["dataset"]
+        exclude_index = identification_data.get("exclude_index") if identification_data else None
         
         if dataset is None:
             return [prompt]
@@ -60,11 +63,13 @@ class FewShotAugmenter(BaseAxisAugmenter):
         variations = []
         used_variations = set()
         attempts = 0
+        rng = self.get_rng(prompt)
         # We'll allow more attempts than n_augments, in case we get duplicates
         while len(variations) < self.n_augments and attempts < self.n_augments * 2:
             # Get random examples for this variation
-            # We pass None for random_state so each sample can differ
-            examples = self._get_examples_for_question(prompt, dataset, random_state=None)
+            # We share one generator across attempts so each sample can differ
+            examples = self._get_examples_for_question(prompt, dataset, random_state=rng,
+                                                       exclude_index=exclude_index)
             formatted = self.format_examples(examples)
             # Only add if it's new
             if formatted not in used_variations:
@@ -93,17 +98,18 @@ class FewShotAugmenter(BaseAxisAugmenter):
         # Process each question in the dataframe
         for _, row in df.iterrows():
             question = row["input"]
-            examples = self._get_examples_for_question(question, df)
+            examples = self._get_examples_for_question(question, df, random_state=self.get_rng(question))
             result[question] = examples
 
         return result
 
-    def _get_examples_for_question(self, question: str, df, random_state=None) -> List[str]:
+    def _get_examples_for_question(self, question: str, df, random_state=None, exclude_index=None) -> List[str]:
         """
-        Get few-shot examples for a specific question, but now skipping the question itself.
+        Get few-shot examples for a specific question, but now skipping the question itself
+        (and the row labelled exclude_index, if given).
         """
         result = []
-        temp_df = df.copy()
+        temp_df = df.drop(index=exclude_index) if exclude_index is not None else df.copy()
 
         # Filter out the current question
         temp_df = temp_df[temp_df["input"] != question]
@@ -179,15 +185,16 @@ class FewShotAugmenter(BaseAxisAugmenter):
             return [self.create_few_shot_prompt(test_question, example_pool)]
         
         variations = []
+        rng = self.get_py_rng(test_question)
         
         # Create n_augments variations
         for _ in range(self.n_augments):
             # Sample examples
-            sampled_examples = random.sample(example_pool, min(self.num_examples, len(example_pool)))
+            sampled_examples = rng.sample(example_pool, min(self.num_examples, len(example_pool)))
             
             # Optionally shuffle the order (50% chance)
-            if random.random() > 0.5:
-                random.shuffle(sampled_examples)
+            if rng.random() > 0.5:
+                rng.shuffle(sampled_examples)
             
             # Create the prompt
             prompt = self.create_few_shot_prompt(test_question, sampled_examples)
@@ -1,18 +1,27 @@
 from itertools import permutations
 from math import factorial
-from random import sample
 from typing import List
 
-from datasets import load_dataset
+from src.axis_augmentation.base_augmenter import BaseAxisAugmenter
 from src.utils.constants import MultiDocConstants
 
 
-class MultiDocAugmenter():
+class MultiDocAugmenter(BaseAxisAugmenter):
     """
     This augmenter is intended for multi-document tasks, and performs augmentation on the
     list of documents of each example in the dataset.
     """
 
+    def __init__(self, n_augments=3, seed=0):
+        """
+        Initialize the multi-document augmenter.
+
+        Args:
+            n_augments: Number of document orders to generate
+            seed: Root seed of the augmenter's random streams (default: 0; None for fresh entropy)
+        """
+        super().__init__(n_augments=n_augments, seed=seed)
+
     def add_random_contexts(self, docs: List[str], corpus: List[str],
                             n_new_docs: int = 3) -> List[str]:
         """
@@ -23,7 +32,7 @@ class MultiDocAugmenter():
         :return: an augmented list of documents, where the original docs appear first,
         and n_new_docs irrelevant documents are added
         """
-        irrelevant_docs = sample([doc for doc in corpus if doc not in docs], n_new_docs)
+        irrelevant_docs = self.get_py_rng(*docs).sample([doc for doc in corpus if doc not in docs], n_new_docs)
         augmented_docs = docs + irrelevant_docs
         return augmented_docs
 
@@ -40,7 +49,7 @@ class MultiDocAugmenter():
 
         # generate all permutations of the docs
         n_iterations = min(n_permutations, factorial(len(docs)))
-        augments = sample(list(permutations(docs)), n_iterations)
+        augments = self.get_py_rng(*docs).sample(list(permutations(docs)), n_iterations)
         return [list(item) for item in augments]
 
     def concatenate_docs(self, docs: List[str], concat_type: str = MultiDocConstants.SINGLE_DOC) -> str:
@@ -78,6 +87,8 @@ class MultiDocAugmenter():
 
 
 if __name__ == "__main__":  # Example usage
+    from datasets import load_dataset
+
     # Load the dataset (this is clapnq, a multi-document dataset intended for RAG)
     ds = load_dataset("PrimeQA/clapnq")['validation']['passages']
     docs = [ds[i][0]['text'] for i in range(3)]  # example 3 documents
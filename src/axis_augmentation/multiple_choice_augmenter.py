@@ -1,4 +1,3 @@
-import random
 from typing import List, Dict, Any
 
 from src.axis_augmentation.base_augmenter import BaseAxisAugmenter
@@ -14,9 +13,9 @@ class MultipleChoiceAugmenter(BaseAxisAugmenter):
     2. Changing the order of answer options
     """
 
-    def __init__(self, n_augments=3):
+    def __init__(self, n_augments=3, seed=0):
         """Initialize the multiple choice augmenter."""
-        super().__init__(n_augments=n_augments)
+        super().__init__(n_augments=n_augments, seed=seed)
         
         # Define available enumeration styles
         self.enumeration_styles = MultipleChoiceConstants.ENUMERATION_STYLES
@@ -66,10 +65,11 @@ class MultipleChoiceAugmenter(BaseAxisAugmenter):
         
         # 2. Create variations with different order
         current_style = self.enumeration_styles[current_style_index]
+        rng = self.get_py_rng(prompt)
         for _ in range(min(2, self.n_augments)):
             # Shuffle options
             shuffled_indices = list(range(len(options)))
-            random.shuffle(shuffled_indices)
+            rng.shuffle(shuffled_indices)
             
             # Skip if order is unchanged
             if shuffled_indices == list(range(len(options))):
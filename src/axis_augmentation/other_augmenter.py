@@ -1,8 +1,13 @@
 # Augmentor for custom augmentations
 # This module provides an augmenter that generates variations of a prompt
+import asyncio
+import logging
 from typing import List, Dict, Any
 from src.axis_augmentation.base_augmenter import BaseAxisAugmenter
-from src.utils.model_client import get_completion
+from src.utils.llm_retry import LLMError
+from src.utils.model_client import aget_completion, get_completion
+
+logger = logging.getLogger(__name__)
 
 
 class OtherAugmenter(BaseAxisAugmenter):
@@ -11,7 +16,10 @@ class OtherAugmenter(BaseAxisAugmenter):
     according to the user's input, using an LLM in the background.
     """
 
-    def __init__(self, n_augments=3, augmentation_title="", augmentation_description="", augmentation_examples=""):
+    io_bound = True
+
+    def __init__(self, n_augments=3, augmentation_title="", augmentation_description="", augmentation_examples="",
+                 seed=0):
         """
         Initialize the context augmenter.
 
@@ -19,8 +27,9 @@ class OtherAugmenter(BaseAxisAugmenter):
             n_augments: Number of variations to generate
             augmentation_title: Title of the augmentation
             augmentation_description: Description of the augmentation
+            seed: Root seed of the augmenter's random streams (default: 0; None for fresh entropy)
         """
-        super().__init__(n_augments=n_augments)
+        super().__init__(n_augments=n_augments, seed=seed)
         self.augmentation_title = augmentation_title
         self.augmentation_description = augmentation_description
         self.augmentation_examples = augmentation_examples
@@ -29,6 +38,12 @@ class OtherAugmenter(BaseAxisAugmenter):
     def get_name(self):
         return "Other Variations " + self.augmentation_title
 
+    def get_cache_config(self):
+        # The meta-prompt is derived from the title and description, and is built lazily
+        config = super().get_cache_config()
+        config.pop("meta_prompt", None)
+        return config
+
     def _create_meta_prompt(self, augmentation_title: str, augmentation_description: str) -> str:
         """
         Create a meta-prompt to ask the language model to add context.
@@ -96,20 +111,38 @@ class OtherAugmenter(BaseAxisAugmenter):
         variations = [input_text]  # Start with the original prompt
 
         # Generate n_augments-1 variations (since we already have the original)
-        for _ in range(self.n_augments - 1):
+        for sample in range(self.n_augments - 1):
             # Generate the variation
-            new_variation = self._generate_variation(input_text)
+            new_variation = self._generate_variation(input_text, sample)
             if new_variation and new_variation != input_text:
                 variations.append(new_variation)
 
         return variations
 
-    def _generate_variation(self, text: str) -> str:
+    async def aaugment(self, input_text: str, identification_data: Dict[str, Any] = None) -> List[str]:
+        """
+        Async counterpart of augment: all the LLM calls of the text are issued concurrently.
+
+        Args:
+            input_text: The original prompt text
+            identification_data: Data from the identifier (not used in this augmenter)
+
+        Returns:
+            List of variations with added context
+        """
+        if not self.meta_prompt:
+            self.meta_prompt = self._create_meta_prompt(self.augmentation_title, self.augmentation_description)
+        new_variations = await asyncio.gather(
+            *(self._agenerate_variation(input_text, sample) for sample in range(self.n_augments - 1)))
+        return [input_text] + [variation for variation in new_variations if variation and variation != input_text]
+
+    def _generate_variation(self, text: str, sample: int = 0) -> str:
         """
         Generate a single variation by adding context.
 
         Args:
             text: The original text
+            sample: Index of the variation, so concurrent requests for the same text are not coalesced
 
         Returns:
             A new variation of the text
@@ -117,13 +150,37 @@ class OtherAugmenter(BaseAxisAugmenter):
         # Call language model to generate the variation
         try:
             temp = self.meta_prompt + f"Input Text: {text} \nReturn only the augmented result as a Python string."
-            result = get_completion(self.meta_prompt + text)
+            result = get_completion(self.meta_prompt + text, sample=sample)
             # Check if the result is valid (not empty and not the same as the original prompt and the original prompt is in the result)
             if result and result != text:
                 return result
             else:
                 return text
-        except Exception as e:
+        except LLMError as error:
+            # Counted by the retry policy (see get_client_stats); the text is kept as is
+            logger.warning("OtherAugmenter variation failed: %s", error)
+            return text
+
+    async def _agenerate_variation(self, text: str, sample: int = 0) -> str:
+        """
+        Async counterpart of _generate_variation.
+
+        Args:
+            text: The original text
+            sample: Index of the variation, so concurrent requests for the same text are not coalesced
+
+        Returns:
+            A new variation of the text
+        """
+        try:
+            result = await aget_completion(self.meta_prompt + text, sample=sample)
+            if result and result != text:
+                return result
+            else:
+                return text
+        except LLMError as error:
+            # Counted by the retry policy (see get_client_stats); the text is kept as is
+            logger.warning("OtherAugmenter variation failed: %s", error)
             return text
 
 
@@ -1,6 +1,6 @@
 from src.axis_augmentation.base_augmenter import BaseAxisAugmenter
 from typing import List
-from src.utils.model_client import get_completion
+from src.utils.model_client import aget_completion, get_completion
 import ast
 
 
@@ -23,14 +23,17 @@ talkative_template = (
 
 
 class Paraphrase(BaseAxisAugmenter):
-    def __init__(self, n_augments: int = 1):
+    io_bound = True
+
+    def __init__(self, n_augments: int = 1, seed=0):
         """
         Initialize the paraphrse augmenter.
 
         Args:
             k: number of paraphrase needed
+            seed: Root seed of the augmenter's random streams (default: 0; None for fresh entropy)
         """
-        super().__init__(n_augments=n_augments)
+        super().__init__(n_augments=n_augments, seed=seed)
 
     def build_rephrasing_prompt(self, template: str, n_augments: int, prompt: str) -> \
             str:
@@ -41,6 +44,11 @@ class Paraphrase(BaseAxisAugmenter):
         response = get_completion(prompt)
         return ast.literal_eval(response)
 
+    async def aaugment(self, prompt: str, identification_data=None) -> List[str]:
+        prompt = self.build_rephrasing_prompt(talkative_template, self.n_augments, prompt)
+        response = await aget_completion(prompt)
+        return ast.literal_eval(response)
+
 
 if __name__ == '__main__':
     para = Paraphrase(10)
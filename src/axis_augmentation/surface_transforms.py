@@ -0,0 +1,424 @@
+"""
+Vectorized text surface transforms operating on numpy arrays of unicode codepoints.
+
+Each transform ("kernel") takes a 1-D uint32 codepoint buffer and a numpy Generator and
+returns the transformed buffer. Length-preserving kernels work in place, so several of
+them can be chained over the same buffer; a TransformPlan compiles an ordered subset of
+techniques into such a chain, so a text is encoded and decoded only once.
+
+The length-preserving kernels only use uniform draws indexed by position, so instead of a
+Generator they also accept precomputed draws from keyed_uniforms. These come from one
+counter-based stream per text, so a whole batch of texts is transformed in a single pass
+while each text gets the same outputs as when it is transformed alone.
+"""
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.utils.constants import TextSurfaceAugmenterConstants
+
+
+def encode_texts(texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encode texts into a single flat array of unicode codepoints.
+
+    Args:
+        texts: List of texts to encode.
+
+    Returns:
+        A tuple of (codepoints, offsets) where text i occupies codepoints[offsets[i]:offsets[i + 1]].
+    """
+    codes = np.frombuffer("".join(texts).encode("utf-32-le"), dtype=np.uint32).copy()
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in texts], out=offsets[1:])
+    return codes, offsets
+
+
+def decode_codes(codes: np.ndarray) -> str:
+    """Decode a 1-D codepoint array back into a string."""
+    return codes.astype(np.uint32, copy=False).tobytes().decode("utf-32-le")
+
+
+def decode_rows(rows: np.ndarray, offsets: np.ndarray) -> List[List[str]]:
+    """
+    Decode a 2-D codepoint array (one row per output) back into texts.
+
+    Args:
+        rows: Array of shape (max_outputs, total_length) holding the augmented codepoints.
+        offsets: Text boundaries as returned by encode_texts.
+
+    Returns:
+        List with, for each input text, the list of its augmented outputs.
+    """
+    decoded = [decode_codes(row) for row in rows]
+    return [[row[offsets[i]:offsets[i + 1]] for row in decoded] for i in range(len(offsets) - 1)]
+
+
+_GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """SplitMix64 output function, applied in place to a uint64 array (wrapping arithmetic)."""
+    values ^= values >> np.uint64(30)
+    values *= np.uint64(0xBF58476D1CE4E5B9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94D049BB133111EB)
+    values ^= values >> np.uint64(31)
+    return values
+
+
+def keyed_uniforms(keys: np.ndarray, offsets: np.ndarray, n_rows: int, n_draws: int) -> np.ndarray:
+    """
+    Draw uniforms for every position of a batch of texts repeated over several rows.
+
+    Each text has its own SplitMix64 stream, seeded by its key and indexed by (draw, row,
+    position within the text), so its draws do not depend on the rest of the batch.
+
+    Args:
+        keys: One uint64 stream key per text.
+        offsets: Text boundaries as returned by encode_texts.
+        n_rows: Number of rows (outputs) the texts are repeated over.
+        n_draws: Number of uniforms per position.
+
+    Returns:
+        Array of shape (n_draws, n_rows * total_length) of uniforms in [0, 1), aligned with
+        the flattened (n_rows, total_length) codepoint array.
+    """
+    lengths = np.diff(offsets)
+    total = int(offsets[-1])
+    column_keys = np.repeat(np.asarray(keys, dtype=np.uint64), lengths)
+    local_positions = (np.arange(total, dtype=np.int64) - np.repeat(offsets[:-1], lengths)).astype(np.uint64)
+    uniforms = np.empty((n_draws, n_rows * total), dtype=np.float64)
+    bits = np.empty(total, dtype=np.uint64)
+    # One (draw, row) slice at a time, so the temporaries stay small
+    for counter in range(n_draws * n_rows):
+        draw, row = divmod(counter, n_rows)
+        np.bitwise_or(local_positions, np.uint64(counter << 32), out=bits)
+        bits *= _GOLDEN_GAMMA
+        bits += column_keys
+        _mix64(bits)
+        bits >>= np.uint64(11)
+        np.multiply(bits, 2.0 ** -53, out=uniforms[draw, row * total:(row + 1) * total])
+    return uniforms
+
+
+def position_uniforms(rng, n_draws: int, size: int) -> np.ndarray:
+    """
+    Get n_draws uniforms per position of a buffer.
+
+    Args:
+        rng: A numpy Generator, or an array of at least n_draws rows of precomputed uniforms
+            (see keyed_uniforms).
+        n_draws: Number of uniforms per position.
+        size: Length of the buffer.
+
+    Returns:
+        Array of shape (n_draws, size).
+    """
+    if isinstance(rng, np.ndarray):
+        return rng[:n_draws]
+    return rng.random((n_draws, size))
+
+
+def build_keyboard_table(keyboard: Dict[str, str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Precompute the neighbour-index table of a keyboard layout for vectorized lookups.
+
+    Args:
+        keyboard: Mapping from a lowercase key to the string of its neighbouring keys.
+
+    Returns:
+        A tuple of (neighbours, upper_neighbours, counts) indexed by the codepoint of the key.
+        Row k holds the codepoints of the neighbours of chr(k) (lowercase and uppercase),
+        and counts[k] is the number of neighbours (0 for keys that are not in the layout).
+    """
+    width = max(len(neighbours) for neighbours in keyboard.values())
+    size = max(ord(key) for key in keyboard) + 1
+    neighbours = np.zeros((size, width), dtype=np.uint32)
+    upper_neighbours = np.zeros((size, width), dtype=np.uint32)
+    counts = np.zeros(size, dtype=np.int64)
+    for key, keys_nearby in keyboard.items():
+        counts[ord(key)] = len(keys_nearby)
+        neighbours[ord(key), :len(keys_nearby)] = [ord(c) for c in keys_nearby]
+        upper_neighbours[ord(key), :len(keys_nearby)] = [ord(c.upper()) for c in keys_nearby]
+    return neighbours, upper_neighbours, counts
+
+
+KEYBOARD_TABLES = {
+    "querty": build_keyboard_table(TextSurfaceAugmenterConstants.QUERTY_KEYBOARD),
+}
+
+# Case flip and whitespace tables for ASCII; other codepoints are resolved per buffer
+_ASCII_CASE_FLIP = np.array([ord(chr(c).swapcase()) for c in range(128)], dtype=np.uint32)
+_ASCII_SPACE = np.array([chr(c).isspace() for c in range(128)], dtype=bool)
+
+# Punctuation index of each ASCII codepoint (-1 if not a mark) and, per mark, the other marks
+_PUNCTUATION_INDEX = np.full(128, -1, dtype=np.int64)
+for _i, _mark in enumerate(TextSurfaceAugmenterConstants.PUNCTUATION_MARKS):
+    _PUNCTUATION_INDEX[ord(_mark)] = _i
+_PUNCTUATION_REPLACEMENTS = np.array(
+    [[ord(p) for p in TextSurfaceAugmenterConstants.PUNCTUATION_MARKS if p != mark]
+     for mark in TextSurfaceAugmenterConstants.PUNCTUATION_MARKS],
+    dtype=np.uint32,
+)
+
+# White space options as codepoints; empty options are kept with a length of 0
+_WHITE_SPACE_CODES = np.array([ord(option) if option else 0
+                               for option in TextSurfaceAugmenterConstants.WHITE_SPACE_OPTIONS], dtype=np.uint32)
+_WHITE_SPACE_LENGTHS = np.array([len(option) for option in TextSurfaceAugmenterConstants.WHITE_SPACE_OPTIONS],
+                                dtype=np.int64)
+assert _WHITE_SPACE_LENGTHS.max() <= 1, "white space options must be single characters"
+
+
+def case_flip_table(codes: np.ndarray) -> np.ndarray:
+    """
+    Map every codepoint to its case-flipped codepoint.
+
+    Args:
+        codes: Codepoint array.
+
+    Returns:
+        Array of the same shape; characters without a single-character case counterpart map to themselves.
+    """
+    ascii_codes = codes < 128
+    flipped = np.where(ascii_codes, _ASCII_CASE_FLIP[np.where(ascii_codes, codes, 0)], codes)
+    if not ascii_codes.all():
+        other = ~ascii_codes
+        unique_codes, inverse = np.unique(codes[other], return_inverse=True)
+        mapped = np.empty(len(unique_codes), dtype=np.uint32)
+        for i, code in enumerate(unique_codes):
+            char = chr(code)
+            swapped = char.lower() if char.isupper() else char.upper() if char.islower() else char
+            mapped[i] = ord(swapped) if len(swapped) == 1 else code
+        flipped[other] = mapped[inverse]
+    return flipped
+
+
+def isspace_mask(codes: np.ndarray) -> np.ndarray:
+    """Return a boolean mask of the whitespace codepoints (as defined by str.isspace)."""
+    ascii_codes = codes < 128
+    mask = np.where(ascii_codes, _ASCII_SPACE[np.where(ascii_codes, codes, 0)], False)
+    if not ascii_codes.all():
+        other = ~ascii_codes
+        unique_codes, inverse = np.unique(codes[other], return_inverse=True)
+        mask[other] = np.array([chr(code).isspace() for code in unique_codes], dtype=bool)[inverse]
+    return mask
+
+
+def apply_typos(codes: np.ndarray, rng, prob: float, keyboard: str = "querty") -> np.ndarray:
+    """
+    Replace keys by a neighbouring key with probability prob, preserving case (in place).
+
+    Args:
+        codes: Codepoint buffer.
+        rng: Generator to draw from, or 2 rows of uniforms per position (see position_uniforms).
+        prob: Probability of a typo for each key of the layout.
+        keyboard: Keyboard layout (a key of KEYBOARD_TABLES).
+
+    Returns:
+        The modified buffer.
+    """
+    neighbours, upper_neighbours, counts = KEYBOARD_TABLES[keyboard]
+    is_upper = (codes >= ord("A")) & (codes <= ord("Z"))
+    lower_codes = np.where(is_upper, codes + (ord("a") - ord("A")), codes)
+    in_table = lower_codes < len(counts)
+    keys = np.where(in_table, lower_codes, 0).astype(np.int64)
+    key_counts = np.where(in_table, counts[keys], 0)
+
+    uniforms = position_uniforms(rng, 2, len(codes))
+    positions = np.flatnonzero((key_counts > 0) & (uniforms[0] < prob))
+    picks = (uniforms[1][positions] * key_counts[positions]).astype(np.int64)
+    codes[positions] = np.where(is_upper[positions],
+                                upper_neighbours[keys[positions], picks],
+                                neighbours[keys[positions], picks])
+    return codes
+
+
+def apply_case_change(codes: np.ndarray, rng, prob: float) -> np.ndarray:
+    """
+    Flip the case of each cased character with probability prob (in place).
+
+    Args:
+        codes: Codepoint buffer.
+        rng: Generator to draw from, or 1 row of uniforms per position (see position_uniforms).
+        prob: Probability of changing the case of each character.
+
+    Returns:
+        The modified buffer.
+    """
+    flipped = case_flip_table(codes)
+    mask = (flipped != codes) & (position_uniforms(rng, 1, len(codes))[0] < prob)
+    codes[mask] = flipped[mask]
+    return codes
+
+
+def apply_punctuation_switch(codes: np.ndarray, rng, prob: float) -> np.ndarray:
+    """
+    Replace each punctuation mark by a different mark with probability prob (in place).
+
+    Args:
+        codes: Codepoint buffer.
+        rng: Generator to draw from, or 2 rows of uniforms per position (see position_uniforms).
+        prob: Probability of switching each punctuation mark.
+
+    Returns:
+        The modified buffer.
+    """
+    ascii_codes = codes < 128
+    marks = np.where(ascii_codes, _PUNCTUATION_INDEX[np.where(ascii_codes, codes, 0)], -1)
+    uniforms = position_uniforms(rng, 2, len(codes))
+    positions = np.flatnonzero((marks >= 0) & (uniforms[0] < prob))
+    picks = (uniforms[1][positions] * _PUNCTUATION_REPLACEMENTS.shape[1]).astype(np.int64)
+    codes[positions] = _PUNCTUATION_REPLACEMENTS[marks[positions], picks]
+    return codes
+
+
+def apply_swaps(codes: np.ndarray, rng, prob: float,
+                boundaries: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Swap each pair of adjacent characters with probability prob (in place).
+
+    Swaps are applied in a random order, as in the NL-Augmenter implementation. Isolated
+    swaps commute with every other swap and are applied at once; only chains of adjacent
+    swaps, whose order matters, are applied one by one.
+
+    Args:
+        codes: Codepoint buffer.
+        rng: Generator to draw from, or 2 rows of uniforms per position (see position_uniforms).
+        prob: Probability of swapping each pair of adjacent characters.
+        boundaries: Optional boolean mask marking the last character of each text in the buffer;
+            pairs that would cross a boundary are never swapped.
+
+    Returns:
+        The modified buffer.
+    """
+    num_pairs = len(codes) - 1
+    if num_pairs < 1:
+        return codes
+    uniforms = position_uniforms(rng, 2, len(codes))
+    selected = uniforms[0][:num_pairs] < prob
+    if boundaries is not None:
+        selected &= ~boundaries[:-1]
+    if not selected.any():
+        return codes
+
+    chained = np.zeros(num_pairs, dtype=bool)
+    chained[1:] |= selected[1:] & selected[:-1]
+    chained[:-1] |= selected[:-1] & selected[1:]
+    isolated = np.flatnonzero(selected & ~chained)
+    codes[isolated], codes[isolated + 1] = codes[isolated + 1], codes[isolated].copy()
+    # Sorting by a uniform draw applies the chained swaps in a random order
+    chained_indices = np.flatnonzero(chained)
+    for index in chained_indices[np.argsort(uniforms[1][chained_indices], kind="stable")]:
+        codes[index], codes[index + 1] = codes[index + 1], codes[index]
+    return codes
+
+
+def apply_white_spaces(codes: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    Replace every run of whitespace by a random sequence of white space options.
+
+    Args:
+        codes: Codepoint buffer.
+        rng: Generator to draw from.
+
+    Returns:
+        A new buffer (the length changes with the new white space).
+    """
+    space = isspace_mask(codes)
+    if not space.any():
+        return codes
+    run_starts = np.flatnonzero(space & ~np.concatenate(([False], space[:-1])))
+
+    # Sample the length of every run, then the option of every character of every run
+    counts = rng.integers(TextSurfaceAugmenterConstants.MIN_WHITESPACE_COUNT,
+                          TextSurfaceAugmenterConstants.MAX_WHITESPACE_COUNT + 1, len(run_starts))
+    picks = rng.integers(TextSurfaceAugmenterConstants.MIN_WHITESPACE_INDEX,
+                         TextSurfaceAugmenterConstants.MAX_WHITESPACE_INDEX + 1, counts.sum())
+    non_empty = _WHITE_SPACE_LENGTHS[picks] > 0
+    fill = _WHITE_SPACE_CODES[picks[non_empty]]
+    run_lengths = np.bincount(np.repeat(np.arange(len(run_starts)), counts)[non_empty],
+                              minlength=len(run_starts))
+
+    # Non-space characters keep one slot, each run gets run_lengths slots, other spaces none
+    lengths = (~space).astype(np.int64)
+    lengths[run_starts] = run_lengths
+    out_positions = np.cumsum(lengths) - lengths
+    out = np.empty(lengths.sum(), dtype=np.uint32)
+    out[out_positions[~space]] = codes[~space]
+    run_offsets = np.cumsum(run_lengths) - run_lengths
+    out[np.repeat(out_positions[run_starts] - run_offsets, run_lengths) + np.arange(len(fill))] = fill
+    return out
+
+
+class TransformPlan:
+    """
+    A compiled, ordered subset of text surface techniques.
+
+    Applying a plan encodes the text once, runs every technique over the same codepoint
+    buffer and decodes once, instead of building a new string per technique. Each step
+    draws from the same distribution as the corresponding TextSurfaceAugmenter method,
+    so the result is distributed as the sequential application of the techniques.
+    """
+
+    def __init__(self, techniques: List[str], probs: Dict[str, float] = None, keyboard: str = "querty"):
+        """
+        Compile a plan.
+
+        Args:
+            techniques: Ordered list of techniques.
+                Options: "typos", "capitalization", "spacing", "swap_characters", "punctuation"
+            probs: Optional per-technique probabilities, overriding TECHNIQUE_PROBS.
+            keyboard: Keyboard layout used by the "typos" technique.
+        """
+        if keyboard not in KEYBOARD_TABLES:
+            raise ValueError(f"Keyboard not supported: {keyboard}")
+        probs = {**TextSurfaceAugmenterConstants.TECHNIQUE_PROBS, **(probs or {})}
+        kernels = {
+            "typos": partial(apply_typos, prob=probs.get("typos"), keyboard=keyboard),
+            "capitalization": partial(apply_case_change, prob=probs.get("capitalization")),
+            "spacing": apply_white_spaces,
+            "swap_characters": partial(apply_swaps, prob=probs.get("swap_characters")),
+            "punctuation": partial(apply_punctuation_switch, prob=probs.get("punctuation")),
+        }
+        unknown = [technique for technique in techniques if technique not in kernels]
+        if unknown:
+            raise ValueError(f"Unknown techniques: {unknown}. Choose from: {list(kernels)}")
+        self.techniques = list(techniques)
+        self.steps = [kernels[technique] for technique in techniques]
+
+    def apply_codes(self, codes: np.ndarray, rng: np.random.Generator, max_outputs: int = 1) -> List[np.ndarray]:
+        """
+        Apply the plan to a codepoint buffer.
+
+        Args:
+            codes: Codepoint buffer of the text (left unchanged).
+            rng: Generator to draw from.
+            max_outputs: Number of outputs to generate.
+
+        Returns:
+            List of transformed codepoint buffers.
+        """
+        outputs = []
+        for _ in range(max_outputs):
+            buffer = codes.copy()
+            for step in self.steps:
+                buffer = step(buffer, rng)
+            outputs.append(buffer)
+        return outputs
+
+    def apply(self, text: str, rng: np.random.Generator, max_outputs: int = 1) -> List[str]:
+        """
+        Apply the plan to a text.
+
+        Args:
+            text: The text to transform.
+            rng: Generator to draw from.
+            max_outputs: Number of outputs to generate.
+
+        Returns:
+            List of transformed texts.
+        """
+        codes, _ = encode_texts([text])
+        return [decode_codes(buffer) for buffer in self.apply_codes(codes, rng, max_outputs)]
@@ -1,14 +1,72 @@
 # Non-semantic changes / structural changes (UNI TEXT)
 import itertools
-import random
 import re
-from typing import List
+from functools import lru_cache
+from typing import Iterator, List, Tuple
 
 import numpy as np
 
 from src.axis_augmentation.base_augmenter import BaseAxisAugmenter
+from src.axis_augmentation.surface_transforms import (
+    KEYBOARD_TABLES,
+    TransformPlan,
+    apply_case_change,
+    apply_punctuation_switch,
+    apply_swaps,
+    apply_typos,
+    decode_codes,
+    decode_rows,
+    encode_texts,
+    keyed_uniforms,
+)
 from src.utils.constants import TextSurfaceAugmenterConstants
 
+_WHITE_SPACE_PATTERN = re.compile(r"(\s+)")
+
+
+@lru_cache(maxsize=TextSurfaceAugmenterConstants.WHITE_SPACE_SPLIT_CACHE_SIZE)
+def _split_white_spaces(value: str) -> Tuple[Tuple[str, ...], np.ndarray]:
+    """
+    Split a text into words and whitespace runs (cached, as the same text is augmented repeatedly).
+
+    Args:
+        value: The text to split.
+
+    Returns:
+        A tuple of (tokens, indices of the whitespace runs among the tokens).
+    """
+    words = tuple(_WHITE_SPACE_PATTERN.split(value))
+    return words, np.array([i for i, word in enumerate(words) if word.isspace()], dtype=np.int64)
+
+
+def _build_white_space_runs() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Precompute every whitespace replacement string.
+
+    A replacement of length c is encoded by c option picks, read as the digits of a base-n
+    number (n being the number of allowed options); digits beyond c are ignored.
+
+    Returns:
+        A tuple of (allowed option indices, digit weights, table of replacement strings
+        indexed by [length - MIN_WHITESPACE_COUNT, code]).
+    """
+    picks = np.arange(TextSurfaceAugmenterConstants.MIN_WHITESPACE_INDEX,
+                      TextSurfaceAugmenterConstants.MAX_WHITESPACE_INDEX + 1)
+    max_count = TextSurfaceAugmenterConstants.MAX_WHITESPACE_COUNT
+    digits = len(picks) ** np.arange(max_count)
+    runs = np.empty((max_count - TextSurfaceAugmenterConstants.MIN_WHITESPACE_COUNT + 1, len(picks) ** max_count),
+                    dtype=object)
+    for count in range(TextSurfaceAugmenterConstants.MIN_WHITESPACE_COUNT, max_count + 1):
+        for code, combination in enumerate(itertools.product(picks, repeat=max_count)):
+            # itertools.product varies the last position fastest; code reads position k as digit k
+            positions = combination[::-1]
+            runs[count - TextSurfaceAugmenterConstants.MIN_WHITESPACE_COUNT, code] = "".join(
+                TextSurfaceAugmenterConstants.WHITE_SPACE_OPTIONS[pick] for pick in positions[:count])
+    return picks, digits, runs
+
+
+_WHITE_SPACE_PICKS, _WHITE_SPACE_DIGITS, _WHITE_SPACE_RUNS = _build_white_space_runs()
+
 
 class TextSurfaceAugmenter(BaseAxisAugmenter):
     """
@@ -16,47 +74,87 @@ class TextSurfaceAugmenter(BaseAxisAugmenter):
     This includes simple transformations like adding typos, changing capitalization, etc.
     """
 
-    def __init__(self, n_augments=3):
+    def __init__(self, n_augments=3, seed=0):
         """
         Initialize the non-LLM augmenter.
 
         Args:
             n_augments: Number of variations to generate
+            seed: Root seed of the augmenter's random streams (default: 0; None for fresh entropy)
         """
-        super().__init__(n_augments=n_augments)
+        super().__init__(n_augments=n_augments, seed=seed)
+        self._plans = {}
 
-    def _add_white_spaces_to_single_text(self, value):
+    def _add_white_spaces_to_text(self, value, rng, max_outputs):
         """
-        Add white spaces to the input text.
+        Add white spaces to the input text, generating all outputs at once.
+
+        The text is split once (through the tokenization cache), the length and characters of
+        every whitespace replacement are sampled for all outputs in one draw, and each output
+        is built with a single join.
 
         Args:
             value: The input text to augment.
+            rng: numpy Generator to draw from.
+            max_outputs: Number of augmented outputs.
 
         Returns:
-            Augmented text with added white spaces.
+            List of augmented texts with added white spaces.
         """
-        words = re.split(r"(\s+)", value)
-        new_value = ""
+        words, space_indices = _split_white_spaces(value)
+        if not len(space_indices):
+            return [value] * max_outputs
+
+        # Sample the length and the options of every whitespace run of every output
+        counts = rng.integers(TextSurfaceAugmenterConstants.MIN_WHITESPACE_COUNT,
+                              TextSurfaceAugmenterConstants.MAX_WHITESPACE_COUNT + 1,
+                              (max_outputs, len(space_indices)))
+        picks = rng.integers(0, len(_WHITE_SPACE_PICKS), (max_outputs, len(space_indices),
+                                                           TextSurfaceAugmenterConstants.MAX_WHITESPACE_COUNT))
+        codes = (picks * _WHITE_SPACE_DIGITS).sum(axis=-1)
+        replacements = _WHITE_SPACE_RUNS[counts - TextSurfaceAugmenterConstants.MIN_WHITESPACE_COUNT, codes]
+
+        augmented = []
+        parts = list(words)
+        for output_replacements in replacements:
+            for index, replacement in zip(space_indices, output_replacements):
+                parts[index] = replacement
+            augmented.append("".join(parts))
+        return augmented
+
+    def _transform_rows(self, texts, apply, n_draws, seed=None,
+                        max_outputs=TextSurfaceAugmenterConstants.DEFAULT_MAX_OUTPUTS):
+        """
+        Apply a vectorized codepoint kernel to a whole batch of texts at once.
+
+        All texts are encoded into one codepoint array, repeated max_outputs times, and the
+        kernel runs once over it. Its draws come from keyed_uniforms, with one stream per text,
+        so a batch gives the same outputs as its texts augmented one at a time.
 
-        for word in words:
-            if word.isspace():
-                for j in range(random.randint(
-                        TextSurfaceAugmenterConstants.MIN_WHITESPACE_COUNT,
-                        TextSurfaceAugmenterConstants.MAX_WHITESPACE_COUNT)):
-                    new_value += TextSurfaceAugmenterConstants.WHITE_SPACE_OPTIONS[random.randint(
-                        TextSurfaceAugmenterConstants.MIN_WHITESPACE_INDEX,
-                        TextSurfaceAugmenterConstants.MAX_WHITESPACE_INDEX)]
-            else:
-                new_value += word
-        return new_value
+        Args:
+            texts: List of input texts.
+            apply: Callable(rows, uniforms, offsets) transforming the (max_outputs, total_length) rows in place.
+            n_draws: Number of uniforms the kernel uses per position.
+            seed: Random seed for reproducibility. If None, the augmenter's own stream for each text is used.
+            max_outputs: Maximum number of augmented outputs per text.
 
-    def add_white_spaces(self, inputs, max_outputs=TextSurfaceAugmenterConstants.DEFAULT_MAX_OUTPUTS):
+        Returns:
+            List of lists of augmented texts, one list per input text.
+        """
+        codes, offsets = encode_texts(texts)
+        rows = np.tile(codes, (max_outputs, 1))
+        uniforms = keyed_uniforms(self.get_stream_keys(texts, seed=seed), offsets, max_outputs, n_draws)
+        apply(rows, uniforms, offsets)
+        return decode_rows(rows, offsets)
+
+    def add_white_spaces(self, inputs, max_outputs=TextSurfaceAugmenterConstants.DEFAULT_MAX_OUTPUTS, seed=None):
         """
         Add white spaces to input text(s).
 
         Args:
             inputs: Either a single text string or a list of input texts to augment.
             max_outputs: Maximum number of augmented outputs per input.
+            seed: Random seed for reproducibility. If None, the augmenter's own stream for each text is used.
 
         Returns:
             If inputs is a string: List of augmented texts.
@@ -64,24 +162,13 @@ class TextSurfaceAugmenter(BaseAxisAugmenter):
         """
         # Handle single text input
         if isinstance(inputs, str):
-            augmented_input = []
-            for i in range(max_outputs):
-                augmented_text = self._add_white_spaces_to_single_text(inputs)
-                augmented_input.append(augmented_text)
-            return augmented_input
-
-        # Handle list of texts
-        augmented_texts = []
-        for input_text in inputs:
-            augmented_input = []
-            for i in range(max_outputs):
-                # Apply augmentation
-                cur_augmented_texts = self._add_white_spaces_to_single_text(input_text)
-                augmented_input.append(cur_augmented_texts)
-            augmented_texts.append(augmented_input)
-        return augmented_texts
-
-    def butter_finger(self, text, prob=TextSurfaceAugmenterConstants.DEFAULT_TYPO_PROB, keyboard="querty", seed=0,
+            return self._add_white_spaces_to_text(inputs, self.get_rng(inputs, seed=seed), max_outputs)
+
+        # Handle list of texts, each with its own generator so it is augmented as on its own
+        return [self._add_white_spaces_to_text(input_text, self.get_rng(input_text, seed=seed), max_outputs)
+                for input_text in inputs]
+
+    def butter_finger(self, text, prob=TextSurfaceAugmenterConstants.DEFAULT_TYPO_PROB, keyboard="querty", seed=None,
                       max_outputs=TextSurfaceAugmenterConstants.DEFAULT_MAX_OUTPUTS):
         """
         Introduce typos in the text by simulating butter fingers on a keyboard.
@@ -90,40 +177,41 @@ class TextSurfaceAugmenter(BaseAxisAugmenter):
             text: Input text to augment.
             prob: Probability of introducing a typo for each character.
             keyboard: Keyboard layout to use.
-            seed: Random seed for reproducibility.
+            seed: Random seed for reproducibility. If None, the augmenter's own stream is used.
             max_outputs: Maximum number of augmented outputs.
 
         Returns:
             List of texts with typos.
         """
-        random.seed(seed)
-        key_approx = TextSurfaceAugmenterConstants.QUERTY_KEYBOARD if keyboard == "querty" else {}
+        return self.butter_finger_batch([text], prob=prob, keyboard=keyboard, seed=seed, max_outputs=max_outputs)[0]
+
+    def butter_finger_batch(self, texts, prob=TextSurfaceAugmenterConstants.DEFAULT_TYPO_PROB, keyboard="querty",
+                            seed=None, max_outputs=TextSurfaceAugmenterConstants.DEFAULT_MAX_OUTPUTS):
+        """
+        Introduce keyboard typos in a batch of texts at once.
+
+        All texts are encoded into one codepoint array, which is repeated max_outputs times,
+        so a single Bernoulli mask and a single neighbour lookup produce every variation.
 
-        if not key_approx:
+        Args:
+            texts: List of input texts to augment.
+            prob: Probability of introducing a typo for each character.
+            keyboard: Keyboard layout to use.
+            seed: Random seed for reproducibility. If None, the augmenter's own stream for each text is used.
+            max_outputs: Maximum number of augmented outputs per text.
+
+        Returns:
+            List of lists of texts with typos, one list per input text.
+        """
+        if keyboard not in KEYBOARD_TABLES:
             print("Keyboard not supported.")
-            return [text]
-
-        prob_of_typo = int(prob * 100)
-        perturbed_texts = []
-        for _ in itertools.repeat(None, max_outputs):
-            butter_text = ""
-            for letter in text:
-                lcletter = letter.lower()
-                if lcletter not in key_approx.keys():
-                    new_letter = lcletter
-                else:
-                    if random.choice(range(0, 100)) <= prob_of_typo:
-                        new_letter = random.choice(key_approx[lcletter])
-                    else:
-                        new_letter = lcletter
-                # go back to original case
-                if not lcletter == letter:
-                    new_letter = new_letter.upper()
-                butter_text += new_letter
-            perturbed_texts.append(butter_text)
-        return perturbed_texts
-
-    def change_char_case(self, text, prob=TextSurfaceAugmenterConstants.DEFAULT_CASE_CHANGE_PROB, seed=0,
+            return [[text] for text in texts]
+
+        return self._transform_rows(
+            texts, lambda rows, uniforms, offsets: apply_typos(rows.reshape(-1), uniforms, prob, keyboard),
+            n_draws=2, seed=seed, max_outputs=max_outputs)
+
+    def change_char_case(self, text, prob=TextSurfaceAugmenterConstants.DEFAULT_CASE_CHANGE_PROB, seed=None,
                          max_outputs=TextSurfaceAugmenterConstants.DEFAULT_MAX_OUTPUTS):
         """
         Change the case of characters in the text.
@@ -131,29 +219,36 @@ class TextSurfaceAugmenter(BaseAxisAugmenter):
         Args:
             text: Input text to augment.
             prob: Probability of changing the case of each character.
-            seed: Random seed for reproducibility.
+            seed: Random seed for reproducibility. If None, the augmenter's own stream is used.
             max_outputs: Maximum number of augmented outputs.
 
         Returns:
             List of texts with modified character cases.
         """
-        random.seed(seed)
-        results = []
-        for _ in range(max_outputs):
-            result = []
-            for c in text:
-                if c.isupper() and random.random() < prob:
-                    result.append(c.lower())
-                elif c.islower() and random.random() < prob:
-                    result.append(c.upper())
-                else:
-                    result.append(c)
-            result = "".join(result)
-            results.append(result)
-        return results
-
-
-    def swap_characters(self, text, prob=TextSurfaceAugmenterConstants.DEFAULT_TYPO_PROB, seed=0,
+        return self.change_char_case_batch([text], prob=prob, seed=seed, max_outputs=max_outputs)[0]
+
+    def change_char_case_batch(self, texts, prob=TextSurfaceAugmenterConstants.DEFAULT_CASE_CHANGE_PROB, seed=None,
+                               max_outputs=TextSurfaceAugmenterConstants.DEFAULT_MAX_OUTPUTS):
+        """
+        Change the case of characters in a batch of texts at once.
+
+        The case-flipped codepoint of every character comes from a translate table, and a
+        single mask over texts x max_outputs decides which characters are flipped.
+
+        Args:
+            texts: List of input texts to augment.
+            prob: Probability of changing the case of each character.
+            seed: Random seed for reproducibility. If None, the augmenter's own stream for each text is used.
+            max_outputs: Maximum number of augmented outputs per text.
+
+        Returns:
+            List of lists of texts with modified character cases, one list per input text.
+        """
+        return self._transform_rows(
+            texts, lambda rows, uniforms, offsets: apply_case_change(rows.reshape(-1), uniforms, prob),
+            n_draws=1, seed=seed, max_outputs=max_outputs)
+
+    def swap_characters(self, text, prob=TextSurfaceAugmenterConstants.DEFAULT_TYPO_PROB, seed=None,
                         max_outputs=TextSurfaceAugmenterConstants.DEFAULT_MAX_OUTPUTS):
         """
         Swaps characters in text, with probability prob for ang given pair.
@@ -161,131 +256,187 @@ class TextSurfaceAugmenter(BaseAxisAugmenter):
         Arguments:
             text (string): text to transform
             prob (float): probability of any two characters swapping. Default: 0.05
-            seed (int): random seed
+            seed (int): random seed. If None, the augmenter's own stream for this text is used.
             max_outputs: Maximum number of augmented outputs.
             (taken from the NL-Augmenter project)
+
+        Returns:
+            List of texts with swapped characters (always a list, also for texts shorter than two characters).
         """
-        results = []
-        for _ in range(max_outputs):
-            max_seed = 2 ** 32
-            # seed with hash so each text of same length gets different treatment.
-            np.random.seed((seed + sum([ord(c) for c in text])) % max_seed)
-            # np.random.seed((seed) % max_seed).
-            # number of possible characters to swap.
-            num_pairs = len(text) - 1
-            # if no pairs, do nothing
-            if num_pairs < 1:
-                return text
-            # get indices to swap.
-            indices_to_swap = np.argwhere(
-                np.random.rand(num_pairs) < prob
-            ).reshape(-1)
-            # shuffle swapping order, may matter if there are adjacent swaps.
-            np.random.shuffle(indices_to_swap)
-            # convert to list.
-            text = list(text)
-            # swap.
-            for index in indices_to_swap:
-                text[index], text[index + 1] = text[index + 1], text[index]
-            # convert to string.
-            text = "".join(text)
-            results.append(text)
-        return results
-
-    def switch_punctuation(self, text, prob=TextSurfaceAugmenterConstants.DEFAULT_TYPO_PROB, seed=0, max_outputs=TextSurfaceAugmenterConstants.DEFAULT_MAX_OUTPUTS):
+        return self.swap_characters_batch([text], prob=prob, seed=seed, max_outputs=max_outputs)[0]
+
+    def swap_characters_batch(self, texts, prob=TextSurfaceAugmenterConstants.DEFAULT_TYPO_PROB, seed=None,
+                              max_outputs=TextSurfaceAugmenterConstants.DEFAULT_MAX_OUTPUTS):
+        """
+        Swap adjacent characters in a batch of texts at once.
+
+        The texts are laid out as a 2-D codepoint array with one row per output. A swap mask
+        marking the last character of every text is precomputed once, so pairs never cross
+        from one text (or row) into the next.
+
+        Arguments:
+            texts: list of texts to transform
+            prob (float): probability of any two characters swapping. Default: 0.05
+            seed (int): random seed. If None, the augmenter's own stream for each text is used.
+            max_outputs: Maximum number of augmented outputs per text.
+
+        Returns:
+            List of lists of texts with swapped characters, one list per input text.
+        """
+        def swap_rows(rows, uniforms, offsets):
+            text_ends = np.zeros(rows.shape[1], dtype=bool)
+            ends = offsets[1:] - 1
+            text_ends[ends[ends >= 0]] = True
+            apply_swaps(rows.reshape(-1), uniforms, prob, boundaries=np.tile(text_ends, len(rows)))
+
+        return self._transform_rows(texts, swap_rows, n_draws=2, seed=seed, max_outputs=max_outputs)
+
+    def switch_punctuation(self, text, prob=TextSurfaceAugmenterConstants.DEFAULT_TYPO_PROB, seed=None, max_outputs=TextSurfaceAugmenterConstants.DEFAULT_MAX_OUTPUTS):
         """
         Switches punctuation in text with a probability of prob.
         Arguments:
             text (string): text to transform
             prob (float): probability of any two characters switching. Default: 0.05
-            seed (int): random seed
+            seed (int): random seed. If None, the augmenter's own stream for this text is used.
             max_outputs: Maximum number of augmented outputs.
         """
-        results = []
-        for _ in range(max_outputs):
-            np.random.seed(seed)
-            text_chars = list(text)
-            for i in range(len(text_chars)):
-                if text_chars[i] in TextSurfaceAugmenterConstants.PUNCTUATION_MARKS and np.random.rand() < prob:
-                    # Randomly select a different punctuation mark to switch with
-                    new_punctuation = np.random.choice([p for p in TextSurfaceAugmenterConstants.PUNCTUATION_MARKS
-                                                        if p != text_chars[i]])
-                    text_chars[i] = new_punctuation
-            results.append("".join(text_chars))
-        return results
+        return self.switch_punctuation_batch([text], prob=prob, seed=seed, max_outputs=max_outputs)[0]
 
-    def augment(self, text: str, techniques: List[str] = None) -> List[str]:
+    def switch_punctuation_batch(self, texts, prob=TextSurfaceAugmenterConstants.DEFAULT_TYPO_PROB, seed=None,
+                                 max_outputs=TextSurfaceAugmenterConstants.DEFAULT_MAX_OUTPUTS):
         """
-        Apply text surface transformations to generate variations.
+        Switch punctuation in a batch of texts at once.
+
+        Marks are located through a lookup table over PUNCTUATION_MARKS and replaced through a
+        precomputed matrix holding, for each mark, every other mark.
+
+        Arguments:
+            texts: list of texts to transform
+            prob (float): probability of switching each punctuation mark. Default: 0.05
+            seed (int): random seed. If None, the augmenter's own stream for each text is used.
+            max_outputs: Maximum number of augmented outputs per text.
+
+        Returns:
+            List of lists of texts with switched punctuation, one list per input text.
+        """
+        return self._transform_rows(
+            texts, lambda rows, uniforms, offsets: apply_punctuation_switch(rows.reshape(-1), uniforms, prob),
+            n_draws=2, seed=seed, max_outputs=max_outputs)
+
+    def clear_caches(self):
+        """
+        Clear the compiled transform plans and the process-wide whitespace tokenization cache.
+        """
+        self._plans.clear()
+        _split_white_spaces.cache_clear()
+
+    def compile_plan(self, techniques: List[str], probs=None, keyboard="querty") -> TransformPlan:
+        """
+        Compile an ordered subset of techniques into a single-pass transform plan.
+
+        Plans are cached on the augmenter, so compiling the same sequence again is free.
+
+        Args:
+            techniques: Ordered list of techniques (see augment for the options)
+            probs: Optional per-technique probabilities, overriding TextSurfaceAugmenterConstants.TECHNIQUE_PROBS
+            keyboard: Keyboard layout used by the "typos" technique
+
+        Returns:
+            The compiled TransformPlan
+        """
+        key = (tuple(techniques), tuple(sorted((probs or {}).items())), keyboard)
+        if key not in self._plans:
+            self._plans[key] = TransformPlan(techniques, probs=probs, keyboard=keyboard)
+        return self._plans[key]
+
+    def transform(self, text: str, techniques: List[str], probs=None, seed=None,
+                  max_outputs=TextSurfaceAugmenterConstants.DEFAULT_MAX_OUTPUTS) -> List[str]:
+        """
+        Apply an ordered subset of techniques to a text in one pass over its codepoint buffer.
+
+        The result is distributed as the sequential application of the corresponding methods
+        (butter_finger, change_char_case, add_white_spaces, swap_characters, switch_punctuation),
+        but the text is encoded and decoded only once per output.
+
+        Args:
+            text: The text to transform
+            techniques: Ordered list of techniques (see augment for the options)
+            probs: Optional per-technique probabilities
+            seed: Random seed for reproducibility. If None, the augmenter's own stream is used.
+            max_outputs: Maximum number of augmented outputs.
+
+        Returns:
+            List of transformed texts
+        """
+        plan = self.compile_plan(techniques, probs=probs)
+        return plan.apply(text, self.get_rng(text, *techniques, seed=seed), max_outputs)
+
+    def iter_augment(self, text: str, techniques: List[str] = None, n_augments: int = None) -> Iterator[str]:
+        """
+        Lazily yield unique text surface variations, starting with the original text.
+
+        Techniques are applied in sequence: each technique is applied to every variation
+        produced so far, and every new variation is yielded as soon as it is produced.
+        Duplicates are skipped through a hash set, and generation stops as soon as
+        n_augments distinct variations have been yielded. Variations are kept as codepoint
+        buffers, so the text is encoded once and each technique is a single vectorized pass.
 
         Args:
             text: The text to augment
             techniques: List of techniques to apply in sequence. If None, a default sequence will be used.
-                Options: "typos", "capitalization", "spacing", "swap_characters", "punctuation"
+            n_augments: Number of distinct variations to yield. Defaults to self.n_augments.
 
-        Returns:
-            List of augmented texts including the original text
+        Yields:
+            Unique augmented texts, the original text first
         """
         # Default sequence if none provided
         if techniques is None:
-            techniques = ["typos", "capitalization", "spacing", "swap_characters", "punctuation"]
+            techniques = TextSurfaceAugmenterConstants.DEFAULT_TECHNIQUES
+        if n_augments is None:
+            n_augments = self.n_augments
+        if n_augments < 1:
+            return
 
         # Start with the original text
-        variations = [text]
+        codes, _ = encode_texts([text])
+        variations = [(text, codes)]
+        seen = {text}
+        yield text
+        if n_augments == 1:
+            return
 
         # Apply each technique in sequence
         for technique in techniques:
-            new_variations = []
-
-            # Always keep the original variations
-            new_variations.extend(variations)
-
-            # For each existing variation, apply the current technique
-            for variation in variations:
-                if technique == "typos":
-                    # Add typo variations
-                    typo_results = self.butter_finger(variation, prob=0.1, max_outputs=2)
-                    new_variations.extend(typo_results)
-                elif technique == "capitalization":
-                    # Add case variations
-                    case_results = self.change_char_case(variation, prob=0.15, max_outputs=2)
-                    new_variations.extend(case_results)
-                elif technique == "spacing":
-                    # Add spacing variations
-                    spacing_results = self.add_white_spaces(variation, max_outputs=2)
-                    new_variations.extend(spacing_results)
-                elif technique == "swap_characters":
-                    # Add character swap variations
-                    swap_results = self.swap_characters(variation, max_outputs=2)
-                    new_variations.extend(swap_results)
-                elif technique == "punctuation":
-                    # Add punctuation variations
-                    punctuation_results = self.switch_punctuation(variation, max_outputs=2)
-                    new_variations.extend(punctuation_results)
-
-            # Update variations for the next technique
-            variations = new_variations
-
-            # If we already have enough variations, we can stop
-            if len(variations) >= self.n_augments:
-                break
-
-        # Remove duplicates while preserving order
-        unique_variations = []
-        for var in variations:
-            if var not in unique_variations:
-                unique_variations.append(var)
-
-        # Ensure we return the requested number of variations
-        if len(unique_variations) > self.n_augments:
-            # Keep the original text and sample from the rest
-            original = unique_variations[0]
-            rest = unique_variations[1:]
-            sampled = random.sample(rest, min(self.n_augments - 1, len(rest)))
-            return [original] + sampled
-
-        return unique_variations
+            plan = self.compile_plan([technique])
+            # Only the variations produced before this technique are transformed by it
+            n_existing = len(variations)
+            for variation, variation_codes in variations[:n_existing]:
+                rng = self.get_rng(variation, technique)
+                for result_codes in plan.apply_codes(variation_codes, rng,
+                                                     TextSurfaceAugmenterConstants.OUTPUTS_PER_TECHNIQUE):
+                    result = decode_codes(result_codes)
+                    if result in seen:
+                        continue
+                    seen.add(result)
+                    variations.append((result, result_codes))
+                    yield result
+                    # If we already have enough variations, we can stop
+                    if len(seen) >= n_augments:
+                        return
+
+    def augment(self, text: str, techniques: List[str] = None) -> List[str]:
+        """
+        Apply text surface transformations to generate variations.
+
+        Args:
+            text: The text to augment
+            techniques: List of techniques to apply in sequence. If None, a default sequence will be used.
+                Options: "typos", "capitalization", "spacing", "swap_characters", "punctuation"
 
+        Returns:
+            List of up to n_augments unique augmented texts, starting with the original text
+        """
+        return list(self.iter_augment(text, techniques))
 
 if __name__ == "__main__":
     # Create the augmenter
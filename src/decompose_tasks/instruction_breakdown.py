@@ -14,6 +14,17 @@ from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
 import argparse
 import traceback # Added for better error reporting
+from concurrent.futures import ThreadPoolExecutor
+
+from src.utils.instrumentation import configure_instrumentation, disable_instrumentation, get_instrumentation
+from src.utils.llm_hedging import configure_hedging, hedged
+from src.utils.llm_retry import CircuitOpenError, LLMError, configure_retry, get_retry_policy
+from src.utils.llm_scheduler import TokenBucket, configure_scheduler, estimate_tokens, get_scheduler
+from src.utils.model_client import (
+    configure_provider, configure_response_cache, get_client_stats, get_model_response, get_provider,
+    lookup_response, single_flight, store_response
+)
+from src.utils.constants import DEFAULT_LLM_CACHE_FILE, FakeLLMConstants
 
 # Load environment variables
 load_dotenv()
@@ -154,7 +165,7 @@ def get_completion(prompt_template: str, input_text: str, model_id: str = "meta-
         prompt_template: The few-shot prompt template (expects '{input_text}')
         input_text: The specific text to process
         model_id: The model identifier (default is meta-llama/llama-3-3-70b-instruct)
-        provider: The API provider to use ('together' or 'rits')
+        provider: The API provider to use ('together', 'rits', or 'fake' for the offline provider)
 
     Returns:
         The generated breakdown string.
@@ -169,10 +180,8 @@ def get_completion(prompt_template: str, input_text: str, model_id: str = "meta-
         # System prompt + user content
         system_content = "You are an AI assistant skilled at analyzing text and breaking it down into predefined components based on examples. Follow the format of the examples precisely."
 
-        if provider.lower() == "together":
-            # Use Together API
-            from src.utils.model_client import get_model_response
-            
+        if provider.lower() in ("together", "fake"):
+            # Use Together API (or the offline fake provider selected in main, with the same client interface)
             messages = [
                 {"role": "system", "content": system_content},
                 {"role": "user", "content": formatted_prompt}
@@ -201,7 +210,7 @@ def get_completion(prompt_template: str, input_text: str, model_id: str = "meta-
                 api_key='/',  # RITS uses header auth
                 base_url=rits_base_url,
                 default_headers={'RITS_API_KEY': rits_api_key},
-                max_retries=2,
+                max_retries=0,  # Retries are handled by the RetryPolicy, outside of the scheduler slots
                 temperature=0.7,
                 max_tokens=1500
             )
@@ -213,12 +222,49 @@ def get_completion(prompt_template: str, input_text: str, model_id: str = "meta-
                 SystemMessage(content=system_content),
                 HumanMessage(content=formatted_prompt)
             ]
-            
-            response = llm.invoke(messages)
-            return response.content.strip()
-        else:
-            raise ValueError(f"Unknown provider: {provider}. Must be 'together' or 'rits'.")
 
+            request_messages = [
+                {"role": "system", "content": system_content},
+                {"role": "user", "content": formatted_prompt}
+            ]
+            request_params = {"temperature": 0.7, "max_tokens": 1500}
+            # RITS responses are keyed apart from the Together ones for the same model name
+            request_model = f"rits:{model_id}"
+            cache_key, cached = lookup_response(request_model, request_messages, request_params)
+            if cached is not None:
+                return cached
+
+            def attempt():
+                estimated_tokens = estimate_tokens(request_messages, max_tokens=1500)
+                with get_scheduler().slot(estimated_tokens) as usage:
+                    # Hedged inside the slot, so the hedging timer starts when the request is sent
+                    response = hedged(lambda: llm.invoke(messages), model_id, estimated_tokens)
+                    token_usage = response.response_metadata.get("token_usage") or {}
+                    usage["tokens"] = token_usage.get("total_tokens")
+                return response, token_usage
+
+            def request() -> str:
+                response, token_usage = get_retry_policy().call(attempt, model_id)
+                instrumentation = get_instrumentation()
+                if instrumentation is not None and token_usage:
+                    instrumentation.record_llm_usage(model_id, token_usage.get("prompt_tokens", 0),
+                                                     token_usage.get("completion_tokens", 0))
+                content = response.content.strip()
+                store_response(cache_key, content)
+                return content
+
+            # Identical rows being decomposed concurrently share one request
+            return single_flight(request_model, request_messages, request_params, request)
+        else:
+            raise ValueError(f"Unknown provider: {provider}. Must be 'together', 'rits' or 'fake'.")
+
+    except CircuitOpenError:
+        # The provider is down: abort the run instead of failing every remaining row
+        raise
+    except LLMError as e:
+        # Typed LLM failures are counted by the retry policy (see get_client_stats)
+        print(f"LLM request failed for input starting with '{input_text[:50]}...': {type(e).__name__}: {e}")
+        return f"ERROR_GENERATING_BREAKDOWN: {type(e).__name__}: {str(e)}"
     except Exception as e:
         print(f"Error getting completion for input starting with '{input_text[:50]}...': {e}")
         traceback.print_exc() # Print full traceback for debugging
@@ -285,8 +331,9 @@ def process_dataframe_with_structure(
     annotation_examples: List[Dict[str, Any]],
     input_column: str,
     model_id: str = "meta-llama/llama-3-3-70b-instruct",
-    delay_seconds: float = 0.5, # Added delay parameter
-    provider: str = "together" # Added provider parameter
+    delay_seconds: float = 0, # Added delay parameter
+    provider: str = "together", # Added provider parameter
+    max_concurrency: int = None
 ) -> pd.DataFrame:
     """
     Processes a dataframe by applying LLM-based decomposition to an input column.
@@ -297,11 +344,17 @@ def process_dataframe_with_structure(
         annotation_examples: List of annotation examples from JSON.
         input_column: Column containing text to analyze.
         model_id: The model identifier.
-        delay_seconds: Delay between API calls to avoid rate limiting.
-        provider: The API provider to use ('together' or 'rits')
+        delay_seconds: Minimum average interval between the starts of two API calls. Calls
+            overlap; the requests-per-minute and tokens-per-minute limits are enforced by the
+            LLM scheduler (see src/utils/llm_scheduler.py). 0 (the default) disables the pacing.
+        provider: The API provider to use ('together', 'rits' or 'fake')
+        max_concurrency: Number of rows processed at once (defaults to the scheduler's cap).
 
     Returns:
         Dataframe with added breakdown, dimensions_json, and individual dimension columns.
+
+    Raises:
+        CircuitOpenError: If the circuit stayed open for max_openings consecutive openings; the rows not started yet are cancelled.
     """
     if input_column not in df.columns:
         raise ValueError(f"Input column '{input_column}' not found in DataFrame. Available columns: {list(df.columns)}")
@@ -318,25 +371,47 @@ def process_dataframe_with_structure(
     total_rows = len(df)
     print(f"Analyzing {total_rows} rows from column '{input_column}'...")
 
-    for i, input_text in enumerate(result_df[input_column]):
-        print(f"Processing row {i+1}/{total_rows}...")
-        # Ensure input is string, handle potential NaN/None
-        if pd.isna(input_text):
-            print(f"Warning: Skipping row {i+1} due to missing input text (NaN).")
-            raw_text_breakdown = "SKIPPED_EMPTY_INPUT"
-            structured_dimensions = {}
-        else:
-            input_text_str = str(input_text)
-            raw_text_breakdown = get_completion(prompt_template, input_text_str, model_id, provider)
-            _, structured_dimensions = parse_llm_breakdown(raw_text_breakdown)
-
-        raw_breakdowns.append(raw_text_breakdown)
-        structured_results.append(structured_dimensions)
-        all_dimension_keys.update(structured_dimensions.keys()) # Update set of keys
-
-        # Add delay
-        if delay_seconds > 0:
-            time.sleep(delay_seconds)
+    def process_row(input_text):
+        input_text_str = str(input_text)
+        raw_text_breakdown = get_completion(prompt_template, input_text_str, model_id, provider)
+        _, structured_dimensions = parse_llm_breakdown(raw_text_breakdown)
+        return raw_text_breakdown, structured_dimensions
+
+    # Rows are processed concurrently; the delay only paces the start of the calls
+    pacer = TokenBucket(60.0 / delay_seconds, capacity=1) if delay_seconds > 0 else None
+    with ThreadPoolExecutor(max_workers=max_concurrency or get_scheduler().max_concurrency) as executor:
+        futures = []
+        for i, input_text in enumerate(result_df[input_column]):
+            # Ensure input is string, handle potential NaN/None
+            if pd.isna(input_text):
+                print(f"Warning: Skipping row {i+1} due to missing input text (NaN).")
+                futures.append(None)
+                continue
+            if pacer is not None:
+                time.sleep(pacer.wait_time(1))
+                pacer.consume(1)
+            futures.append(executor.submit(process_row, input_text))
+
+        # Results are consumed in row order, so progress is reported from this thread only
+        try:
+            for i, future in enumerate(futures):
+                if future is None:
+                    raw_text_breakdown, structured_dimensions = "SKIPPED_EMPTY_INPUT", {}
+                else:
+                    raw_text_breakdown, structured_dimensions = future.result()
+                    print(f"Processed row {i+1}/{total_rows}")
+                raw_breakdowns.append(raw_text_breakdown)
+                structured_results.append(structured_dimensions)
+                all_dimension_keys.update(structured_dimensions.keys()) # Update set of keys
+        except CircuitOpenError as e:
+            print(f"Aborting after {len(raw_breakdowns)}/{total_rows} rows: {e}. "
+                  f"LLM client stats: {get_client_stats()}")
+            executor.shutdown(cancel_futures=True)
+            raise
+
+    n_failed = sum(breakdown.startswith("ERROR_GENERATING_BREAKDOWN") for breakdown in raw_breakdowns)
+    if n_failed:
+        print(f"Warning: {n_failed}/{total_rows} rows failed. LLM client stats: {get_client_stats()}")
 
     # Add base result columns
     result_df["breakdown_text"] = raw_breakdowns
@@ -363,7 +438,7 @@ def main(
     output_csv,
     input_column="prompt",
     model_id=None,
-    delay=0.5,
+    delay=0,
     provider="together",
     memory_mode=False,
     annotations_data=None,
@@ -378,8 +453,8 @@ def main(
         output_csv: Path to the output CSV file or "memory://" prefix if memory_mode=True
         input_column: Name of the column in input_csv that contains the prompts
         model_id: ID of the model to use
-        delay: Delay between requests
-        provider: Provider to use ("together" or "openai")
+        delay: Minimum interval between the starts of two requests (0 for no pacing)
+        provider: Provider to use ("together", "rits" or "fake")
         memory_mode: If True, use data from memory instead of files
         annotations_data: Annotations data if memory_mode=True
         csv_data: CSV data as DataFrame if memory_mode=True
@@ -388,6 +463,10 @@ def main(
         DataFrame with predictions if memory_mode=True, None otherwise
     """
     print(f"Starting instruction breakdown with memory_mode={memory_mode}")
+
+    # Select the fake provider once, before any request (the CLI may already have configured it)
+    if provider.lower() == "fake" and get_provider() != "fake":
+        configure_provider("fake")
     
     # If memory mode, use the provided data
     if memory_mode:
@@ -472,10 +551,36 @@ if __name__ == "__main__":
                         help="Name of the column in the input CSV containing the text to decompose (e.g., 'input', 'prompt').")
     parser.add_argument("--model", type=str, default="meta-llama/llama-3-3-70b-instruct",
                         help="Model identifier for the LLM (default: 'meta-llama/llama-3-3-70b-instruct'). Examples: 'ibm/granite-13b-instruct-v2'.")
-    parser.add_argument("--delay", type=float, default=0.5,
-                        help="Delay in seconds between LLM API calls (default: 0.5). Set to 0 to disable.")
-    parser.add_argument("--provider", type=str, default="together", choices=["together", "rits"],
-                        help="API provider to use (default: 'together'). Options: 'together', 'rits'.")
+    parser.add_argument("--delay", type=float, default=0,
+                        help="Minimum interval in seconds between the starts of two LLM API calls (default: 0, the "
+                             "scheduler adapts the concurrency to the provider).")
+    parser.add_argument("--rpm", type=float, default=None,
+                        help="Maximum LLM requests per minute (default: no limit).")
+    parser.add_argument("--tpm", type=float, default=None,
+                        help="Maximum LLM tokens per minute (default: no limit).")
+    parser.add_argument("--max-concurrency", type=int, default=None,
+                        help="Maximum number of LLM requests in flight; the adaptive window grows up to it (default: 32).")
+    parser.add_argument("--initial-concurrency", type=int, default=None,
+                        help="Starting size of the adaptive concurrency window (default: 16).")
+    parser.add_argument("--fixed-concurrency", action="store_true",
+                        help="Keep max-concurrency requests in flight instead of adapting the window (AIMD).")
+    parser.add_argument("--max-retries", type=int, default=None,
+                        help="Retries of a failed LLM request, with exponential backoff (default: 5).")
+    parser.add_argument("--hedge", action="store_true",
+                        help="Duplicate the LLM requests slower than the observed 95th percentile latency.")
+    parser.add_argument("--provider", type=str, default="together", choices=["together", "rits", "fake"],
+                        help="API provider to use (default: 'together'). Options: 'together', 'rits', "
+                             "'fake' (deterministic offline responses, for load tests).")
+    parser.add_argument("--fake-latency", type=float, default=FakeLLMConstants.LATENCY_MEDIAN_SECONDS,
+                        help="Median latency in seconds of the fake provider (default: 0.05).")
+    parser.add_argument("--fake-failure-rate", type=float, default=FakeLLMConstants.FAILURE_RATE,
+                        help="Fraction of the requests the fake provider fails with a 503 (default: 0).")
+    parser.add_argument("--metrics", type=str, default=None,
+                        help="Optional path of a JSON-lines file receiving the LLM token usage metrics.")
+    parser.add_argument("--llm-cache", type=str, default=None,
+                        help="Optional path of a SQLite file caching the LLM responses across runs.")
+    parser.add_argument("--replay", action="store_true",
+                        help="Only replay the responses of the LLM cache, without calling the API.")
 
     args = parser.parse_args()
 
@@ -489,6 +594,8 @@ if __name__ == "__main__":
             print("Error: TOGETHER_API_KEY environment variable must be set.")
             print("Please create a .env file or set it in your environment.")
             exit()  # Stop execution if config is missing
+    elif args.provider.lower() == "fake":
+        configure_provider("fake", latency_median=args.fake_latency, failure_rate=args.fake_failure_rate)
     elif args.provider.lower() == "rits":
         rits_host = os.getenv("RITS_HOST")
         rits_api_key = os.getenv("RITS_API_KEY")
@@ -497,12 +604,31 @@ if __name__ == "__main__":
             print("Please create a .env file or set them in your environment.")
             exit()  # Stop execution if config is missing
 
-    main(
-        annotation_file=args.annotation,
-        input_csv=args.input,
-        output_csv=args.output,
-        input_column=args.column,
-        model_id=args.model,
-        delay=args.delay,
-        provider=args.provider
-    ) 
\ No newline at end of file
+    if args.metrics:
+        configure_instrumentation(args.metrics)
+    if args.llm_cache or args.replay:
+        configure_response_cache(args.llm_cache or DEFAULT_LLM_CACHE_FILE, replay_only=args.replay)
+    if args.hedge:
+        configure_hedging()
+    if args.max_retries is not None:
+        configure_retry(max_retries=args.max_retries)
+    if args.rpm or args.tpm or args.max_concurrency or args.initial_concurrency or args.fixed_concurrency:
+        scheduler = get_scheduler()
+        configure_scheduler(requests_per_minute=args.rpm, tokens_per_minute=args.tpm,
+                            max_concurrency=args.max_concurrency or scheduler.max_concurrency,
+                            adaptive=not args.fixed_concurrency,
+                            initial_concurrency=args.initial_concurrency or scheduler.initial_concurrency)
+
+    try:
+        main(
+            annotation_file=args.annotation,
+            input_csv=args.input,
+            output_csv=args.output,
+            input_column=args.column,
+            model_id=args.model,
+            delay=args.delay,
+            provider=args.provider
+        )
+    finally:
+        # Write the metrics summary and close the sink, also when the run was aborted
+        disable_instrumentation() 
\ No newline at end of file
@@ -3,9 +3,13 @@ A simplified script that applies augmentation based on dimensions in annotations
 """
 import argparse
 import json
+import logging
 import re
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 
+import pandas as pd
+
+from src.axis_augmentation.augmentation_cache import AugmentationCache
 from src.axis_augmentation.augmentation_pipeline import AugmentationPipeline
 from src.axis_augmentation.context_augmenter import ContextAugmenter
 from src.axis_augmentation.fewshot_augmenter import FewShotAugmenter
@@ -15,8 +19,14 @@ from src.axis_augmentation.paraphrase_instruct import Paraphrase
 from src.axis_augmentation.text_surface_augmenter import TextSurfaceAugmenter
 from src.utils.constants import (
     DEFAULT_ANNOTATIONS_INPUT_FILE,
-    DEFAULT_AUGMENTED_VARIATIONS_OUTPUT_FILE
+    DEFAULT_AUGMENTED_VARIATIONS_OUTPUT_FILE,
+    DEFAULT_LLM_CACHE_FILE
 )
+from src.utils.instrumentation import configure_instrumentation, disable_instrumentation
+from src.utils.llm_hedging import configure_hedging
+from src.utils.model_client import configure_provider, configure_response_cache
+
+logger = logging.getLogger(__name__)
 
 # Define mapping between dimensions and augmenter classes
 DIMENSION_TO_AUGMENTER = {
@@ -30,6 +40,12 @@ DIMENSION_TO_AUGMENTER = {
     "Order of answers": MultipleChoiceAugmenter,
 }
 
+# Augmenter outputs shared by all the parts, so repeated texts are only augmented once
+AUGMENTATION_CACHE = AugmentationCache()
+
+# Observed fan-out of the augmenters, shared so the budget planner learns across parts
+FANOUT_HISTORY = {}
+
 
 def load_annotations(file_path: str) -> List[Dict[str, Any]]:
     """Load annotations from a JSON file."""
@@ -43,31 +59,66 @@ def save_results(results: List[Dict[str, Any]], output_file: str):
         json.dump(results, f, indent=2, ensure_ascii=False)
 
 
-def augment_part(
+def build_few_shot_data(annotations: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Build the few-shot example (input/output pair) of every annotation."""
+    few_shot_data = []
+    for ann in annotations:
+        placeholder_str = ann["placeholder_prompt"]
+        # Remove any placeholders except {CONTEXT}
+        placeholder_str = re.sub(r"\{(?!CONTEXT)[^}]*\}", "", placeholder_str)
+        # Remove text in parentheses
+        placeholder_str = re.sub(r"\([^)]*\)", "", placeholder_str)
+        # Replace {CONTEXT} with the real context
+        real_context = ann["annotations"]["context"]["text"]
+        placeholder_str = placeholder_str.replace("{CONTEXT}", real_context)
+        fs_input = placeholder_str
+        fs_output = ann["annotations"]["output"]["text"]
+        few_shot_data.append({"input": fs_input, "output": fs_output})
+    return few_shot_data
+
+
+def build_augmenters(dimensions: List[str]) -> List[Any]:
+    """
+    Create the augmenters of a list of dimensions.
+
+    Args:
+        dimensions: List of dimensions to apply
+
+    Returns:
+        List of augmenters, in dimension order
+    """
+    augmenters = []
+    for dim in dimensions:
+        if dim in DIMENSION_TO_AUGMENTER:
+            augmenter_class = DIMENSION_TO_AUGMENTER[dim]
+            if augmenter_class == FewShotAugmenter:
+                augmenters.append(augmenter_class(num_examples=2, n_augments=3))
+            else:
+                augmenters.append(augmenter_class(n_augments=3))
+    return augmenters
+
+
+def build_special_data(
         text: str,
         dimensions: List[str],
         part_name: str,
-        annotations: List[Dict[str, Any]],
+        few_shot_dataset: pd.DataFrame,
         current_index: int
-) -> List[str]:
+) -> Dict[str, Any]:
     """
-    Augment a text based on its dimensions.
-    
+    Build the identification data of a part.
+
     Args:
         text: Text to augment
         dimensions: List of dimensions to apply
         part_name: Name of the part (for special handling)
-        annotations: List of all annotations
+        few_shot_dataset: Few-shot examples of all the annotations, shared by all the parts
+            (see build_few_shot_data)
         current_index: Index of the annotation being processed
-        
+
     Returns:
-        List of augmented texts
+        The identification data passed to the augmenters
     """
-    if (not text and part_name != "examples") or not dimensions:
-        return [text]
-
-    # Select augmenters based on dimensions
-    augmenters = []
     special_data = {}
 
     for dim in dimensions:
@@ -75,33 +126,12 @@ def augment_part(
             augmenter_class = DIMENSION_TO_AUGMENTER[dim]
 
             if augmenter_class == FewShotAugmenter:
-                import pandas as pd
-
-                few_shot_data = []
-                for i, ann in enumerate(annotations):
-                    if i != current_index:
-                        placeholder_str = ann["placeholder_prompt"]
-                        # Remove any placeholders except {CONTEXT}
-                        placeholder_str = re.sub(r"\{(?!CONTEXT)[^}]*\}", "", placeholder_str)
-                        # Remove text in parentheses
-                        placeholder_str = re.sub(r"\([^)]*\)", "", placeholder_str)
-                        # Replace {CONTEXT} with the real context
-                        real_context = ann["annotations"]["context"]["text"]
-                        placeholder_str = placeholder_str.replace("{CONTEXT}", real_context)
-                        fs_input = placeholder_str
-                        fs_output = ann["annotations"]["output"]["text"]
-                        few_shot_data.append({"input": fs_input, "output": fs_output})
-
-                few_shot_df = pd.DataFrame(few_shot_data)
-
+                # Every annotation but the current one is a few-shot example
                 special_data = {
-                    "dataset": few_shot_df
+                    "dataset": few_shot_dataset,
+                    "exclude_index": current_index
                 }
 
-                augmenter = augmenter_class(num_examples=2, n_augments=3)
-            else:
-                augmenter = augmenter_class(n_augments=3)
-
             # Special handling for multiple choice
             if augmenter_class == MultipleChoiceAugmenter and part_name == "choices":
                 # Simple parsing of options (assuming format like "A) Option1 B) Option2")
@@ -128,22 +158,118 @@ def augment_part(
                     "markers": markers
                 }
 
-            augmenters.append(augmenter)
+    return special_data
 
-    # If no augmenters selected, return original text
+
+def build_pipeline(dimensions: List[str], budget_aware: bool = False) -> Optional[AugmentationPipeline]:
+    """
+    Create the pipeline of a list of dimensions, or None if no dimension has an augmenter.
+
+    budget_aware is off by default: the planner trims the inputs of each stage, which saves
+    augmenter calls but changes which variations are produced.
+    """
+    augmenters = build_augmenters(dimensions)
     if not augmenters:
+        return None
+    return AugmentationPipeline(augmenters=augmenters, max_variations=5, cache=AUGMENTATION_CACHE,
+                                budget_aware=budget_aware, fanout_history=FANOUT_HISTORY)
+
+
+def should_augment(text: str, dimensions: List[str], part_name: str) -> bool:
+    """Check whether a part has text (examples may be empty) and dimensions to augment."""
+    return bool((text or part_name == "examples") and dimensions)
+
+
+def augment_part(
+        text: str,
+        dimensions: List[str],
+        part_name: str,
+        annotations: List[Dict[str, Any]],
+        current_index: int,
+        budget_aware: bool = False
+) -> List[str]:
+    """
+    Augment a text based on its dimensions.
+    
+    Args:
+        text: Text to augment
+        dimensions: List of dimensions to apply
+        part_name: Name of the part (for special handling)
+        annotations: List of all annotations
+        current_index: Index of the annotation being processed
+        budget_aware: Whether the pipeline only feeds each stage the inputs it needs
+        
+    Returns:
+        List of augmented texts
+    """
+    if not should_augment(text, dimensions, part_name):
+        return [text]
+
+    pipeline = build_pipeline(dimensions, budget_aware)
+
+    # If no augmenters selected, return original text
+    if pipeline is None:
         return [text]
 
-    # Create pipeline with selected augmenters
-    pipeline = AugmentationPipeline(augmenters=augmenters, max_variations=5)
+    few_shot_dataset = pd.DataFrame(build_few_shot_data(annotations))
+    special_data = build_special_data(text, dimensions, part_name, few_shot_dataset, current_index)
 
     # Apply augmentation
     return pipeline.augment(text, special_data)
 
 
-def process_annotations(annotations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def augment_annotation_parts(annotations: List[Dict[str, Any]],
+                             budget_aware: bool = False) -> List[Dict[str, List[str]]]:
+    """
+    Augment the parts of all the annotations.
+
+    Parts with the same name and dimensions share one pipeline, which augments all of them
+    in a single augment_many call.
+
+    Args:
+        annotations: List of all annotations
+        budget_aware: Whether the pipelines only feed each stage the inputs it needs
+
+    Returns:
+        For each annotation, the mapping from part name to its variations
+    """
+    all_part_variations = [{} for _ in annotations]
+    groups = {}
+    few_shot_dataset = None
+
+    for idx, annotation in enumerate(annotations):
+        for part_name, part_data in annotation["annotations"].items():
+            text = part_data["text"]
+            dimensions = part_data.get("dimensions", [])
+            # Parts that are not augmented keep their original text
+            all_part_variations[idx][part_name] = [text]
+            if should_augment(text, dimensions, part_name):
+                groups.setdefault((part_name, tuple(dimensions)), []).append((idx, text))
+
+    for (part_name, dimensions), items in groups.items():
+        pipeline = build_pipeline(list(dimensions), budget_aware)
+
+        # If no augmenters selected, keep the original texts
+        if pipeline is None:
+            continue
+
+        if few_shot_dataset is None:
+            # Built once and shared by every part; each part excludes its own annotation
+            few_shot_dataset = pd.DataFrame(build_few_shot_data(annotations))
+        special_data = [build_special_data(text, list(dimensions), part_name, few_shot_dataset, idx)
+                        for idx, text in items]
+        with pipeline:
+            results = pipeline.augment_many([text for _, text in items], special_data)
+        for item_index, (idx, _) in enumerate(items):
+            all_part_variations[idx][part_name] = results[item_index]
+
+    return all_part_variations
+
+
+def process_annotations(annotations: List[Dict[str, Any]], budget_aware: bool = False) -> List[Dict[str, Any]]:
     """Process all annotations and generate variations."""
     all_results = []
+    all_part_variations = augment_annotation_parts(annotations, budget_aware)
 
     for idx, annotation in enumerate(annotations):
         # Get the placeholder format
@@ -156,15 +282,10 @@ def process_annotations(annotations: List[Dict[str, Any]]) -> List[Dict[str, Any
         }
 
         # Get augmented texts for each part
-        part_variations = {}
+        part_variations = all_part_variations[idx]
 
-        for part_name, part_data in annotation["annotations"].items():
-            text = part_data["text"]
-            dimensions = part_data.get("dimensions", [])
-
-            variations = augment_part(text, dimensions, part_name, annotations, idx)
-            part_variations[part_name] = variations
-            print(f"Generated {len(variations)} variations for {part_name}")
+        for part_name, variations in part_variations.items():
+            logger.info("Generated %d variations for %s", len(variations), part_name)
 
         # Combine variations (limit to 10 combinations per annotation)
         max_combinations = 20
@@ -209,13 +330,13 @@ def process_annotations(annotations: List[Dict[str, Any]]) -> List[Dict[str, Any
     return all_results
 
 
-def main(annotations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def main(annotations: List[Dict[str, Any]], budget_aware: bool = False) -> List[Dict[str, Any]]:
     """Main function to run the annotation augmentation process."""
     # Set input and output paths
     print(f"Loaded {len(annotations)} annotations.")
 
     print("Processing annotations...")
-    results = process_annotations(annotations)
+    results = process_annotations(annotations, budget_aware)
     print(f"Generated variations for {len(results)} annotations.")
     return results
 
@@ -234,12 +355,58 @@ if __name__ == "__main__":
         default=DEFAULT_AUGMENTED_VARIATIONS_OUTPUT_FILE,
         help="Path to the output JSON file for augmented results."
     )
+    parser.add_argument(
+        "--metrics_file",
+        type=str,
+        default=None,
+        help="Optional path to a JSON-lines file receiving the pipeline and LLM metrics."
+    )
+    parser.add_argument(
+        "--llm_cache",
+        type=str,
+        default=None,
+        help="Optional path to a SQLite file caching the LLM responses across runs."
+    )
+    parser.add_argument(
+        "--provider",
+        type=str,
+        default="together",
+        choices=["together", "fake"],
+        help="LLM provider; 'fake' returns deterministic offline responses, for load tests."
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="Duplicate the LLM requests slower than the observed 95th percentile latency."
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help="Only replay the responses of the LLM cache, without calling the API."
+    )
+    parser.add_argument(
+        "--budget_aware",
+        action="store_true",
+        help="Only feed each pipeline stage the inputs it needs to reach max_variations "
+             "(fewer augmenter calls, but different variations)."
+    )
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.metrics_file:
+        configure_instrumentation(args.metrics_file)
+    if args.llm_cache or args.replay:
+        configure_response_cache(args.llm_cache or DEFAULT_LLM_CACHE_FILE, replay_only=args.replay)
+    if args.hedge:
+        configure_hedging()
+    configure_provider(args.provider)
+
     print(f"Loading annotations from {args.input_file}...")
     annotations = load_annotations(args.input_file)
 
-    results = main(annotations)
+    results = main(annotations, budget_aware=args.budget_aware)
     print(f"Saving results to {args.output_file}...")
     save_results(results, args.output_file)
+    # Write the metrics summary and close the sink
+    disable_instrumentation()
     print("Done!")
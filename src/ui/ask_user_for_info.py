@@ -144,7 +144,6 @@ def run_prediction():
         output_csv=out_path,
         input_column="prompt",
         model_id=st.session_state.model_name,
-        delay=0.5,
         provider="together",
         memory_mode=not save_files,
         annotations_data=st.session_state.get('annotations_data') if not save_files else None,
@@ -49,6 +49,134 @@ class FewShotConstants:
     # Default random seed for sampling
     DEFAULT_RANDOM_SEED = 42
 
+# Constants for AugmentationPipeline
+class AugmentationPipelineConstants:
+    # How a stage processes its input variations:
+    # serially, in a thread pool, in a process pool, or "auto" (threads for I/O-bound
+    # augmenters, processes for CPU-bound ones)
+    SERIAL_EXECUTOR = "serial"
+    THREAD_EXECUTOR = "thread"
+    PROCESS_EXECUTOR = "process"
+    AUTO_EXECUTOR = "auto"
+    EXECUTORS = [SERIAL_EXECUTOR, THREAD_EXECUTOR, PROCESS_EXECUTOR, AUTO_EXECUTOR]
+
+    # Maximum number of augmenter calls in flight at once in AugmentationPipeline.aaugment
+    DEFAULT_MAX_CONCURRENCY = 16
+
+    # Number of input variations an augmenter must have processed before the budget planner
+    # trusts its observed fan-out over the n_augments prior
+    MIN_FANOUT_OBSERVATIONS = 3
+
+# Constants for Instrumentation
+class InstrumentationConstants:
+    # Upper bounds (in seconds) of the buckets of the augmenter call latency histograms
+    LATENCY_BUCKETS_SECONDS = [0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 30.0]
+
+# Constants for the model client
+class ModelClientConstants:
+    # Size of the HTTP connection pool shared by all the LLM requests of the process, matching
+    # the ceiling of the adaptive concurrency window (twice the default concurrency of the pipeline)
+    DEFAULT_POOL_SIZE = 2 * AugmentationPipelineConstants.DEFAULT_MAX_CONCURRENCY
+
+# Constants for the LLM scheduler
+class LLMSchedulerConstants:
+    # Default budgets of the process-wide scheduler (None means no limit)
+    DEFAULT_REQUESTS_PER_MINUTE = None
+    DEFAULT_TOKENS_PER_MINUTE = None
+    # Maximum number of LLM requests in flight, matching the connection pool
+    DEFAULT_MAX_CONCURRENCY = ModelClientConstants.DEFAULT_POOL_SIZE
+    # Starting size of the adaptive concurrency window, below the maximum so AIMD has room to grow
+    DEFAULT_INITIAL_CONCURRENCY = AugmentationPipelineConstants.DEFAULT_MAX_CONCURRENCY
+
+    # Token estimate of a request before it is sent: prompt characters per token,
+    # plus a completion estimate when the request has no max_tokens
+    CHARS_PER_TOKEN = 4
+    COMPLETION_TOKENS_ESTIMATE = 512
+
+    # Adaptive (AIMD) concurrency: the window of requests in flight starts at the initial
+    # concurrency, grows by one per window of successful requests, up to the maximum
+    # concurrency, and is cut by the decrease factor on
+    # rate limits, server errors and latency spikes (latencies above the spike factor times the
+    # moving average of the latencies), at most once per average latency
+    ADAPTIVE_CONCURRENCY = True
+    MIN_CONCURRENCY_WINDOW = 1
+    WINDOW_DECREASE_FACTOR = 0.5
+    LATENCY_SPIKE_FACTOR = 4.0
+    LATENCY_EWMA_ALPHA = 0.1
+    MIN_LATENCY_SAMPLES = 10
+
+# Constants for the retries of the LLM requests
+class LLMRetryConstants:
+    # Retries of a failed request, with full-jitter exponential backoff between attempts
+    DEFAULT_MAX_RETRIES = 5
+    BASE_DELAY_SECONDS = 1.0
+    MAX_DELAY_SECONDS = 60.0
+    # HTTP statuses of transient failures (timeouts, conflicts, rate limits, server errors)
+    RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+    # Class names of transient network errors of the SDKs (Together, OpenAI, requests, aiohttp, httpx)
+    RETRYABLE_ERROR_NAMES = ("Timeout", "ReadTimeout", "ConnectTimeout", "APITimeoutError", "APIConnectionError",
+                             "ConnectionError", "ServiceUnavailableError", "RateLimitError",
+                             "ServerDisconnectedError", "ClientConnectorError", "ClientOSError")
+
+    # Circuit breaker: after this many consecutive transient failures, all the requests are
+    # paused for the cooldown (doubled at each consecutive opening)
+    CIRCUIT_FAILURE_THRESHOLD = 5
+    CIRCUIT_COOLDOWN_SECONDS = 30.0
+    # Longest pause of a circuit that keeps re-opening
+    CIRCUIT_MAX_COOLDOWN_SECONDS = 300.0
+    # After this many consecutive openings, requests fail fast with CircuitOpenError while the
+    # circuit is open (a probe is still sent after every cooldown)
+    CIRCUIT_MAX_OPENINGS = 4
+    # How often requests waiting on the probe of a half-open circuit check its outcome
+    CIRCUIT_PROBE_POLL_SECONDS = 0.5
+
+# Constants for the hedging of the LLM requests
+class LLMHedgingConstants:
+    # A duplicate request is sent when a request has not returned by this quantile of the
+    # observed latencies of the model
+    LATENCY_QUANTILE = 0.95
+    # Number of recent latencies the quantile is computed on, and the minimum before hedging
+    LATENCY_WINDOW = 200
+    MIN_OBSERVATIONS = 20
+    # Budget of duplicate requests: this fraction of the requests, with bursts of at most BUDGET_BURST
+    MAX_EXTRA_RATIO = 0.05
+    BUDGET_BURST = 5
+
+# Constants for the fake LLM provider used for offline load tests
+class FakeLLMConstants:
+    # Latencies follow a log-normal distribution with this median and shape
+    LATENCY_MEDIAN_SECONDS = 0.05
+    LATENCY_SIGMA = 0.5
+    # Fraction of the requests that fail, and the HTTP status they fail with
+    FAILURE_RATE = 0.0
+    FAILURE_STATUS = 503
+    # Dimension used for breakdown prompts whose examples have none
+    DEFAULT_DIMENSION = "Instruction"
+
+# Constants for the LLM response cache
+class ResponseCacheConstants:
+    # Entries older than this are ignored and evicted (None keeps them forever)
+    DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+    # Maximum number of stored responses; the least recently used ones are evicted beyond it
+    DEFAULT_MAX_ENTRIES = 100_000
+    # Number of distinct responses kept per request, for sampling-based augmenters
+    DEFAULT_SAMPLES_PER_KEY = 1
+    # Eviction runs every this many insertions
+    EVICTION_INTERVAL = 100
+    # Maximum number of request keys whose read position is tracked (least recently read dropped first)
+    MAX_READ_POSITIONS = 100_000
+
+# Constants for AugmentationCache
+class AugmentationCacheConstants:
+    # Maximum approximate size of the in-memory tier
+    DEFAULT_MAX_MEMORY_BYTES = 64 * 1024 * 1024
+    # On-disk entries older than this are ignored and evicted (None keeps them forever)
+    DEFAULT_DISK_TTL_SECONDS = 30 * 24 * 60 * 60
+    # Maximum number of on-disk entries; the least recently used ones are evicted beyond it
+    DEFAULT_MAX_DISK_ENTRIES = 1_000_000
+    # On-disk eviction runs every this many insertions
+    EVICTION_INTERVAL = 100
+
 # Constants for NonLLMAugmenter
 class TextSurfaceAugmenterConstants:
     # White space options
@@ -101,10 +229,27 @@ class TextSurfaceAugmenterConstants:
     # Random index range for white space options
     MIN_WHITESPACE_INDEX = 0
     MAX_WHITESPACE_INDEX = 2
+
+    # Number of texts whose whitespace split is cached by add_white_spaces
+    WHITE_SPACE_SPLIT_CACHE_SIZE = 1024
     
     # Transformation techniques
     TRANSFORMATION_TECHNIQUES = ["typos", "capitalization", "punctuation", "spacing"]
 
+    # Default technique sequence of TextSurfaceAugmenter.augment
+    DEFAULT_TECHNIQUES = ["typos", "capitalization", "spacing", "swap_characters", "punctuation"]
+
+    # Per-technique probabilities used by augment and by transform plans
+    TECHNIQUE_PROBS = {
+        "typos": 0.1,
+        "capitalization": 0.15,
+        "swap_characters": DEFAULT_TYPO_PROB,
+        "punctuation": DEFAULT_TYPO_PROB,
+    }
+
+    # Number of outputs generated by each technique for each variation in augment
+    OUTPUTS_PER_TECHNIQUE = 2
+
 # Directory where data files are located
 DATA_DIR_NAME = "data"
 DATA_DIR = Path(__file__).resolve().parents[2] / DATA_DIR_NAME
@@ -114,3 +259,5 @@ DEFAULT_ANNOTATIONS_INPUT_FILE = f"{DATA_DIR}/annotations_input.json"
 # Default output file for augmented variations
 DEFAULT_AUGMENTED_VARIATIONS_OUTPUT_FILE = f"{DATA_DIR}/augmented_variations_output.json"
 
+# Default SQLite file of the LLM response cache
+DEFAULT_LLM_CACHE_FILE = f"{DATA_DIR}/llm_response_cache.sqlite"
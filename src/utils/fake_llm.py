@@ -0,0 +1,228 @@
+"""
+Deterministic fake LLM provider, for offline load tests of the pipeline.
+
+FakeLLM mimics the chat completion interface of the Together clients. Its responses are a
+function of the request only, and have the format each caller parses:
+- a Python list of strings for the Paraphrase prompts,
+- the original prompt with context added around it for the ContextAugmenter prompts,
+- "Dimension:\\n- highlight" blocks for the instruction breakdown prompts,
+- the last line of the prompt, tagged, for any other prompt.
+
+Latencies follow a log-normal distribution and a fraction of the requests can be made to fail
+with an HTTP status, so concurrency, retries, hedging and caching can be exercised locally.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from src.utils.constants import FakeLLMConstants, LLMSchedulerConstants
+
+_PARAPHRASE_PREFIXES = [
+    "Please complete the following task:",
+    "Here is a task for you:",
+    "Your task is as follows:",
+    "Consider the following request:",
+    "Read carefully and respond:",
+    "Task description:",
+    "Follow this instruction:",
+    "Kindly address the following:",
+]
+
+_CONTEXT_SENTENCES = [
+    "This question comes up often in introductory courses.",
+    "Many people have wondered about this over the years.",
+    "The topic has a long and interesting history.",
+    "Take a moment to think before answering.",
+    "This is part of a broader set of questions on the subject.",
+    "Experts sometimes approach this from different angles.",
+]
+
+_BREAKDOWN_MARKER = "Now, break down this input:\nInput:\n"
+
+
+class FakeLLMError(Exception):
+    """Injected failure of the fake provider, shaped like the errors of the SDKs."""
+
+    def __init__(self, message: str, http_status: int, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.http_status = http_status
+        self.headers = headers or {}
+
+
+def _digest(*values) -> int:
+    """Stable integer digest of the given values."""
+    data = json.dumps(values, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return int.from_bytes(hashlib.sha256(data).digest()[:8], "little")
+
+
+def _breakdown_response(content: str) -> str:
+    """Answer an instruction breakdown prompt with the dimensions of its examples."""
+    examples, tail = content.rsplit(_BREAKDOWN_MARKER, 1)
+    input_text = tail.rsplit("\n\nBreakdown:", 1)[0].strip()
+
+    dimensions = []
+    in_breakdown = False
+    for line in examples.split("\n"):
+        stripped = line.strip()
+        if stripped == "Breakdown:":
+            in_breakdown = True
+        elif stripped == "---" or re.match(r"Example \d+:$", stripped):
+            in_breakdown = False
+        elif in_breakdown and stripped.endswith(":") and not stripped.startswith("-"):
+            if stripped[:-1].strip() and stripped[:-1].strip() not in dimensions:
+                dimensions.append(stripped[:-1].strip())
+    if not dimensions:
+        dimensions = [FakeLLMConstants.DEFAULT_DIMENSION]
+
+    sentences = [sentence.strip() for sentence in re.split(r"(?<=[.!?])\s+|\n+", input_text) if sentence.strip()]
+    highlights = {dimension: [] for dimension in dimensions}
+    for i, sentence in enumerate(sentences or [input_text]):
+        highlights[dimensions[i % len(dimensions)]].append(sentence)
+    return "\n\n".join(f"{dimension}:\n" + "\n".join(f"- {highlight}" for highlight in dimension_highlights)
+                       for dimension, dimension_highlights in highlights.items() if dimension_highlights)
+
+
+def generate_response(model: str, messages: List[Dict[str, str]]) -> str:
+    """
+    Generate the deterministic response of a request.
+
+    Args:
+        model: Name of the model
+        messages: List of message dictionaries with 'role' and 'content' keys
+
+    Returns:
+        The response text
+    """
+    content = str(messages[-1].get("content", "")) if messages else ""
+    seed = _digest(model, messages)
+
+    if _BREAKDOWN_MARKER in content:
+        return _breakdown_response(content)
+
+    paraphrase = re.search(r"Prompt: '''(.*)'''\s*$", content, re.DOTALL)
+    if paraphrase and "Python list of strings" in content:
+        count = re.search(r"[Pp]roviding (\d+)", content)
+        n_variations = int(count.group(1)) if count else 1
+        prompt = paraphrase.group(1).strip()
+        return repr([f"{_PARAPHRASE_PREFIXES[(seed + i) % len(_PARAPHRASE_PREFIXES)]} {prompt}"
+                     for i in range(n_variations)])
+
+    context = re.search(r'Original prompt:\s*"(.*)"\s*Return ONLY', content, re.DOTALL)
+    if context:
+        prompt = context.group(1)
+        before = _CONTEXT_SENTENCES[seed % len(_CONTEXT_SENTENCES)]
+        after = _CONTEXT_SENTENCES[(seed // len(_CONTEXT_SENTENCES)) % len(_CONTEXT_SENTENCES)]
+        if "BOTH BEFORE AND AFTER" in content:
+            return f"{before} {prompt} {after}"
+        if "add context BEFORE" in content:
+            return f"{before} {prompt}"
+        return f"{prompt} {after}"
+
+    lines = [line.strip() for line in content.split("\n") if line.strip()]
+    return f"{lines[-1] if lines else ''} [{seed % 16 ** 8:08x}]"
+
+
+class _Completions:
+    """The chat.completions endpoint of the fake clients."""
+
+    def __init__(self, provider: "FakeLLM", asynchronous: bool):
+        self._provider = provider
+        self._asynchronous = asynchronous
+
+    def create(self, model: str, messages: List[Dict[str, str]], **params):
+        if self._asynchronous:
+            return self._provider.acreate(model, messages, **params)
+        return self._provider.create(model, messages, **params)
+
+
+class FakeLLM:
+    """
+    Fake LLM provider with the interface of the Together clients.
+
+    The provider is its own blocking client (provider.chat.completions.create), and
+    provider.async_client is the async one. Responses are deterministic; latencies and failures
+    are drawn from a seeded random stream.
+    """
+
+    def __init__(self, latency_median: float = FakeLLMConstants.LATENCY_MEDIAN_SECONDS,
+                 latency_sigma: float = FakeLLMConstants.LATENCY_SIGMA,
+                 failure_rate: float = FakeLLMConstants.FAILURE_RATE,
+                 failure_status: int = FakeLLMConstants.FAILURE_STATUS,
+                 retry_after: Optional[float] = None,
+                 seed: int = 0):
+        """
+        Initialize the provider.
+
+        Args:
+            latency_median: Median latency of the requests in seconds (0 for no latency).
+            latency_sigma: Shape of the log-normal latency distribution (0 for a constant latency).
+            failure_rate: Fraction of the requests that fail.
+            failure_status: HTTP status of the failures (e.g. 429 or 503).
+            retry_after: Optional Retry-After delay, in seconds, sent with the failures.
+            seed: Seed of the latency and failure draws.
+        """
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+
+        self.chat = SimpleNamespace(completions=_Completions(self, asynchronous=False))
+        self.async_client = SimpleNamespace(chat=SimpleNamespace(completions=_Completions(self, asynchronous=True)))
+
+    def _draw(self) -> tuple:
+        """Draw the latency of a request and whether it fails."""
+        with self._lock:
+            self.requests += 1
+            latency = self.latency_median * self._random.lognormvariate(0, self.latency_sigma) \
+                if self.latency_median > 0 else 0.0
+            failed = self._random.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+        return latency, failed
+
+    def _respond(self, model: str, messages: List[Dict[str, str]], failed: bool):
+        if failed:
+            headers = {"retry-after": str(self.retry_after)} if self.retry_after is not None else {}
+            raise FakeLLMError(f"Injected failure of the fake provider ({self.failure_status})",
+                               self.failure_status, headers)
+        content = generate_response(model, messages)
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in messages)
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens // LLMSchedulerConstants.CHARS_PER_TOKEN,
+                                completion_tokens=len(content) // LLMSchedulerConstants.CHARS_PER_TOKEN)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+    def create(self, model: str, messages: List[Dict[str, str]], **params):
+        """
+        Blocking chat completion.
+
+        Args:
+            model: Name of the model
+            messages: List of message dictionaries with 'role' and 'content' keys
+            **params: Sampling parameters (ignored)
+
+        Returns:
+            A response with choices[0].message.content and usage, like the Together responses
+
+        Raises:
+            FakeLLMError: For the injected failures.
+        """
+        latency, failed = self._draw()
+        time.sleep(latency)
+        return self._respond(model, messages, failed)
+
+    async def acreate(self, model: str, messages: List[Dict[str, str]], **params):
+        """Async counterpart of create."""
+        latency, failed = self._draw()
+        await asyncio.sleep(latency)
+        return self._respond(model, messages, failed)
@@ -0,0 +1,218 @@
+"""
+Instrumentation of the augmentation pipeline and the LLM clients.
+
+An Instrumentation collects per-stage wall time, per-augmenter call counts and latency
+histograms, variation fan-in/fan-out, dedup ratio and LLM token usage. Every measurement is
+emitted as an event through logging, an optional JSON-lines sink and the attached hooks.
+
+LLM client events (coalesced requests, ...) are counted per model.
+
+Instrumentation is opt-in: components only measure anything when they are given an
+Instrumentation, or when one is installed process-wide with configure_instrumentation.
+Otherwise they skip the measurements entirely.
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from src.utils.constants import InstrumentationConstants
+
+logger = logging.getLogger(__name__)
+
+# Process-wide instrumentation, used by components that are not given one explicitly
+_instrumentation = None
+
+
+class Instrumentation:
+    """
+    Collector of pipeline and LLM metrics.
+
+    Events are dictionaries with an "event" type ("stage", "augmenter_call", "llm_usage" or "llm_event"),
+    a "timestamp" and the event's fields. The aggregated metrics are available through summary().
+    """
+
+    def __init__(self, sink_path: Optional[str] = None, log_level: int = logging.DEBUG,
+                 latency_buckets: List[float] = None):
+        """
+        Initialize the instrumentation.
+
+        Args:
+            sink_path: Optional path of a JSON-lines file receiving every event.
+            log_level: Level at which events are logged.
+            latency_buckets: Upper bounds in seconds of the latency histogram buckets
+                (an implicit last bucket counts the slower calls).
+        """
+        self.sink_path = sink_path
+        self.log_level = log_level
+        self.latency_buckets = latency_buckets or InstrumentationConstants.LATENCY_BUCKETS_SECONDS
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._sink = open(sink_path, "a", encoding="utf-8") if sink_path else None
+
+        self.stages = {}
+        self.calls = {}
+        self.token_usage = {}
+        self.llm_events = {}
+
+    def add_hook(self, hook: Callable[[Dict[str, Any]], None]):
+        """
+        Attach a collector called with every event.
+
+        Args:
+            hook: Callable receiving the event dictionary.
+        """
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[Dict[str, Any]], None]):
+        """Detach a collector attached with add_hook."""
+        self._hooks.remove(hook)
+
+    def emit(self, event_type: str, **fields):
+        """
+        Emit an event through logging, the sink and the hooks.
+
+        Args:
+            event_type: The type of the event.
+            **fields: The fields of the event.
+        """
+        event = {"event": event_type, "timestamp": time.time(), **fields}
+        logger.log(self.log_level, "%s %s", event_type, fields)
+        if self._sink is not None:
+            line = json.dumps(event, ensure_ascii=False, default=str)
+            with self._lock:
+                self._sink.write(line + "\n")
+                self._sink.flush()
+        for hook in self._hooks:
+            hook(event)
+
+    def record_stage(self, stage: int, augmenter: str, seconds: float, n_texts: int,
+                     n_inputs: int, n_outputs: int, n_unique: int, n_kept: int, n_calls: Optional[int] = None):
+        """
+        Record a pipeline stage.
+
+        Args:
+            stage: Index of the stage in the pipeline.
+            augmenter: Name of the augmenter of the stage.
+            seconds: Wall time of the stage.
+            n_texts: Number of dataset texts processed by the stage.
+            n_inputs: Number of input variations (fan-in).
+            n_outputs: Number of variations produced by the augmenter (fan-out).
+            n_unique: Number of distinct variations produced for each text, summed over the texts.
+            n_kept: Number of variations kept after sampling.
+            n_calls: Number of augmenter calls, once duplicate input variations are collapsed
+                (defaults to n_inputs).
+        """
+        if n_calls is None:
+            n_calls = n_inputs
+        dedup_ratio = 1 - n_unique / n_outputs if n_outputs else 0.0
+        with self._lock:
+            totals = self.stages.setdefault(augmenter, {"runs": 0, "seconds": 0.0, "inputs": 0,
+                                                        "calls": 0, "outputs": 0, "unique": 0, "kept": 0})
+            totals["runs"] += 1
+            totals["seconds"] += seconds
+            totals["inputs"] += n_inputs
+            totals["calls"] += n_calls
+            totals["outputs"] += n_outputs
+            totals["unique"] += n_unique
+            totals["kept"] += n_kept
+        self.emit("stage", stage=stage, augmenter=augmenter, seconds=seconds, texts=n_texts, inputs=n_inputs,
+                  calls=n_calls, multiplicity=n_inputs / n_calls if n_calls else 0.0,
+                  outputs=n_outputs, unique=n_unique, kept=n_kept,
+                  fanout=n_outputs / n_inputs if n_inputs else 0.0, dedup_ratio=dedup_ratio)
+
+    def record_call(self, augmenter: str, seconds: float):
+        """
+        Record a single augmenter call.
+
+        Args:
+            augmenter: Name of the augmenter.
+            seconds: Latency of the call.
+        """
+        with self._lock:
+            calls = self.calls.setdefault(augmenter, {"count": 0, "seconds": 0.0,
+                                                      "histogram": [0] * (len(self.latency_buckets) + 1)})
+            calls["count"] += 1
+            calls["seconds"] += seconds
+            calls["histogram"][bisect.bisect_left(self.latency_buckets, seconds)] += 1
+        self.emit("augmenter_call", augmenter=augmenter, seconds=seconds)
+
+    def record_llm_usage(self, model: str, prompt_tokens: int, completion_tokens: int):
+        """
+        Record the token usage of an LLM request.
+
+        Args:
+            model: The model name.
+            prompt_tokens: Number of prompt tokens.
+            completion_tokens: Number of completion tokens.
+        """
+        with self._lock:
+            usage = self.token_usage.setdefault(model, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0})
+            usage["requests"] += 1
+            usage["prompt_tokens"] += prompt_tokens
+            usage["completion_tokens"] += completion_tokens
+        self.emit("llm_usage", model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                  total_tokens=prompt_tokens + completion_tokens)
+
+    def record_llm_event(self, model: str, event: str):
+        """
+        Count an event of the LLM client.
+
+        Args:
+            model: The model name.
+            event: The name of the event (e.g. "coalesced").
+        """
+        with self._lock:
+            events = self.llm_events.setdefault(model, {})
+            events[event] = events.get(event, 0) + 1
+        self.emit("llm_event", model=model, name=event)
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the aggregated metrics."""
+        with self._lock:
+            return {
+                "stages": {name: dict(totals) for name, totals in self.stages.items()},
+                "calls": {name: {**calls, "histogram": list(calls["histogram"])}
+                          for name, calls in self.calls.items()},
+                "latency_buckets": list(self.latency_buckets),
+                "token_usage": {model: dict(usage) for model, usage in self.token_usage.items()},
+                "llm_events": {model: dict(events) for model, events in self.llm_events.items()},
+            }
+
+    def close(self):
+        """Emit the summary and close the sink."""
+        self.emit("summary", **self.summary())
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+
+def configure_instrumentation(sink_path: Optional[str] = None, log_level: int = logging.DEBUG) -> Instrumentation:
+    """
+    Install a process-wide instrumentation.
+
+    Args:
+        sink_path: Optional path of a JSON-lines file receiving every event.
+        log_level: Level at which events are logged.
+
+    Returns:
+        The installed Instrumentation.
+    """
+    global _instrumentation
+    _instrumentation = Instrumentation(sink_path=sink_path, log_level=log_level)
+    return _instrumentation
+
+
+def get_instrumentation() -> Optional[Instrumentation]:
+    """Get the process-wide instrumentation, or None if instrumentation is disabled."""
+    return _instrumentation
+
+
+def disable_instrumentation():
+    """Close and uninstall the process-wide instrumentation."""
+    global _instrumentation
+    if _instrumentation is not None:
+        _instrumentation.close()
+    _instrumentation = None
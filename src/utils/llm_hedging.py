@@ -0,0 +1,393 @@
+"""
+Hedged LLM requests.
+
+A few LLM requests take many times the median latency, and a whole pipeline stage waits on
+them. When hedging is enabled with configure_hedging, a request that has not returned by the
+observed tail latency of its model (the 95th percentile by default) is duplicated, and the
+first response wins. Duplicates are paid for out of a global budget, a fraction of the
+requests sent, so hedging cannot more than marginally increase the load on the provider.
+
+Hedging happens inside the scheduler slot of a request: the latencies and the hedging timer
+measure the provider only, not the wait for a slot. The duplicate takes a slot of its own without
+waiting, so it counts against the concurrency window and the RPM/TPM budgets; when no slot is free
+the request is not hedged. Hedging is opt-in: get_hedger() returns None unless it was enabled.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from src.utils.constants import LLMHedgingConstants, ModelClientConstants
+from src.utils.instrumentation import get_instrumentation
+from src.utils.llm_scheduler import get_scheduler
+
+# Process-wide hedger, disabled unless configured
+_hedger = None
+
+
+class Hedger:
+    """
+    Sends duplicate requests for the slow LLM requests.
+
+    Latencies are tracked per model over a sliding window. Each request earns max_extra_ratio
+    of a duplicate request, up to budget_burst; a duplicate is only sent when a whole one is
+    available. Blocking requests are run in a dedicated thread pool, so the caller can wait
+    with a timeout; the losing task of an async pair is cancelled.
+
+    The losing request of a blocking pair cannot be cancelled: it runs to completion, holding a
+    worker of the pool and the provider's capacity after its slot is released. Workers are
+    reserved before a request is submitted, so losers never delay new requests in the pool's
+    queue; while every worker is busy, requests are sent unhedged on the calling thread.
+    """
+
+    def __init__(self, quantile: float = LLMHedgingConstants.LATENCY_QUANTILE,
+                 max_extra_ratio: float = LLMHedgingConstants.MAX_EXTRA_RATIO,
+                 budget_burst: float = LLMHedgingConstants.BUDGET_BURST,
+                 window: int = LLMHedgingConstants.LATENCY_WINDOW,
+                 min_observations: int = LLMHedgingConstants.MIN_OBSERVATIONS,
+                 max_workers: int = 4 * ModelClientConstants.DEFAULT_POOL_SIZE):
+        """
+        Initialize the hedger.
+
+        Args:
+            quantile: Latency quantile after which a request is duplicated.
+            max_extra_ratio: Duplicate requests allowed per request sent.
+            budget_burst: Maximum number of duplicate requests that can be saved up.
+            window: Number of recent latencies kept per model.
+            min_observations: Latencies needed before the requests of a model are hedged.
+            max_workers: Size of the thread pool running the hedged blocking requests.
+        """
+        self.quantile = quantile
+        self.max_extra_ratio = max_extra_ratio
+        self.budget_burst = budget_burst
+        self.window = window
+        self.min_observations = min_observations
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._budget = 0.0
+        self._executor = None
+        self._busy_workers = 0
+
+        self.requests = 0
+        self.hedges = 0
+        self.hedges_skipped = 0
+        self.hedge_wins = 0
+
+    def record_latency(self, model: str, seconds: float):
+        """
+        Record the latency of a successful request.
+
+        Args:
+            model: Name of the model.
+            seconds: Latency of the request.
+        """
+        with self._lock:
+            latencies = self._latencies.get(model)
+            if latencies is None:
+                latencies = self._latencies[model] = deque(maxlen=self.window)
+            latencies.append(seconds)
+
+    def get_threshold(self, model: str) -> Optional[float]:
+        """
+        Get the latency after which the requests of a model are duplicated.
+
+        Args:
+            model: Name of the model.
+
+        Returns:
+            The latency quantile, or None if too few latencies were observed.
+        """
+        with self._lock:
+            latencies = self._latencies.get(model)
+            if latencies is None or len(latencies) < self.min_observations:
+                return None
+            ordered = sorted(latencies)
+        return ordered[int(self.quantile * (len(ordered) - 1))]
+
+    def _start_request(self, model: str) -> Optional[float]:
+        """Count a request, earning its share of the budget, and return its hedging threshold."""
+        with self._lock:
+            self.requests += 1
+            self._budget = min(self.budget_burst, self._budget + self.max_extra_ratio)
+        return self.get_threshold(model)
+
+    def _take_budget(self, model: str, estimated_tokens: int) -> bool:
+        """
+        Spend a duplicate request of the budget and take a scheduler slot for it, if both are available.
+
+        The slot must be released when the duplicate completes (see _in_slot).
+        """
+        with self._lock:
+            if self._budget < 1:
+                return False
+            self._budget -= 1
+        if not get_scheduler().try_acquire(estimated_tokens):
+            with self._lock:
+                self._budget += 1
+                self.hedges_skipped += 1
+            return False
+        with self._lock:
+            self.hedges += 1
+        instrumentation = get_instrumentation()
+        if instrumentation is not None:
+            instrumentation.record_llm_event(model, "hedge")
+        return True
+
+    @staticmethod
+    def _in_slot(request: Callable[[], Any], estimated_tokens: int) -> Callable[[], Any]:
+        """Wrap a duplicate request to release its scheduler slot when it completes."""
+        scheduler = get_scheduler()
+
+        def run():
+            start = time.monotonic()
+            error = None
+            try:
+                return request()
+            except BaseException as exception:
+                error = exception
+                raise
+            finally:
+                scheduler.release(estimated_tokens, latency=time.monotonic() - start, error=error)
+
+        return run
+
+    @staticmethod
+    def _ain_slot(request: Callable[[], Awaitable[Any]], estimated_tokens: int) -> Callable[[], Awaitable[Any]]:
+        """Async counterpart of _in_slot."""
+        scheduler = get_scheduler()
+
+        async def run():
+            start = time.monotonic()
+            error = None
+            try:
+                return await request()
+            except BaseException as exception:
+                error = exception
+                raise
+            finally:
+                scheduler.release(estimated_tokens, latency=time.monotonic() - start, error=error)
+
+        return run
+
+    def _reserve_worker(self) -> bool:
+        """Reserve a worker of the thread pool, if one is free."""
+        with self._lock:
+            if self._busy_workers >= self.max_workers:
+                return False
+            self._busy_workers += 1
+            return True
+
+    def _release_worker(self, future=None):
+        with self._lock:
+            self._busy_workers -= 1
+
+    def _submit(self, request: Callable[[], Any]):
+        """Run a request on a reserved worker, which is released when the request completes."""
+        future = self._get_executor().submit(self._timed, request)
+        future.add_done_callback(self._release_worker)
+        return future
+
+    def _record_win(self, model: str):
+        with self._lock:
+            self.hedge_wins += 1
+        instrumentation = get_instrumentation()
+        if instrumentation is not None:
+            instrumentation.record_llm_event(model, "hedge_win")
+
+    @staticmethod
+    def _timed(request: Callable[[], Any]) -> tuple:
+        start = time.monotonic()
+        result = request()
+        return result, time.monotonic() - start
+
+    @staticmethod
+    async def _atimed(request: Callable[[], Awaitable[Any]]) -> tuple:
+        start = time.monotonic()
+        result = await request()
+        return result, time.monotonic() - start
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix="llm-hedge")
+        return self._executor
+
+    def call(self, request: Callable[[], Any], model: str, estimated_tokens: int = 0) -> Any:
+        """
+        Send a request, duplicating it if it is slower than the threshold of its model.
+
+        Args:
+            request: Callable making one request.
+            model: Name of the model.
+            estimated_tokens: The estimated number of tokens of the request, charged again for a duplicate.
+
+        Returns:
+            The result of the first request that succeeds.
+
+        Raises:
+            The error of the original request if both requests fail.
+        """
+        threshold = self._start_request(model)
+        if threshold is None or not self._reserve_worker():
+            result, seconds = self._timed(request)
+            self.record_latency(model, seconds)
+            return result
+
+        primary = self._submit(request)
+        done, _ = wait([primary], timeout=threshold)
+        if done or not self._reserve_worker():
+            result, seconds = primary.result()
+            self.record_latency(model, seconds)
+            return result
+        if not self._take_budget(model, estimated_tokens):
+            self._release_worker()
+            result, seconds = primary.result()
+            self.record_latency(model, seconds)
+            return result
+
+        hedge = self._submit(self._in_slot(request, estimated_tokens))
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda future: future is hedge):
+                if future.exception() is None:
+                    result, seconds = future.result()
+                    self.record_latency(model, seconds)
+                    if future is hedge:
+                        self._record_win(model)
+                    return result
+        return primary.result()
+
+    async def acall(self, request: Callable[[], Awaitable[Any]], model: str, estimated_tokens: int = 0) -> Any:
+        """
+        Async counterpart of call; the losing request is cancelled.
+
+        Args:
+            request: Coroutine function making one request.
+            model: Name of the model.
+            estimated_tokens: The estimated number of tokens of the request, charged again for a duplicate.
+
+        Returns:
+            The result of the first request that succeeds.
+        """
+        threshold = self._start_request(model)
+        if threshold is None:
+            result, seconds = await self._atimed(request)
+            self.record_latency(model, seconds)
+            return result
+
+        primary = asyncio.ensure_future(self._atimed(request))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=threshold)
+            if done or not self._take_budget(model, estimated_tokens):
+                result, seconds = await primary
+                self.record_latency(model, seconds)
+                return result
+
+            hedge = asyncio.ensure_future(self._atimed(self._ain_slot(request, estimated_tokens)))
+            tasks.append(hedge)
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in sorted(done, key=lambda task: task is hedge):
+                    if task.exception() is None:
+                        result, seconds = task.result()
+                        self.record_latency(model, seconds)
+                        if task is hedge:
+                            self._record_win(model)
+                        return result
+            return primary.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the hedging counters and the current thresholds."""
+        thresholds = {model: self.get_threshold(model) for model in list(self._latencies)}
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedges_skipped": self.hedges_skipped,
+                "hedge_wins": self.hedge_wins,
+                "budget": self._budget,
+                "busy_workers": self._busy_workers,
+                "thresholds": thresholds,
+            }
+
+    def close(self):
+        """Shut down the thread pool of the blocking requests."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def configure_hedging(enabled: bool = True,
+                      quantile: float = LLMHedgingConstants.LATENCY_QUANTILE,
+                      max_extra_ratio: float = LLMHedgingConstants.MAX_EXTRA_RATIO,
+                      budget_burst: float = LLMHedgingConstants.BUDGET_BURST) -> Optional[Hedger]:
+    """
+    Enable (or disable) hedging of the LLM requests of the process.
+
+    Args:
+        enabled: Whether to hedge the requests.
+        quantile: Latency quantile after which a request is duplicated.
+        max_extra_ratio: Duplicate requests allowed per request sent.
+        budget_burst: Maximum number of duplicate requests that can be saved up.
+
+    Returns:
+        The hedger, or None if hedging is disabled.
+    """
+    global _hedger
+    if _hedger is not None:
+        _hedger.close()
+    _hedger = Hedger(quantile, max_extra_ratio, budget_burst) if enabled else None
+    return _hedger
+
+
+def get_hedger() -> Optional[Hedger]:
+    """Get the process-wide hedger, or None if hedging is disabled."""
+    return _hedger
+
+
+def hedged(request: Callable[[], Any], model: str, estimated_tokens: int = 0) -> Any:
+    """
+    Send a request through the process-wide hedger, if hedging is enabled.
+
+    Args:
+        request: Callable making one request.
+        model: Name of the model.
+        estimated_tokens: The estimated number of tokens of the request, charged again for a duplicate.
+
+    Returns:
+        The result of the request.
+    """
+    hedger = _hedger
+    if hedger is None:
+        return request()
+    return hedger.call(request, model, estimated_tokens)
+
+
+async def ahedged(request: Callable[[], Awaitable[Any]], model: str, estimated_tokens: int = 0) -> Any:
+    """
+    Async counterpart of hedged.
+
+    Args:
+        request: Coroutine function making one request.
+        model: Name of the model.
+        estimated_tokens: The estimated number of tokens of the request, charged again for a duplicate.
+
+    Returns:
+        The result of the request.
+    """
+    hedger = _hedger
+    if hedger is None:
+        return await request()
+    return await hedger.acall(request, model, estimated_tokens)
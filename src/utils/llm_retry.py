@@ -0,0 +1,444 @@
+"""
+Retries of the LLM requests and circuit breaker.
+
+Every LLM request (Together or RITS, sync or async) is sent through the process-wide
+RetryPolicy. Transient failures (timeouts, connection errors, 429 and 5xx responses) are
+retried with full-jitter exponential backoff, honouring the Retry-After header of the
+response when there is one. Consecutive transient failures open the circuit breaker, which
+pauses the LLMScheduler so that all the workers hold back while the provider recovers, then
+lets a single probe request through to find out whether it has.
+
+Failures surface as typed errors, so callers can count them rather than swallow them:
+LLMError for requests the provider rejected, RetryExhaustedError when the retries are used
+up and CircuitOpenError when the breaker keeps failing its probes.
+"""
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from src.utils.constants import LLMRetryConstants
+from src.utils.instrumentation import get_instrumentation
+from src.utils.llm_scheduler import get_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Process-wide retry policy, created on first use
+_retry_policy = None
+_retry_policy_lock = threading.Lock()
+
+# Root modules of the libraries whose exceptions are provider errors
+_PROVIDER_MODULES = ("together", "openai", "requests", "aiohttp", "httpx", "urllib3")
+
+
+class LLMError(Exception):
+    """An LLM request failed."""
+
+    def __init__(self, message: str, model: Optional[str] = None, attempts: int = 1):
+        """
+        Initialize the error.
+
+        Args:
+            message: Description of the failure.
+            model: Name of the model the request was sent to.
+            attempts: Number of attempts made.
+        """
+        super().__init__(message)
+        self.model = model
+        self.attempts = attempts
+
+
+class RetryExhaustedError(LLMError):
+    """An LLM request kept failing with transient errors until the retries were used up."""
+
+
+class CircuitOpenError(LLMError):
+    """An LLM request was not sent because the circuit stayed open for max_openings consecutive openings."""
+
+
+def get_status_code(error: BaseException) -> Optional[int]:
+    """Get the HTTP status of a provider error, if any."""
+    status = getattr(error, "http_status", None)
+    if status is None:
+        status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(error, "status", None)
+    return status if isinstance(status, int) else None
+
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+    """
+    Get the delay requested by the Retry-After headers of a provider error.
+
+    Args:
+        error: The provider error.
+
+    Returns:
+        The delay in seconds, or None if the response has no (valid) Retry-After header.
+    """
+    headers = getattr(error, "headers", None)
+    if not headers:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers or not hasattr(headers, "get"):
+        return None
+    retry_after_ms = headers.get("retry-after-ms") or headers.get("Retry-After-Ms")
+    if retry_after_ms is not None:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after") or headers.get("Retry-After")
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    # Retry-After can also be an HTTP date
+    retry_date = email.utils.parsedate_tz(str(retry_after))
+    if retry_date is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(retry_date) - time.time())
+
+
+def is_provider_error(error: BaseException) -> bool:
+    """Whether an exception comes from the provider or the network, rather than from our code."""
+    if get_status_code(error) is not None or isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(klass.__module__.split(".")[0] in _PROVIDER_MODULES for klass in type(error).__mro__)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a provider error is transient and the request should be retried."""
+    status = get_status_code(error)
+    if status is not None:
+        return status in LLMRetryConstants.RETRYABLE_STATUS_CODES
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(klass.__name__ in LLMRetryConstants.RETRYABLE_ERROR_NAMES for klass in type(error).__mro__)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker shared by all the LLM requests of the process.
+
+    After failure_threshold consecutive transient failures the circuit opens: the scheduler is
+    paused for the cooldown, doubled at each consecutive opening, so every worker holds back
+    instead of hammering a provider that is down. Failures reported while the circuit is open
+    come from requests sent before it opened and are ignored, so a burst opens it only once.
+
+    Once the cooldown is over the circuit is half-open: a single probe request is let through
+    while the others wait. A successful probe closes the circuit; a failed one re-opens it.
+    After max_openings consecutive openings, the requests that would wait fail fast with
+    CircuitOpenError instead, but a probe is still sent after every cooldown, so the circuit
+    closes again when the provider recovers.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = LLMRetryConstants.CIRCUIT_FAILURE_THRESHOLD,
+                 cooldown_seconds: float = LLMRetryConstants.CIRCUIT_COOLDOWN_SECONDS,
+                 max_openings: int = LLMRetryConstants.CIRCUIT_MAX_OPENINGS):
+        """
+        Initialize the breaker, closed.
+
+        Args:
+            failure_threshold: Consecutive transient failures that open the circuit.
+            cooldown_seconds: Pause of the first opening.
+            max_openings: Consecutive openings after which waiting requests fail fast.
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.max_openings = max_openings
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self._failures = 0
+        self._openings = 0
+        self._open_until = 0.0
+        self.total_openings = 0
+
+    def admit(self, model: Optional[str] = None) -> Tuple[float, bool]:
+        """
+        Check whether a request can be sent.
+
+        Args:
+            model: Name of the model, for the errors.
+
+        Returns:
+            The time to wait before asking again (0 if the request can be sent now), and whether
+            the request is the probe of the half-open circuit, whose outcome must be reported.
+
+        Raises:
+            CircuitOpenError: If the request would have to wait after max_openings consecutive openings.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0, False
+            now = time.monotonic()
+            if self.state == self.OPEN and now >= self._open_until:
+                self.state = self.HALF_OPEN
+                return 0.0, True
+            if self._openings >= self.max_openings:
+                raise CircuitOpenError(f"Circuit open after {self._openings} consecutive openings", model, 0)
+            if self.state == self.OPEN:
+                return self._open_until - now, False
+            return LLMRetryConstants.CIRCUIT_PROBE_POLL_SECONDS, False
+
+    def record_success(self):
+        """Close the circuit."""
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._openings = 0
+
+    def record_failure(self, model: Optional[str] = None, probe: bool = False):
+        """
+        Count a transient failure, opening the circuit at the threshold.
+
+        Args:
+            model: Name of the model, for the metrics.
+            probe: Whether the request was the probe of the half-open circuit (see admit).
+        """
+        with self._lock:
+            if self.state != self.CLOSED and not (probe and self.state == self.HALF_OPEN):
+                return
+            if self.state == self.CLOSED:
+                self._failures += 1
+                if self._failures < self.failure_threshold:
+                    return
+            self._failures = 0
+            self._openings += 1
+            self.total_openings += 1
+            cooldown = min(LLMRetryConstants.CIRCUIT_MAX_COOLDOWN_SECONDS,
+                           self.cooldown_seconds * 2 ** (self._openings - 1))
+            self.state = self.OPEN
+            self._open_until = time.monotonic() + cooldown
+        logger.warning("Circuit breaker open: pausing LLM requests for %.1f seconds", cooldown)
+        get_scheduler().pause(cooldown)
+        instrumentation = get_instrumentation()
+        if instrumentation is not None:
+            instrumentation.record_llm_event(model, "circuit_open")
+
+    def abandon_probe(self):
+        """Let another request probe the half-open circuit, when the probe ended without an outcome."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def reset(self):
+        """Close the circuit and forget the failures."""
+        self.record_success()
+
+    @property
+    def is_open(self) -> bool:
+        """Whether the circuit is open or half-open."""
+        return self.state != self.CLOSED
+
+
+class RetryPolicy:
+    """
+    Retry loop around single LLM requests.
+
+    Each attempt acquires its own scheduler slot, so backoff waits do not hold a slot. The
+    counters of retries and failures (by error type) are exposed through stats().
+    """
+
+    def __init__(self, max_retries: int = LLMRetryConstants.DEFAULT_MAX_RETRIES,
+                 base_delay: float = LLMRetryConstants.BASE_DELAY_SECONDS,
+                 max_delay: float = LLMRetryConstants.MAX_DELAY_SECONDS,
+                 breaker: Optional[CircuitBreaker] = None):
+        """
+        Initialize the policy.
+
+        Args:
+            max_retries: Retries of a request after its first attempt.
+            base_delay: Backoff ceiling of the first retry, doubled at each retry.
+            max_delay: Maximum wait between two attempts, Retry-After included.
+            breaker: Circuit breaker (a new one by default).
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self.retries = 0
+        self.errors = {}
+
+    def get_delay(self, attempt: int, error: BaseException) -> float:
+        """
+        Get the wait before the next attempt.
+
+        Args:
+            attempt: Index of the attempt that failed (0 for the first one).
+            error: The error of the attempt.
+
+        Returns:
+            The Retry-After delay if the response has one, a full-jitter exponential backoff
+            otherwise, capped at max_delay.
+        """
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        with self._lock:
+            return self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _count(self, error: LLMError) -> LLMError:
+        """Count a typed error before it is raised."""
+        with self._lock:
+            name = type(error).__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+        instrumentation = get_instrumentation()
+        if instrumentation is not None:
+            instrumentation.record_llm_event(error.model, name)
+        return error
+
+    def _admit(self, model: Optional[str]) -> Tuple[float, bool]:
+        """Ask the breaker whether an attempt can be sent, counting its refusals."""
+        try:
+            return self.breaker.admit(model)
+        except CircuitOpenError as error:
+            raise self._count(error)
+
+    def _handle_failure(self, error: Exception, attempt: int, model: Optional[str], probe: bool = False) -> float:
+        """
+        Classify the error of an attempt.
+
+        Returns:
+            The wait before the next attempt.
+
+        Raises:
+            The error itself if it does not come from the provider, LLMError if the provider
+            rejected the request, RetryExhaustedError if the retries are used up.
+        """
+        if not is_provider_error(error) or not is_retryable(error):
+            if probe:
+                self.breaker.abandon_probe()
+            if not is_provider_error(error):
+                raise error
+            raise self._count(LLMError(f"{type(error).__name__}: {error}", model, attempt + 1)) from error
+        self.breaker.record_failure(model, probe)
+        if attempt >= self.max_retries:
+            raise self._count(RetryExhaustedError(
+                f"Gave up after {attempt + 1} attempts: {type(error).__name__}: {error}", model, attempt + 1)) from error
+        with self._lock:
+            self.retries += 1
+        instrumentation = get_instrumentation()
+        if instrumentation is not None:
+            instrumentation.record_llm_event(model, "retry")
+        delay = self.get_delay(attempt, error)
+        logger.debug("Retrying LLM request in %.2f seconds after %s", delay, type(error).__name__)
+        return delay
+
+    def call(self, request: Callable[[], Any], model: Optional[str] = None) -> Any:
+        """
+        Send a request, retrying its transient failures.
+
+        Args:
+            request: Callable making one attempt.
+            model: Name of the model, for the errors and metrics.
+
+        Returns:
+            The result of the first successful attempt.
+        """
+        attempt = 0
+        while True:
+            wait, probe = self._admit(model)
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            try:
+                result = request()
+            except Exception as error:
+                time.sleep(self._handle_failure(error, attempt, model, probe))
+                attempt += 1
+                continue
+            except BaseException:
+                if probe:
+                    self.breaker.abandon_probe()
+                raise
+            self.breaker.record_success()
+            return result
+
+    async def acall(self, request: Callable[[], Awaitable[Any]], model: Optional[str] = None) -> Any:
+        """
+        Async counterpart of call.
+
+        Args:
+            request: Coroutine function making one attempt.
+            model: Name of the model, for the errors and metrics.
+
+        Returns:
+            The result of the first successful attempt.
+        """
+        attempt = 0
+        while True:
+            wait, probe = self._admit(model)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                result = await request()
+            except Exception as error:
+                await asyncio.sleep(self._handle_failure(error, attempt, model, probe))
+                attempt += 1
+                continue
+            except BaseException:
+                if probe:
+                    self.breaker.abandon_probe()
+                raise
+            self.breaker.record_success()
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the retry counters."""
+        with self._lock:
+            return {
+                "retries": self.retries,
+                "errors": dict(self.errors),
+                "circuit_openings": self.breaker.total_openings,
+                "circuit_open": self.breaker.is_open,
+                "circuit_state": self.breaker.state,
+            }
+
+
+def configure_retry(max_retries: int = LLMRetryConstants.DEFAULT_MAX_RETRIES,
+                    base_delay: float = LLMRetryConstants.BASE_DELAY_SECONDS,
+                    max_delay: float = LLMRetryConstants.MAX_DELAY_SECONDS,
+                    failure_threshold: int = LLMRetryConstants.CIRCUIT_FAILURE_THRESHOLD,
+                    cooldown_seconds: float = LLMRetryConstants.CIRCUIT_COOLDOWN_SECONDS,
+                    max_openings: int = LLMRetryConstants.CIRCUIT_MAX_OPENINGS) -> RetryPolicy:
+    """
+    Replace the process-wide retry policy.
+
+    Args:
+        max_retries: Retries of a request after its first attempt.
+        base_delay: Backoff ceiling of the first retry, doubled at each retry.
+        max_delay: Maximum wait between two attempts.
+        failure_threshold: Consecutive transient failures that open the circuit.
+        cooldown_seconds: Pause of the first opening of the circuit.
+        max_openings: Consecutive openings after which waiting requests fail fast.
+
+    Returns:
+        The new retry policy.
+    """
+    global _retry_policy
+    with _retry_policy_lock:
+        _retry_policy = RetryPolicy(max_retries, base_delay, max_delay,
+                                    CircuitBreaker(failure_threshold, cooldown_seconds, max_openings))
+    return _retry_policy
+
+
+def get_retry_policy() -> RetryPolicy:
+    """Get the process-wide retry policy, creating it with the default settings on first use."""
+    global _retry_policy
+    if _retry_policy is None:
+        with _retry_policy_lock:
+            if _retry_policy is None:
+                _retry_policy = RetryPolicy()
+    return _retry_policy
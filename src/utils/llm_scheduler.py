@@ -0,0 +1,442 @@
+"""
+Process-wide scheduler of the LLM requests.
+
+Every LLM request (Together or RITS, sync or async) goes through one LLMScheduler, which
+enforces a requests-per-minute and a tokens-per-minute budget with token buckets, and caps
+the number of requests in flight. Requests run concurrently as long as the budgets allow.
+The scheduler can also be paused, e.g. by the circuit breaker when the provider is down.
+
+By default the cap on the requests in flight is an adaptive window (AIMD): it grows while the
+requests succeed at a steady latency, and is cut on rate limits, server errors and latency
+spikes, so long runs use whatever capacity the provider gives without manual tuning.
+"""
+import asyncio
+import threading
+from collections import deque
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, List, Optional
+
+from src.utils.constants import LLMSchedulerConstants
+from src.utils.instrumentation import get_instrumentation
+
+# Process-wide scheduler, created on first use
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: Optional[int] = None) -> int:
+    """
+    Estimate the number of tokens of a request before sending it.
+
+    Args:
+        messages: List of message dictionaries with 'role' and 'content' keys
+        max_tokens: Optional completion token limit of the request
+
+    Returns:
+        The estimated number of prompt and completion tokens
+    """
+    prompt_chars = sum(len(str(message.get("content", ""))) for message in messages)
+    completion_tokens = max_tokens if max_tokens is not None else LLMSchedulerConstants.COMPLETION_TOKENS_ESTIMATE
+    return prompt_chars // LLMSchedulerConstants.CHARS_PER_TOKEN + completion_tokens
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at a per-minute rate, holding one minute of budget by default.
+
+    The bucket is not thread-safe on its own; the scheduler guards it with its lock.
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        """
+        Initialize the bucket, full.
+
+        Args:
+            per_minute: The budget per minute.
+            capacity: Maximum burst (defaults to one minute of budget).
+        """
+        self.capacity = float(capacity if capacity is not None else per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Get how long to wait before amount tokens are available.
+
+        Args:
+            amount: The number of tokens needed (capped at the capacity, so large requests can pass).
+
+        Returns:
+            The wait time in seconds, 0 if the tokens are available now.
+        """
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        """Take tokens from the bucket; the balance may go negative when usage is reconciled."""
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class LLMScheduler:
+    """
+    Rate limiter and concurrency cap shared by all the LLM requests of the process.
+
+    Requests acquire a slot with slot() (threads) or aslot() (event loops) before being sent.
+    A slot is granted when fewer requests than the concurrency window are in flight and both
+    token buckets have enough budget for the request's estimated tokens; the estimate is
+    reconciled with the actual usage when the slot is released.
+
+    With adaptive concurrency, the window starts at initial_concurrency and the outcome and
+    latency of each request adjust it between MIN_CONCURRENCY_WINDOW and max_concurrency;
+    otherwise the window is max_concurrency.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = LLMSchedulerConstants.DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: Optional[float] = LLMSchedulerConstants.DEFAULT_TOKENS_PER_MINUTE,
+                 max_concurrency: int = LLMSchedulerConstants.DEFAULT_MAX_CONCURRENCY,
+                 adaptive: bool = LLMSchedulerConstants.ADAPTIVE_CONCURRENCY,
+                 initial_concurrency: int = LLMSchedulerConstants.DEFAULT_INITIAL_CONCURRENCY):
+        """
+        Initialize the scheduler.
+
+        Args:
+            requests_per_minute: Maximum number of requests per minute (None for no limit).
+            tokens_per_minute: Maximum number of tokens per minute (None for no limit).
+            max_concurrency: Maximum number of requests in flight (the ceiling of the adaptive window).
+            adaptive: Whether to adapt the concurrency window to the provider (AIMD).
+            initial_concurrency: Starting size of the adaptive window, capped at max_concurrency.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.adaptive = adaptive
+        self.initial_concurrency = max(LLMSchedulerConstants.MIN_CONCURRENCY_WINDOW,
+                                       min(initial_concurrency, max_concurrency))
+        self.window = float(self.initial_concurrency if adaptive else max_concurrency)
+        self._latency_average = None
+        self._latency_samples = 0
+        self._last_decrease = float("-inf")
+        self.window_decreases = 0
+        self._request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._condition = threading.Condition()
+        # Async requests waiting for a free slot, in arrival order, as (event loop, future)
+        self._waiters = deque()
+        # Waiters woken by release() that have not taken their slot yet
+        self._pending_wakeups = 0
+        self.in_flight = 0
+        self._paused_until = 0.0
+
+        self.requests = 0
+        self.wait_seconds = 0.0
+        self.pauses = 0
+
+    def _try_acquire(self, tokens: int) -> Optional[float]:
+        """
+        Try to take a slot; must be called with the condition held.
+
+        Returns:
+            0 if the slot was taken, the time to wait for the budgets (or the end of a pause)
+            otherwise, or None if the concurrency cap is reached (wait for a release).
+        """
+        paused = self._paused_until - time.monotonic()
+        if paused > 0:
+            return paused
+        if self.in_flight >= int(self.window):
+            return None
+        wait = 0.0
+        if self._request_bucket is not None:
+            wait = max(wait, self._request_bucket.wait_time(1))
+        if self._token_bucket is not None:
+            wait = max(wait, self._token_bucket.wait_time(tokens))
+        if wait > 0:
+            return wait
+        if self._request_bucket is not None:
+            self._request_bucket.consume(1)
+        if self._token_bucket is not None:
+            self._token_bucket.consume(tokens)
+        self.in_flight += 1
+        self.requests += 1
+        return 0.0
+
+    def acquire(self, tokens: int):
+        """
+        Block the calling thread until a slot is granted.
+
+        Args:
+            tokens: The estimated number of tokens of the request.
+        """
+        start = time.monotonic()
+        with self._condition:
+            while True:
+                wait = self._try_acquire(tokens)
+                if wait == 0:
+                    break
+                self._condition.wait(wait)
+            self.wait_seconds += time.monotonic() - start
+
+    def try_acquire(self, tokens: int) -> bool:
+        """
+        Take a slot only if one is free now, without waiting.
+
+        Requests already queued for a slot keep their priority: no slot is taken while async
+        requests are waiting.
+
+        Args:
+            tokens: The estimated number of tokens of the request.
+
+        Returns:
+            Whether the slot was taken (it must then be released with release()).
+        """
+        with self._condition:
+            if self._waiters:
+                return False
+            return self._try_acquire(tokens) == 0
+
+    async def aacquire(self, tokens: int):
+        """
+        Wait on the running event loop until a slot is granted.
+
+        A request blocked by the concurrency cap waits on a future, in FIFO order, which release()
+        resolves when a slot frees up; one waiting for the budgets or the end of a pause sleeps for
+        exactly that long. The loop never polls.
+
+        Args:
+            tokens: The estimated number of tokens of the request.
+        """
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        woken = False
+        while True:
+            waiter = None
+            with self._condition:
+                if woken:
+                    self._pending_wakeups -= 1
+                    woken = False
+                wait = self._try_acquire(tokens)
+                if wait == 0:
+                    self.wait_seconds += time.monotonic() - start
+                    return
+                if wait is None:
+                    waiter = (loop, loop.create_future())
+                    self._waiters.append(waiter)
+            if waiter is None:
+                await asyncio.sleep(wait)
+                continue
+            future = waiter[1]
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self._condition:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+                    elif not future.cancelled():
+                        # Cancelled after being woken: hand the free slot to the next waiter
+                        self._pending_wakeups -= 1
+                        self._wake_waiters()
+                raise
+            woken = True
+
+    def _wake_waiters(self):
+        """
+        Wake the oldest async requests waiting for a slot, one per free slot; must be called with the condition held.
+        """
+        while self._waiters and self.in_flight + self._pending_wakeups < int(self.window):
+            loop, future = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(self._resolve_waiter, future)
+            except RuntimeError:
+                # The waiter's event loop is closed
+                continue
+            self._pending_wakeups += 1
+
+    def _resolve_waiter(self, future: asyncio.Future):
+        """Resolve a waiter's future on its event loop, or pass the slot on if the waiter was cancelled."""
+        if not future.done():
+            future.set_result(None)
+            return
+        with self._condition:
+            self._pending_wakeups -= 1
+            self._wake_waiters()
+
+    def release(self, estimated_tokens: int = 0, actual_tokens: Optional[int] = None,
+                latency: Optional[float] = None, error: Optional[BaseException] = None):
+        """
+        Release a slot, reconciling the token budget with the actual usage of the request.
+
+        Args:
+            estimated_tokens: The estimate the slot was acquired with.
+            actual_tokens: The actual number of tokens used, if known.
+            latency: The time the slot was held, if known.
+            error: The error of the request, if it failed.
+        """
+        decrease = None
+        with self._condition:
+            self.in_flight -= 1
+            if self._token_bucket is not None and actual_tokens is not None:
+                self._token_bucket.tokens -= actual_tokens - estimated_tokens
+            if self.adaptive and (latency is not None or error is not None):
+                decrease = self._adapt(latency, error)
+            self._condition.notify_all()
+            self._wake_waiters()
+        if decrease is not None:
+            instrumentation = get_instrumentation()
+            if instrumentation is not None:
+                instrumentation.emit("concurrency_window", window=self.window, reason=decrease)
+
+    def _adapt(self, latency: Optional[float], error: Optional[BaseException]) -> Optional[str]:
+        """
+        Adjust the concurrency window to the outcome of a request; must be called with the condition held.
+
+        Returns:
+            The reason of a decrease of the window ("overload" or "latency"), or None.
+        """
+        if error is not None:
+            # Lazy import: the retry module depends on the scheduler
+            from src.utils.llm_retry import is_retryable
+
+            if not is_retryable(error):
+                return None
+            reason = "overload"
+        else:
+            spike = (self._latency_samples >= LLMSchedulerConstants.MIN_LATENCY_SAMPLES
+                     and latency > LLMSchedulerConstants.LATENCY_SPIKE_FACTOR * self._latency_average)
+            alpha = LLMSchedulerConstants.LATENCY_EWMA_ALPHA
+            self._latency_average = latency if self._latency_average is None else \
+                (1 - alpha) * self._latency_average + alpha * latency
+            self._latency_samples += 1
+            if not spike:
+                # Additive increase: about one more slot per window of successful requests
+                self.window = min(float(self.max_concurrency), self.window + 1 / self.window)
+                return None
+            reason = "latency"
+
+        # Multiplicative decrease, once per congestion event (requests failing together count once)
+        now = time.monotonic()
+        if now - self._last_decrease < (self._latency_average or 0.0):
+            return None
+        self._last_decrease = now
+        self.window = max(float(LLMSchedulerConstants.MIN_CONCURRENCY_WINDOW),
+                          self.window * LLMSchedulerConstants.WINDOW_DECREASE_FACTOR)
+        self.window_decreases += 1
+        return reason
+
+    def pause(self, seconds: float):
+        """
+        Hold back every new request for a while; the requests in flight are not affected.
+
+        Args:
+            seconds: Duration of the pause (an ongoing longer pause is kept).
+        """
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.pauses += 1
+
+    @contextmanager
+    def slot(self, estimated_tokens: int):
+        """
+        Hold a slot for the duration of a blocking request.
+
+        Args:
+            estimated_tokens: The estimated number of tokens of the request.
+
+        Yields:
+            A dictionary where the caller can store the actual usage under "tokens".
+        """
+        self.acquire(estimated_tokens)
+        usage = {"tokens": None}
+        start = time.monotonic()
+        error = None
+        try:
+            yield usage
+        except BaseException as exception:
+            error = exception
+            raise
+        finally:
+            self.release(estimated_tokens, usage["tokens"], time.monotonic() - start, error)
+
+    @asynccontextmanager
+    async def aslot(self, estimated_tokens: int):
+        """
+        Async counterpart of slot.
+
+        Args:
+            estimated_tokens: The estimated number of tokens of the request.
+
+        Yields:
+            A dictionary where the caller can store the actual usage under "tokens".
+        """
+        await self.aacquire(estimated_tokens)
+        usage = {"tokens": None}
+        start = time.monotonic()
+        error = None
+        try:
+            yield usage
+        except BaseException as exception:
+            error = exception
+            raise
+        finally:
+            self.release(estimated_tokens, usage["tokens"], time.monotonic() - start, error)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the scheduler counters."""
+        with self._condition:
+            return {
+                "requests": self.requests,
+                "in_flight": self.in_flight,
+                "wait_seconds": self.wait_seconds,
+                "pauses": self.pauses,
+                "paused_seconds": max(0.0, self._paused_until - time.monotonic()),
+                "max_concurrency": self.max_concurrency,
+                "adaptive": self.adaptive,
+                "window": self.window,
+                "window_decreases": self.window_decreases,
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+            }
+
+
+def configure_scheduler(requests_per_minute: Optional[float] = LLMSchedulerConstants.DEFAULT_REQUESTS_PER_MINUTE,
+                        tokens_per_minute: Optional[float] = LLMSchedulerConstants.DEFAULT_TOKENS_PER_MINUTE,
+                        max_concurrency: int = LLMSchedulerConstants.DEFAULT_MAX_CONCURRENCY,
+                        adaptive: bool = LLMSchedulerConstants.ADAPTIVE_CONCURRENCY,
+                        initial_concurrency: int = LLMSchedulerConstants.DEFAULT_INITIAL_CONCURRENCY) -> LLMScheduler:
+    """
+    Replace the process-wide scheduler.
+
+    Args:
+        requests_per_minute: Maximum number of requests per minute (None for no limit).
+        tokens_per_minute: Maximum number of tokens per minute (None for no limit).
+        max_concurrency: Maximum number of requests in flight (the ceiling of the adaptive window).
+        adaptive: Whether to adapt the concurrency window to the provider (AIMD).
+        initial_concurrency: Starting size of the adaptive window, capped at max_concurrency.
+
+    Returns:
+        The new scheduler.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = LLMScheduler(requests_per_minute, tokens_per_minute, max_concurrency, adaptive,
+                                  initial_concurrency)
+    return _scheduler
+
+
+def get_scheduler() -> LLMScheduler:
+    """Get the process-wide scheduler, creating it with the default budgets on first use."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = LLMScheduler()
+    return _scheduler
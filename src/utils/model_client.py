@@ -1,60 +1,650 @@
 """
 Client for interacting with language models.
+
+The Together clients are created lazily on the first LLM call and shared by the whole process,
+so importing this module (and the augmenters that use it) neither loads the SDK nor needs an
+API key. All the requests of the process share one HTTP connection pool, and go through the
+process-wide LLMScheduler (see src/utils/llm_scheduler.py).
+
+Responses can be cached on disk with configure_response_cache, so re-runs on the same data do
+not issue the same requests again. Identical requests that are in flight at the same time are
+coalesced: the later callers wait for the response of the first one instead of sending their own.
+Failed requests are retried by the process-wide RetryPolicy (see src/utils/llm_retry.py), and
+surface as LLMError subclasses once the retries are used up. Slow requests can be hedged with
+a duplicate request (see src/utils/llm_hedging.py).
+
+configure_provider("fake") swaps the Together clients for the deterministic FakeLLM (see
+src/utils/fake_llm.py), so the pipeline can be load-tested without an API key or network.
 """
+import asyncio
+import concurrent.futures
+import hashlib
+import json
 import os
-from typing import List, Dict
-from together import Together
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, List, Dict, Optional
+
+from src.utils.constants import DEFAULT_LLM_CACHE_FILE, DEFAULT_MODEL, ModelClientConstants, ResponseCacheConstants
+from src.utils.instrumentation import get_instrumentation
+from src.utils.llm_hedging import ahedged, get_hedger, hedged
+from src.utils.llm_retry import LLMError, get_retry_policy
+from src.utils.llm_scheduler import estimate_tokens, get_scheduler
+
+_client_lock = threading.Lock()
+# "together", or "fake" for the offline FakeLLM
+_provider = "together"
+_fake_llm = None
+_pool_size = ModelClientConstants.DEFAULT_POOL_SIZE
+_client = None
+_async_client = None
+_http_session = None
+# aiohttp sessions are bound to an event loop, so the async pool is created per loop
+_aiohttp_session = None
+_aiohttp_session_loop = None
+# Process-wide response cache, disabled unless configured
+_response_cache = None
+# Requests in flight, keyed by request digest and sample index, shared by threads and event loops
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+_sent_requests = 0
+_coalesced_requests = 0
+
+
+class ResponseCacheMissError(LLMError, LookupError):
+    """Raised in replay-only mode when a request has no cached response."""
+
+
+class ResponseCache:
+    """
+    Content-addressed SQLite cache of LLM responses.
+
+    Entries are keyed by the model name, the full message list and the sampling parameters.
+    Up to samples_per_key responses are stored per key: while fewer are stored, every other call
+    is a miss that adds a new sample, then calls cycle through the stored samples, so repeated
+    calls of sampling-based augmenters keep getting distinct answers. Entries expire after
+    ttl_seconds, and the least recently used entries are evicted beyond max_entries. The read
+    position of each key is kept in memory for the MAX_READ_POSITIONS most recently read keys;
+    a key whose position was dropped starts again from its first sample.
+    """
+
+    def __init__(self, path: str = DEFAULT_LLM_CACHE_FILE,
+                 ttl_seconds: Optional[float] = ResponseCacheConstants.DEFAULT_TTL_SECONDS,
+                 max_entries: Optional[int] = ResponseCacheConstants.DEFAULT_MAX_ENTRIES,
+                 samples_per_key: int = ResponseCacheConstants.DEFAULT_SAMPLES_PER_KEY,
+                 replay_only: bool = False):
+        """
+        Initialize the cache.
+
+        Args:
+            path: Path of the SQLite file.
+            ttl_seconds: Time to live of the entries (None for no expiry).
+            max_entries: Maximum number of stored responses (None for no limit).
+            samples_per_key: Number of distinct responses stored per request.
+            replay_only: If True, requests without a cached response raise ResponseCacheMissError
+                instead of being sent, for deterministic re-runs.
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.samples_per_key = samples_per_key
+        self.replay_only = replay_only
+        self._lock = threading.Lock()
+        self._reads = OrderedDict()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT NOT NULL, sample INTEGER NOT NULL, value TEXT NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (key, sample))")
+        self._connection.commit()
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def make_key(model_name: str, messages: List[Dict[str, str]], params: Dict[str, Any] = None) -> str:
+        """
+        Build the key of a request.
+
+        Args:
+            model_name: Name of the model
+            messages: List of message dictionaries with 'role' and 'content' keys
+            params: Sampling parameters of the request
+
+        Returns:
+            Hex digest of the request
+        """
+        request = {"model": model_name, "messages": messages, "params": params or {}}
+        return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Get the next cached response of a request.
+
+        Args:
+            key: The request key (see make_key)
+
+        Returns:
+            The cached response, or None if a new response should be generated
+        """
+        with self._lock:
+            cutoff = time.time() - self.ttl_seconds if self.ttl_seconds is not None else float("-inf")
+            rows = self._connection.execute(
+                "SELECT sample, value FROM responses WHERE key = ? AND created >= ? ORDER BY sample",
+                (key, cutoff)).fetchall()
+            n_reads = self._reads.get(key, 0)
+            if rows and (n_reads < len(rows) or len(rows) >= self.samples_per_key or self.replay_only):
+                sample, value = rows[n_reads % len(rows)]
+                self._advance_read(key)
+                self._connection.execute("UPDATE responses SET accessed = ? WHERE key = ? AND sample = ?",
+                                         (time.time(), key, sample))
+                self._connection.commit()
+                self.hits += 1
+                return value
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: str):
+        """
+        Store a new response of a request.
+
+        Args:
+            key: The request key (see make_key)
+            value: The response text
+        """
+        with self._lock:
+            now = time.time()
+            cutoff = now - self.ttl_seconds if self.ttl_seconds is not None else float("-inf")
+            # Expired samples of the key are replaced
+            self._connection.execute("DELETE FROM responses WHERE key = ? AND created < ?", (key, cutoff))
+            (n_samples,) = self._connection.execute("SELECT COUNT(*) FROM responses WHERE key = ?", (key,)).fetchone()
+            sample = n_samples % self.samples_per_key
+            self._connection.execute("INSERT OR REPLACE INTO responses (key, sample, value, created, accessed) "
+                                     "VALUES (?, ?, ?, ?, ?)", (key, sample, value, now, now))
+            self._connection.commit()
+            self._advance_read(key)
+            self._puts += 1
+            if self._puts % ResponseCacheConstants.EVICTION_INTERVAL == 0:
+                self._evict()
+
+    def _advance_read(self, key: str):
+        """Count a read of a key, dropping the least recently read keys beyond MAX_READ_POSITIONS."""
+        self._reads[key] = self._reads.pop(key, 0) + 1
+        while len(self._reads) > ResponseCacheConstants.MAX_READ_POSITIONS:
+            self._reads.popitem(last=False)
+
+    def _evict(self):
+        """Delete the expired entries and the least recently used ones beyond max_entries."""
+        deleted = 0
+        if self.ttl_seconds is not None:
+            deleted += self._connection.execute("DELETE FROM responses WHERE created < ?",
+                                                (time.time() - self.ttl_seconds,)).rowcount
+        if self.max_entries is not None:
+            (n_entries,) = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+            if n_entries > self.max_entries:
+                deleted += self._connection.execute(
+                    "DELETE FROM responses WHERE rowid IN "
+                    "(SELECT rowid FROM responses ORDER BY accessed LIMIT ?)",
+                    (n_entries - self.max_entries,)).rowcount
+        self._connection.commit()
+        self.evictions += deleted
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cache counters and the number of stored responses."""
+        with self._lock:
+            (n_entries,) = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": n_entries}
+
+    def close(self):
+        """Close the SQLite file."""
+        with self._lock:
+            self._connection.close()
+
+
+def configure_response_cache(path: Optional[str] = DEFAULT_LLM_CACHE_FILE,
+                             ttl_seconds: Optional[float] = ResponseCacheConstants.DEFAULT_TTL_SECONDS,
+                             max_entries: Optional[int] = ResponseCacheConstants.DEFAULT_MAX_ENTRIES,
+                             samples_per_key: int = ResponseCacheConstants.DEFAULT_SAMPLES_PER_KEY,
+                             replay_only: bool = False) -> Optional[ResponseCache]:
+    """
+    Enable (or, with path=None, disable) the process-wide response cache.
+
+    Args:
+        path: Path of the SQLite file, or None to disable caching.
+        ttl_seconds: Time to live of the entries (None for no expiry).
+        max_entries: Maximum number of stored responses (None for no limit).
+        samples_per_key: Number of distinct responses stored per request.
+        replay_only: If True, requests without a cached response raise ResponseCacheMissError.
+
+    Returns:
+        The response cache, or None if caching is disabled.
+    """
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+    _response_cache = ResponseCache(path, ttl_seconds, max_entries, samples_per_key, replay_only) if path else None
+    return _response_cache
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Get the process-wide response cache, or None if caching is disabled."""
+    return _response_cache
+
+
+def lookup_response(model_name: str, messages: List[Dict[str, str]],
+                    params: Dict[str, Any] = None) -> tuple:
+    """
+    Look up a request in the process-wide response cache.
+
+    Args:
+        model_name: Name of the model
+        messages: List of message dictionaries with 'role' and 'content' keys
+        params: Sampling parameters of the request
+
+    Returns:
+        The cache key (None if caching is disabled) and the cached response (None on a miss)
+
+    Raises:
+        ResponseCacheMissError: In replay-only mode, if the request has no cached response.
+    """
+    cache = _response_cache
+    if cache is None:
+        return None, None
+    key = cache.make_key(model_name, messages, params)
+    cached = cache.get(key)
+    if cached is None and cache.replay_only:
+        raise ResponseCacheMissError(f"No cached response for a request to {model_name} (replay-only mode)",
+                                     model_name, 0)
+    return key, cached
+
+
+def store_response(key: Optional[str], value: str):
+    """Store a response in the process-wide response cache, if the request was looked up in it."""
+    if key is not None and _response_cache is not None:
+        _response_cache.put(key, value)
+
+
+def _join_or_lead(model_name: str, messages: List[Dict[str, str]], params: Dict[str, Any], sample: int) -> tuple:
+    """
+    Register a request in flight, or find the identical request already in flight.
+
+    Returns:
+        The in-flight key, the future of the request and whether the caller must send it
+    """
+    global _sent_requests, _coalesced_requests
+    key = (ResponseCache.make_key(model_name, messages, params), sample)
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        if future is not None:
+            _coalesced_requests += 1
+            leader = False
+        else:
+            future = concurrent.futures.Future()
+            _in_flight[key] = future
+            _sent_requests += 1
+            leader = True
+    if not leader:
+        instrumentation = get_instrumentation()
+        if instrumentation is not None:
+            instrumentation.record_llm_event(model_name, "coalesced")
+    return key, future, leader
+
+
+def _settle(key: tuple, future: concurrent.futures.Future, result: Any = None, error: BaseException = None):
+    """Remove a request from the in-flight table and hand its outcome to the coalesced callers."""
+    with _in_flight_lock:
+        _in_flight.pop(key, None)
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
 
-import together
-from dotenv import load_dotenv
 
-from src.utils.constants import DEFAULT_MODEL
+def single_flight(model_name: str, messages: List[Dict[str, str]], params: Dict[str, Any],
+                  request: Callable[[], str], sample: int = 0) -> str:
+    """
+    Send a request, unless an identical one is in flight, in which case wait for its response.
 
-# Load environment variables from .env file
-load_dotenv()
+    Args:
+        model_name: Name of the model
+        messages: List of message dictionaries with 'role' and 'content' keys
+        params: Sampling parameters of the request
+        request: Callable sending the request and returning the response text
+        sample: Index of the independent sample requested; only requests with the same index
+            are coalesced, so callers asking for several samples of the same messages get them
+
+    Returns:
+        The response text
+    """
+    key, future, leader = _join_or_lead(model_name, messages, params, sample)
+    if not leader:
+        return future.result()
+    try:
+        result = request()
+    except BaseException as error:
+        _settle(key, future, error=error)
+        raise
+    _settle(key, future, result)
+    return result
 
-# Get API key from environment
-API_KEY = os.getenv("TOGETHER_API_KEY")
 
-# Initialize the Together client
-together.api_key = API_KEY
-client = Together()
+async def asingle_flight(model_name: str, messages: List[Dict[str, str]], params: Dict[str, Any],
+                         request: Callable[[], Awaitable[str]], sample: int = 0) -> str:
+    """
+    Async counterpart of single_flight; async and blocking callers are coalesced together.
 
+    Args:
+        model_name: Name of the model
+        messages: List of message dictionaries with 'role' and 'content' keys
+        params: Sampling parameters of the request
+        request: Coroutine function sending the request and returning the response text
+        sample: Index of the independent sample requested
 
-def get_model_response(messages: List[Dict[str, str]], model_name: str = DEFAULT_MODEL) -> str:
+    Returns:
+        The response text
+    """
+    key, future, leader = _join_or_lead(model_name, messages, params, sample)
+    if not leader:
+        return await asyncio.wrap_future(future)
+    try:
+        result = await request()
+    except BaseException as error:
+        _settle(key, future, error=error)
+        raise
+    _settle(key, future, result)
+    return result
+
+
+def get_client_stats() -> Dict[str, Any]:
+    """Return the counters of the requests sent, coalesced, retried, hedged and failed by the model client."""
+    with _in_flight_lock:
+        stats = {"sent": _sent_requests, "coalesced": _coalesced_requests, "in_flight": len(_in_flight)}
+    stats.update(get_retry_policy().stats())
+    stats["concurrency_window"] = get_scheduler().stats()["window"]
+    hedger = get_hedger()
+    if hedger is not None:
+        stats["hedging"] = hedger.stats()
+    return stats
+
+
+def configure_client(pool_size: int = ModelClientConstants.DEFAULT_POOL_SIZE):
+    """
+    Set the size of the HTTP connection pool, e.g. to the concurrency of the pipeline.
+
+    Clients that were already created are discarded and recreated on the next call.
+
+    Args:
+        pool_size: Maximum number of connections kept open to the API
+    """
+    global _pool_size, _client, _async_client, _http_session
+    with _client_lock:
+        _pool_size = pool_size
+        _client = None
+        _async_client = None
+        if _http_session is not None:
+            _http_session.close()
+            _http_session = None
+
+
+def configure_provider(provider: str = "together", **fake_options):
+    """
+    Select the provider the LLM requests are sent to.
+
+    Args:
+        provider: "together", or "fake" for the deterministic offline provider.
+        **fake_options: Options of the FakeLLM (latency_median, latency_sigma, failure_rate,
+            failure_status, retry_after, seed).
+    """
+    global _provider, _fake_llm
+    if provider not in ("together", "fake"):
+        raise ValueError(f"Unknown provider: {provider}. Must be 'together' or 'fake'.")
+    with _client_lock:
+        _provider = provider
+        if provider == "fake":
+            from src.utils.fake_llm import FakeLLM
+
+            _fake_llm = FakeLLM(**fake_options)
+        else:
+            _fake_llm = None
+
+
+def get_provider() -> str:
+    """Get the name of the provider the LLM requests are sent to."""
+    return _provider
+
+
+def _request_model(model_name: str) -> str:
+    """Name of the model in the cache and in-flight keys, so fake responses never mix with real ones."""
+    return model_name if _provider == "together" else f"{_provider}:{model_name}"
+
+
+def _load_api_key():
+    """Load the environment variables from the .env file and configure the Together SDK."""
+    import together
+    from dotenv import load_dotenv
+
+    # Load environment variables from .env file
+    load_dotenv()
+    together.api_key = os.getenv("TOGETHER_API_KEY")
+
+
+def get_client():
+    """
+    Get the process-wide Together client, creating it on the first call.
+
+    Returns:
+        The Together client (or the FakeLLM, if it is the selected provider)
+    """
+    global _client, _http_session
+    if _fake_llm is not None:
+        return _fake_llm
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import requests
+                import together
+                from together import Together
+
+                _load_api_key()
+                # One pooled session shared by all threads, instead of one session per thread
+                _http_session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=_pool_size, pool_maxsize=_pool_size)
+                _http_session.mount("https://", adapter)
+                _http_session.mount("http://", adapter)
+                together.requestssession = _http_session
+                # Retries are handled by the RetryPolicy, outside of the scheduler slots
+                _client = Together(max_retries=0)
+    return _client
+
+
+def get_async_client():
+    """
+    Get the process-wide async Together client, creating it on the first call.
+
+    Returns:
+        The AsyncTogether client (or the async FakeLLM client, if it is the selected provider)
+    """
+    global _async_client
+    if _fake_llm is not None:
+        return _fake_llm.async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                from together import AsyncTogether
+
+                _load_api_key()
+                _async_client = AsyncTogether(max_retries=0)
+    return _async_client
+
+
+def _use_aiohttp_session():
+    """Make the async requests of the current task use the pooled aiohttp session of the running loop."""
+    global _aiohttp_session, _aiohttp_session_loop
+    if _fake_llm is not None:
+        return
+    import aiohttp
+    import together
+
+    loop = asyncio.get_running_loop()
+    if _aiohttp_session_loop is not loop or _aiohttp_session is None or _aiohttp_session.closed:
+        _aiohttp_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=_pool_size))
+        _aiohttp_session_loop = loop
+    together.aiosession.set(_aiohttp_session)
+
+
+async def aclose_client():
+    """Close the pooled aiohttp session of the running event loop, if any."""
+    global _aiohttp_session, _aiohttp_session_loop
+    if _aiohttp_session is not None and _aiohttp_session_loop is asyncio.get_running_loop():
+        await _aiohttp_session.close()
+        _aiohttp_session = None
+        _aiohttp_session_loop = None
+
+
+def record_usage(model_name: str, response, usage: Dict = None):
+    """
+    Record the token usage of a response in the process-wide instrumentation, if any.
+
+    Args:
+        model_name: Name of the model
+        response: The chat completion response
+        usage: Optional scheduler slot usage receiving the actual number of tokens
+    """
+    if getattr(response, "usage", None) is None:
+        return
+    prompt_tokens = response.usage.prompt_tokens or 0
+    completion_tokens = response.usage.completion_tokens or 0
+    if usage is not None:
+        usage["tokens"] = prompt_tokens + completion_tokens
+    instrumentation = get_instrumentation()
+    if instrumentation is not None:
+        instrumentation.record_llm_usage(model_name, prompt_tokens, completion_tokens)
+
+
+def get_model_response(messages: List[Dict[str, str]], model_name: str = DEFAULT_MODEL, sample: int = 0,
+                       **params) -> str:
     """
     Get a response from the language model.
 
     Args:
         messages: List of message dictionaries with 'role' and 'content' keys
         model_name: Name of the model to use (defaults to the value in constants)
+        sample: Index of the independent sample requested for the same messages (see single_flight)
+        **params: Optional sampling parameters (temperature, max_tokens, ...)
 
     Returns:
         The model's response text
+
+    Raises:
+        LLMError: If the request failed (RetryExhaustedError, CircuitOpenError, ResponseCacheMissError
+            or a rejection by the provider).
     """
-    response = client.chat.completions.create(
-        model=model_name,
-        messages=messages,
-    )
+    key, cached = lookup_response(_request_model(model_name), messages, params)
+    if cached is not None:
+        return cached
 
-    return response.choices[0].message.content
+    def attempt():
+        client = get_client()
+        estimated_tokens = estimate_tokens(messages, params.get("max_tokens"))
+        with get_scheduler().slot(estimated_tokens) as usage:
+            # Hedged inside the slot, so the hedging timer starts when the request is sent
+            response = hedged(lambda: client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                **params,
+            ), model_name, estimated_tokens)
+            record_usage(model_name, response, usage)
+        return response
 
+    def request() -> str:
+        response = get_retry_policy().call(attempt, model_name)
+        content = response.choices[0].message.content
+        store_response(key, content)
+        return content
 
-def get_completion(prompt: str, model_name: str = DEFAULT_MODEL) -> str:
+    return single_flight(_request_model(model_name), messages, params, request, sample)
+
+
+def get_completion(prompt: str, model_name: str = DEFAULT_MODEL, sample: int = 0) -> str:
     """
     Get a completion from the language model using a simple prompt.
-    
+
     Args:
         prompt: The prompt text
         model_name: Name of the model to use
-        
+        sample: Index of the independent sample requested for the same prompt
+
+    Returns:
+        The model's response text
+    """
+    messages = [
+        {"role": "user", "content": prompt}
+    ]
+    return get_model_response(messages, model_name, sample)
+
+
+async def aget_model_response(messages: List[Dict[str, str]], model_name: str = DEFAULT_MODEL, sample: int = 0,
+                              **params) -> str:
+    """
+    Async counterpart of get_model_response.
+
+    Args:
+        messages: List of message dictionaries with 'role' and 'content' keys
+        model_name: Name of the model to use (defaults to the value in constants)
+        sample: Index of the independent sample requested for the same messages (see single_flight)
+        **params: Optional sampling parameters (temperature, max_tokens, ...)
+
+    Returns:
+        The model's response text
+    """
+    key, cached = lookup_response(_request_model(model_name), messages, params)
+    if cached is not None:
+        return cached
+
+    async def attempt():
+        async_client = get_async_client()
+        _use_aiohttp_session()
+        estimated_tokens = estimate_tokens(messages, params.get("max_tokens"))
+        async with get_scheduler().aslot(estimated_tokens) as usage:
+            # Hedged inside the slot, so the hedging timer starts when the request is sent
+            response = await ahedged(lambda: async_client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                **params,
+            ), model_name, estimated_tokens)
+            record_usage(model_name, response, usage)
+        return response
+
+    async def request() -> str:
+        response = await get_retry_policy().acall(attempt, model_name)
+        content = response.choices[0].message.content
+        store_response(key, content)
+        return content
+
+    return await asingle_flight(_request_model(model_name), messages, params, request, sample)
+
+
+async def aget_completion(prompt: str, model_name: str = DEFAULT_MODEL, sample: int = 0) -> str:
+    """
+    Async counterpart of get_completion.
+
+    Args:
+        prompt: The prompt text
+        model_name: Name of the model to use
+        sample: Index of the independent sample requested for the same prompt
+
     Returns:
         The model's response text
     """
     messages = [
         {"role": "user", "content": prompt}
     ]
-    return get_model_response(messages, model_name)
+    return await aget_model_response(messages, model_name, sample)
 
 
 if __name__ == "__main__":
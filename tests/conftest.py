@@ -0,0 +1,23 @@
+"""
+Shared fixtures: every test starts from fresh process-wide LLM state (scheduler, retry policy,
+hedging, response cache and provider), so tests never depend on each other or on the network.
+"""
+import pytest
+
+from src.utils.llm_hedging import configure_hedging
+from src.utils.llm_retry import configure_retry
+from src.utils.llm_scheduler import configure_scheduler
+from src.utils.model_client import configure_provider, configure_response_cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_llm_state():
+    configure_scheduler(requests_per_minute=None, tokens_per_minute=None, adaptive=False)
+    configure_retry()
+    configure_hedging(enabled=False)
+    configure_response_cache(None)
+    yield
+    configure_provider("together")
+    configure_response_cache(None)
+    configure_retry()
+    configure_scheduler()
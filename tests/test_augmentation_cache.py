@@ -0,0 +1,133 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.axis_augmentation.augmentation_cache import AugmentationCache, UncacheableValueError, _entry_size, digest
+from src.axis_augmentation.augmentation_pipeline import AugmentationPipeline
+from src.axis_augmentation.base_augmenter import BaseAxisAugmenter
+
+
+class CountingAugmenter(BaseAxisAugmenter):
+    """Augmenter returning tagged copies of its input and counting its calls."""
+
+    def __init__(self, n_augments=2):
+        super().__init__(n_augments=n_augments)
+        self.calls = 0
+
+    def augment(self, text, identification_data=None):
+        self.calls += 1
+        return [f"{text} #{i}" for i in range(self.n_augments)]
+
+    def get_cache_config(self):
+        return {"n_augments": self.n_augments}
+
+
+def test_digest_is_stable_and_type_tagged():
+    frame = pd.DataFrame({"input": ["a", "b"], "output": ["c", "d"]})
+    value = {"docs": ["x", "y"], "k": 1, "frame": frame, "array": np.arange(3)}
+    assert digest(value) == digest({"array": np.arange(3), "frame": frame.copy(), "k": 1, "docs": ["x", "y"]})
+    assert digest(["1"]) != digest([1])
+    assert digest(("a",)) != digest(["a"])
+
+
+@pytest.mark.parametrize("value", [object(), {"data": object()}, [lambda: None], np.array([object()])])
+def test_values_without_stable_digest_are_uncacheable(value):
+    with pytest.raises(UncacheableValueError):
+        digest(value)
+
+
+def test_pipeline_skips_cache_for_uncacheable_identification_data():
+    augmenter = CountingAugmenter()
+    cache = AugmentationCache()
+    pipeline = AugmentationPipeline(augmenters=[augmenter], cache=cache)
+
+    identification_data = {"handle": object()}
+    first = pipeline.apply_augmenter(augmenter, "text", identification_data)
+    second = pipeline.apply_augmenter(augmenter, "text", identification_data)
+
+    assert first == second == ["text #0", "text #1"]
+    assert augmenter.calls == 2
+    assert cache.stats()["entries"] == 0
+
+
+def test_pipeline_caches_calls_with_digestible_identification_data():
+    augmenter = CountingAugmenter()
+    cache = AugmentationCache()
+    pipeline = AugmentationPipeline(augmenters=[augmenter], cache=cache)
+
+    pipeline.apply_augmenter(augmenter, "text", {"docs": ["a", "b"]})
+    pipeline.apply_augmenter(augmenter, "text", {"docs": ["a", "b"]})
+    pipeline.apply_augmenter(augmenter, "text", {"docs": ["b", "a"]})
+
+    assert augmenter.calls == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_memory_tier_evicts_least_recently_used_beyond_byte_bound():
+    value = ["x" * 100]
+    # Entries are stored as copies, whose footprint is what the bound applies to
+    cache = AugmentationCache(max_memory_bytes=2 * _entry_size(list(value)))
+    cache.put("a", value)
+    cache.put("b", value)
+    assert cache.get("a") == value
+    cache.put("c", value)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == value and cache.get("c") == value
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["memory_bytes"] <= cache.max_memory_bytes
+
+
+def test_memory_tier_skips_entries_larger_than_the_bound():
+    cache = AugmentationCache(max_memory_bytes=_entry_size(["x"]))
+    cache.put("big", ["x" * 1000])
+    assert cache.get("big") is None
+    assert cache.stats()["memory_bytes"] == 0
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "augmentations.sqlite")
+    cache = AugmentationCache(disk_path=path)
+    cache.put("key", ["a", "b"])
+    cache.close()
+
+    reopened = AugmentationCache(disk_path=path)
+    assert reopened.get("key") == ["a", "b"]
+    assert reopened.stats()["disk_hits"] == 1
+    reopened.close()
+
+
+def test_disk_entries_expire_after_ttl(tmp_path):
+    path = str(tmp_path / "augmentations.sqlite")
+    cache = AugmentationCache(disk_path=path, disk_ttl_seconds=0.05)
+    cache.put("key", ["a"])
+    cache.close()
+    time.sleep(0.1)
+
+    reopened = AugmentationCache(disk_path=path, disk_ttl_seconds=0.05)
+    assert reopened.get("key") is None
+    assert reopened.stats()["disk_evictions"] == 1
+    reopened.close()
+
+
+def test_disk_tier_evicts_least_recently_used_beyond_max_entries(tmp_path):
+    path = str(tmp_path / "augmentations.sqlite")
+    cache = AugmentationCache(disk_path=path)
+    for key in ("a", "b", "c"):
+        cache.put(key, [key])
+        time.sleep(0.01)
+    cache.close()
+
+    # Reading "a" from a fresh memory tier refreshes its access time on disk
+    reader = AugmentationCache(disk_path=path)
+    assert reader.get("a") == ["a"]
+    reader.close()
+
+    bounded = AugmentationCache(disk_path=path, max_disk_entries=2)
+    assert bounded.stats()["disk_evictions"] == 1
+    assert bounded.get("b") is None
+    assert bounded.get("a") == ["a"] and bounded.get("c") == ["c"]
+    bounded.close()
@@ -0,0 +1,182 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.utils.fake_llm import FakeLLMError
+from src.utils.llm_retry import (CircuitBreaker, CircuitOpenError, LLMError, RetryExhaustedError, RetryPolicy,
+                                 configure_retry)
+from src.utils.llm_scheduler import get_scheduler
+from src.utils.model_client import configure_provider, get_client, get_model_response
+
+MESSAGES = [{"role": "user", "content": "Name a primary color."}]
+
+
+class FlakyRequest:
+    """Request failing with the given HTTP statuses before succeeding."""
+
+    def __init__(self, *statuses, headers=None):
+        self.statuses = list(statuses)
+        self.headers = headers
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.statuses:
+            raise FakeLLMError("injected", self.statuses.pop(0), self.headers)
+        return "ok"
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_retryable_statuses_are_retried_with_backoff(status):
+    policy = RetryPolicy(max_retries=3, base_delay=0.01, max_delay=0.05)
+    request = FlakyRequest(status, status)
+    assert policy.call(request, "model") == "ok"
+    assert request.calls == 3
+    assert policy.stats()["retries"] == 2
+
+
+@pytest.mark.parametrize("status", [400, 401, 404])
+def test_rejected_requests_are_not_retried(status):
+    policy = RetryPolicy(max_retries=3, base_delay=0.01)
+    request = FlakyRequest(status)
+    with pytest.raises(LLMError) as error:
+        policy.call(request, "model")
+    assert not isinstance(error.value, RetryExhaustedError)
+    assert request.calls == 1
+    assert policy.stats()["errors"] == {"LLMError": 1}
+
+
+def test_retries_are_exhausted():
+    policy = RetryPolicy(max_retries=2, base_delay=0.01, breaker=CircuitBreaker(failure_threshold=100))
+    request = FlakyRequest(503, 503, 503, 503)
+    with pytest.raises(RetryExhaustedError) as error:
+        policy.call(request, "model")
+    assert error.value.attempts == 3
+    assert request.calls == 3
+
+
+def test_errors_from_our_code_are_raised_unchanged():
+    policy = RetryPolicy(max_retries=3, base_delay=0.01)
+
+    def broken():
+        raise KeyError("bug")
+
+    with pytest.raises(KeyError):
+        policy.call(broken, "model")
+
+
+def test_backoff_is_full_jitter_and_capped():
+    policy = RetryPolicy(base_delay=0.5, max_delay=4.0)
+    error = FakeLLMError("injected", 503)
+    for attempt in range(6):
+        delays = [policy.get_delay(attempt, error) for _ in range(200)]
+        assert all(0 <= delay <= min(4.0, 0.5 * 2 ** attempt) for delay in delays)
+    assert max(policy.get_delay(5, error) for _ in range(200)) > 2.0
+
+
+def test_retry_after_header_is_honoured():
+    policy = RetryPolicy(max_delay=10.0)
+    assert policy.get_delay(0, FakeLLMError("injected", 429, {"retry-after": "2"})) == 2.0
+    assert policy.get_delay(0, FakeLLMError("injected", 429, {"retry-after-ms": "250"})) == 0.25
+    assert policy.get_delay(0, FakeLLMError("injected", 429, {"retry-after": "60"})) == 10.0
+
+
+def test_async_retries():
+    policy = RetryPolicy(max_retries=3, base_delay=0.01)
+    request = FlakyRequest(503)
+
+    async def attempt():
+        return request()
+
+    assert asyncio.run(policy.acall(attempt, "model")) == "ok"
+    assert request.calls == 2
+
+
+def test_breaker_opens_once_per_burst_and_half_opens_with_one_probe():
+    breaker = CircuitBreaker(failure_threshold=3, cooldown_seconds=0.1)
+    for _ in range(3):
+        breaker.record_failure("model")
+    assert breaker.state == CircuitBreaker.OPEN
+    # Failures of requests sent before the circuit opened do not re-open it
+    for _ in range(10):
+        breaker.record_failure("model")
+    assert breaker.total_openings == 1
+    wait, probe = breaker.admit("model")
+    assert 0 < wait <= 0.1 and not probe
+
+    time.sleep(0.11)
+    assert breaker.admit("model") == (0.0, True)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # While the probe is in flight, the other requests wait
+    wait, probe = breaker.admit("model")
+    assert wait > 0 and not probe
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.admit("model") == (0.0, False)
+
+
+def test_failed_probe_reopens_with_a_longer_cooldown():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=0.05)
+    breaker.record_failure("model")
+    time.sleep(0.06)
+    assert breaker.admit("model") == (0.0, True)
+
+    breaker.record_failure("model", probe=True)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.total_openings == 2
+    wait, _ = breaker.admit("model")
+    assert 0.05 < wait <= 0.1
+
+
+def test_breaker_fails_fast_after_max_openings_but_still_probes():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=0.02, max_openings=1)
+    breaker.record_failure("model")
+    with pytest.raises(CircuitOpenError):
+        breaker.admit("model")
+
+    time.sleep(0.03)
+    assert breaker.admit("model") == (0.0, True)
+    breaker.record_success()
+    assert breaker.admit("model") == (0.0, False)
+
+
+def test_abandoned_probe_lets_another_request_probe():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=0.01)
+    breaker.record_failure("model")
+    time.sleep(0.02)
+    assert breaker.admit("model") == (0.0, True)
+    breaker.abandon_probe()
+    assert breaker.admit("model") == (0.0, True)
+
+
+def test_breaker_opens_and_recovers_with_the_fake_provider():
+    configure_provider("fake", latency_median=0.05, latency_sigma=0, failure_rate=1.0, failure_status=503)
+    policy = configure_retry(max_retries=0, failure_threshold=3, cooldown_seconds=0.2)
+    provider = get_client()
+
+    # A burst of concurrent failures (all sent before the first one returns) opens the circuit
+    # once and pauses the scheduler
+    with ThreadPoolExecutor(6) as executor:
+        futures = [executor.submit(get_model_response, [{"role": "user", "content": f"question {i}"}], "model")
+                   for i in range(6)]
+        for future in futures:
+            with pytest.raises(RetryExhaustedError):
+                future.result()
+    assert policy.breaker.total_openings == 1
+    assert policy.stats()["circuit_state"] != CircuitBreaker.CLOSED
+    assert get_scheduler().stats()["pauses"] == 1
+
+    # The provider recovers: after the cooldown, the probe succeeds and closes the circuit
+    provider.failure_rate = 0.0
+    start = time.monotonic()
+    assert get_model_response(MESSAGES, "model")
+    assert time.monotonic() - start < 1.0
+    assert policy.stats()["circuit_state"] == CircuitBreaker.CLOSED
+    assert policy.breaker.total_openings == 1
+
+    requests = provider.requests
+    get_model_response([{"role": "user", "content": "another question"}], "model")
+    assert provider.requests == requests + 1
@@ -0,0 +1,48 @@
+import random
+from collections import Counter
+
+from src.axis_augmentation.augmentation_pipeline import AugmentationPipeline, reservoir_sample
+from src.axis_augmentation.text_surface_augmenter import TextSurfaceAugmenter
+
+
+def test_short_streams_are_returned_whole_in_order():
+    assert reservoir_sample(iter(["a", "b", "c"]), 5, random.Random(0)) == ["a", "b", "c"]
+    assert reservoir_sample(iter([]), 5, random.Random(0)) == []
+
+
+def test_sample_size_is_bounded_and_without_repeats():
+    sample = reservoir_sample((str(i) for i in range(1000)), 10, random.Random(0))
+    assert len(sample) == 10
+    assert len(set(sample)) == 10
+
+
+def test_every_item_is_equally_likely_to_be_kept():
+    n_items, k, trials = 10, 3, 20000
+    rng = random.Random(0)
+    kept = Counter()
+    first = Counter()
+    for _ in range(trials):
+        sample = reservoir_sample(range(n_items), k, rng)
+        kept.update(sample)
+        first[sample[0]] += 1
+
+    # Each item is kept with probability k / n_items, and the sample order is shuffled
+    for item in range(n_items):
+        assert abs(kept[item] / trials - k / n_items) < 0.02
+        assert abs(first[item] / trials - 1 / n_items) < 0.015
+
+
+def test_sampling_is_deterministic_under_a_seed():
+    items = [f"variation {i}" for i in range(100)]
+    assert reservoir_sample(items, 7, random.Random(42)) == reservoir_sample(items, 7, random.Random(42))
+    assert reservoir_sample(items, 7, random.Random(42)) != reservoir_sample(items, 7, random.Random(43))
+
+
+def test_seeded_pipelines_sample_the_same_variations():
+    def run():
+        pipeline = AugmentationPipeline(augmenters=[TextSurfaceAugmenter(n_augments=5)], max_variations=3, seed=7)
+        return pipeline.augment("What is the capital of France? Answer in one word, please.")
+
+    first = run()
+    assert len(first) == 3
+    assert run() == first
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.utils.model_client import (aget_model_response, asingle_flight, configure_provider, get_client,
+                                    get_client_stats, get_model_response, single_flight)
+
+MESSAGES = [{"role": "user", "content": "What is the capital of France?"}]
+N_CALLERS = 8
+
+
+def wait_for_coalesced(count, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while get_client_stats()["coalesced"] < count:
+        assert time.monotonic() < deadline, "callers were not coalesced in time"
+        time.sleep(0.001)
+
+
+def test_concurrent_identical_requests_make_one_upstream_call():
+    calls = []
+    release = threading.Event()
+    before = get_client_stats()["coalesced"]
+
+    def request():
+        calls.append(1)
+        release.wait(5)
+        return "Paris"
+
+    with ThreadPoolExecutor(N_CALLERS) as executor:
+        futures = [executor.submit(single_flight, "model", MESSAGES, {}, request) for _ in range(N_CALLERS)]
+        wait_for_coalesced(before + N_CALLERS - 1)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert results == ["Paris"] * N_CALLERS
+    assert len(calls) == 1
+    assert get_client_stats()["in_flight"] == 0
+
+
+def test_errors_are_shared_and_not_cached():
+    release = threading.Event()
+    before = get_client_stats()["coalesced"]
+
+    def failing():
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    with ThreadPoolExecutor(4) as executor:
+        futures = [executor.submit(single_flight, "model", MESSAGES, {}, failing) for _ in range(4)]
+        wait_for_coalesced(before + 3)
+        release.set()
+        for future in futures:
+            with pytest.raises(RuntimeError, match="boom"):
+                future.result()
+
+    # The failed request left the in-flight table, so the next call is sent again
+    assert single_flight("model", MESSAGES, {}, lambda: "Paris") == "Paris"
+
+
+def test_fake_provider_receives_one_request_per_distinct_sample():
+    configure_provider("fake", latency_median=0.2, latency_sigma=0)
+    provider = get_client()
+
+    with ThreadPoolExecutor(N_CALLERS) as executor:
+        results = list(executor.map(lambda sample: get_model_response(MESSAGES, "model", sample=sample),
+                                    [0] * N_CALLERS + [1]))
+
+    assert len(set(results[:N_CALLERS])) == 1
+    assert provider.requests == 2
+
+
+def test_async_callers_are_coalesced():
+    configure_provider("fake", latency_median=0.2, latency_sigma=0)
+    provider = get_client()
+
+    async def run():
+        return await asyncio.gather(*[aget_model_response(MESSAGES, "model") for _ in range(N_CALLERS)])
+
+    results = asyncio.run(run())
+    assert len(set(results)) == 1
+    assert provider.requests == 1
+
+
+def test_async_and_blocking_callers_share_one_request():
+    calls = []
+    release = threading.Event()
+    before = get_client_stats()["coalesced"]
+
+    async def request():
+        calls.append(1)
+        await asyncio.to_thread(release.wait, 5)
+        return "Paris"
+
+    async def run():
+        leaders = asyncio.gather(*[asingle_flight("model", MESSAGES, {}, request) for _ in range(3)])
+        follower = asyncio.ensure_future(asyncio.to_thread(single_flight, "model", MESSAGES, {}, lambda: "unused"))
+        await asyncio.to_thread(wait_for_coalesced, before + 3)
+        release.set()
+        return await leaders, await follower
+
+    async_results, blocking_result = asyncio.run(run())
+    assert async_results == ["Paris"] * 3
+    assert blocking_result == "Paris"
+    assert len(calls) == 1
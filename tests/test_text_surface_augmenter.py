@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from src.axis_augmentation.benchmark import make_texts
+from src.axis_augmentation.surface_transforms import encode_texts, keyed_uniforms
+from src.axis_augmentation.text_surface_augmenter import TextSurfaceAugmenter
+
+TEXTS = ["What is the capital of France? Answer: Paris!", "", "a", "Hello, world; how are you?",
+         "Ünïcödé text — with dashes, quotes \"and\" emoji 🙂."] + make_texts(64, 20)
+
+METHODS = {
+    "butter_finger": 0.3,
+    "change_char_case": 0.3,
+    "swap_characters": 0.3,
+    "switch_punctuation": 0.5,
+}
+
+
+@pytest.mark.parametrize("method", sorted(METHODS))
+@pytest.mark.parametrize("seed", [None, 3])
+def test_batch_matches_per_text_outputs(method, seed):
+    augmenter = TextSurfaceAugmenter(seed=0)
+    prob = METHODS[method]
+    batch = getattr(augmenter, f"{method}_batch")(TEXTS, prob=prob, seed=seed, max_outputs=4)
+    single = [getattr(augmenter, method)(text, prob=prob, seed=seed, max_outputs=4) for text in TEXTS]
+    assert batch == single
+
+
+@pytest.mark.parametrize("method", sorted(METHODS))
+def test_outputs_do_not_depend_on_the_rest_of_the_batch(method):
+    augmenter = TextSurfaceAugmenter(seed=0)
+    run = getattr(augmenter, f"{method}_batch")
+    full = run(TEXTS, prob=METHODS[method])
+    reversed_batch = run(TEXTS[::-1], prob=METHODS[method])
+    assert reversed_batch[::-1] == full
+    assert run(TEXTS[:3], prob=METHODS[method]) == full[:3]
+
+
+@pytest.mark.parametrize("method", sorted(METHODS))
+def test_outputs_are_reproducible_and_seeded(method):
+    prob = METHODS[method]
+    first = getattr(TextSurfaceAugmenter(seed=0), f"{method}_batch")(TEXTS, prob=prob)
+    again = getattr(TextSurfaceAugmenter(seed=0), f"{method}_batch")(TEXTS, prob=prob)
+    other = getattr(TextSurfaceAugmenter(seed=1), f"{method}_batch")(TEXTS, prob=prob)
+    assert first == again
+    assert first != other
+
+
+def test_length_preserving_kernels_keep_lengths():
+    augmenter = TextSurfaceAugmenter(seed=0)
+    for method in ("change_char_case", "swap_characters", "switch_punctuation"):
+        for text, outputs in zip(TEXTS, getattr(augmenter, f"{method}_batch")(TEXTS, prob=0.5)):
+            assert all(len(output) == len(text) for output in outputs)
+
+
+def test_keyed_uniforms_are_uniform_and_independent():
+    augmenter = TextSurfaceAugmenter(seed=0)
+    texts = make_texts(50, 500)
+    _, offsets = encode_texts(texts)
+    uniforms = keyed_uniforms(augmenter.get_stream_keys(texts), offsets, 4, 2)
+
+    assert uniforms.shape == (2, 4 * offsets[-1])
+    assert uniforms.min() >= 0 and uniforms.max() < 1
+    assert abs(uniforms.mean() - 0.5) < 0.005
+    assert abs(uniforms.var() - 1 / 12) < 0.002
+    histogram = np.histogram(uniforms[0], bins=10, range=(0, 1))[0] / uniforms.shape[1]
+    assert np.all(np.abs(histogram - 0.1) < 0.005)
+    assert abs(np.corrcoef(uniforms[0], uniforms[1])[0, 1]) < 0.01
+    assert abs(np.corrcoef(uniforms[0][:-1], uniforms[0][1:])[0, 1]) < 0.01